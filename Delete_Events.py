@@ -1,11 +1,12 @@
 import os
 import pickle
 import sys
-from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.errors import HttpError
 
+from calendar_service import build_calendar_service
+
 # --- Configuration ---
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/calendar'] # Read/write access
@@ -53,7 +54,7 @@ def get_calendar_service():
             pickle.dump(creds, token)
 
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service = build_calendar_service(creds) # Bundled discovery document, pooled connection
         print("Successfully connected to Google Calendar API.")
         return service
     except HttpError as error:
@@ -1,24 +1,39 @@
 import os
+import io
 import json # For parsing form data
+import time
+import zipfile
 import re   # Potentially needed if handling complex strings, though utils does it now
 from flask import (
     Flask, request, redirect, url_for, render_template,
-    flash, session, abort, jsonify # Added jsonify for potential API responses
+    flash, session, abort, jsonify, # Added jsonify for potential API responses
+    Response, stream_with_context
 )
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
 # --- Google Auth Imports ---
-import google.oauth2.credentials
-import google_auth_oauthlib.flow
-from google.auth.transport.requests import Request
-from googleapiclient.errors import HttpError
+# google_auth_oauthlib is imported inside the OAuth routes so app startup doesn't pay for it.
 
 # --- Local Imports ---
 # Make sure these files are in the same directory or Python path
-from ocr_script import run_ocr_and_extract, time_slots as default_time_slots
+from ocr_script import run_ocr_and_extract, parse_stats
+from ocr_cache import get_ocr_cache
+from ocr_similarity import get_similarity_index
+from image_preprocess import preprocess_stats
+from image_tiling import tiling_stats
+from slot_validation import slot_validation_stats
+from slot_grids import get_slot_grid_registry
+from ocr_jobs import get_job_manager, QueueFullError, FAILED
+from gemini_limiter import limiter_stats
+from ocr_batch import run_ocr_batch, batch_stats, OCR_BATCH_MAX_IMAGES
+from ocr_backends import backend_stats, token_stats
+from ics_export import iter_ics, ics_stats
+from calendar_outbox import get_calendar_outbox
+from calendar_conflicts import check_plan_conflicts, CALENDAR_CONFLICT_CHECK
 from google_calendar_utils import (
-    get_calendar_service, create_calendar_events,
+    get_calendar_service, create_calendar_events, calendar_stats, calendar_user_key,
+    prefetch_credentials, store_credentials, forget_credentials, get_event_plan, preview_event_plan, parse_date_range,
     CLIENT_SECRET_FILE, SCOPES # Import helper if needed here
 )
 
@@ -45,6 +60,11 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def mime_type_for(filename):
+    """Simple mime type deduction from extension."""
+    ext = filename.rsplit('.', 1)[1].lower()
+    return f'image/{ext}' if ext != 'jpg' else 'image/jpeg'
+
 # credentials_to_dict is now primarily used within google_calendar_utils if needed,
 # but keep it here if used directly in app routes (like OAuth callback)
 def credentials_to_dict(credentials):
@@ -55,7 +75,9 @@ def credentials_to_dict(credentials):
             'token_uri': credentials.token_uri,
             'client_id': credentials.client_id,
             'client_secret': credentials.client_secret,
-            'scopes': credentials.scopes}
+            'scopes': credentials.scopes,
+            # Lets the server-side credential cache refresh ahead of expiry for a new session
+            'expiry': credentials.expiry.strftime('%Y-%m-%dT%H:%M:%SZ') if credentials.expiry else None}
 
 
 # --- Routes ---
@@ -63,11 +85,14 @@ def credentials_to_dict(credentials):
 @app.route('/')
 def index():
     """Renders the main upload page."""
-    return render_template('index.html')
+    registry = get_slot_grid_registry()
+    return render_template('index.html', slot_grids=registry.available(),
+                           selected_slot_grid=session.get('slot_grid') or registry.get().key)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Handles file upload, runs OCR, and redirects to results page."""
+    """Handles file upload, queues a background OCR job, and redirects to the results page."""
+    wants_json = request.accept_mimetypes.best == 'application/json'
     if 'timetable_image' not in request.files:
         flash('No file part selected in the form.', 'warning')
         return redirect(url_for('index'))
@@ -78,6 +103,15 @@ def upload_file():
         flash('No file selected.', 'warning')
         return redirect(url_for('index'))
 
+    # OCR'd slot codes are corrected against the campus/semester timetable chosen here
+    slot_grid_key = request.form.get('slot_grid') or session.get('slot_grid')
+    slot_grid = get_slot_grid_registry().get(slot_grid_key)
+    if slot_grid is None:
+        if wants_json:
+            return jsonify({'error': f"Unknown slot timetable '{slot_grid_key}'."}), 400
+        flash(f"Unknown slot timetable '{slot_grid_key}'. Please choose another one.", 'warning')
+        return redirect(url_for('index'))
+
     if file and allowed_file(file.filename):
         # Secure the filename before using it (though we read bytes directly now)
         filename = secure_filename(file.filename)
@@ -86,37 +120,40 @@ def upload_file():
         try:
             # Read image data directly into memory
             image_data = file.read()
-            # Simple mime type deduction from extension
-            ext = filename.rsplit('.', 1)[1].lower()
-            mime_type = f'image/{ext}' if ext != 'jpg' else 'image/jpeg'
-
-            # --- Run OCR ---
-            print("Starting OCR process...")
-            extracted_data = run_ocr_and_extract(image_data, mime_type=mime_type)
-            # run_ocr_and_extract now returns list or None on critical failure
-
-            print(f"OCR process finished.") # Don't log potentially large data here by default
-
-            if extracted_data is None:
-                 # OCR failed critically (API key issue, safety block, network error after retries)
-                 flash('OCR process failed critically. Check API key, network, or server logs.', 'danger')
-                 # Clear any potential stale data from previous attempts
-                 session.pop('extracted_data', None)
-                 return redirect(url_for('index'))
-            else:
-                 # OCR completed, result is a list (potentially empty)
-                 session['extracted_data'] = extracted_data # Store list (even if empty)
-                 if not extracted_data:
-                      print("OCR returned empty list.")
-                      flash('OCR completed, but no schedule data could be extracted automatically. You can add rows manually below.', 'warning')
-                 else:
-                      print(f"OCR extracted {len(extracted_data)} item(s).")
-                      flash('OCR successful! Review and edit the extracted data below.', 'success')
-                 return redirect(url_for('show_results'))
+            mime_type = mime_type_for(filename)
+
+            # --- Queue OCR ---
+            # run_ocr_and_extract can take 30s+ with retries, so it runs on the job pool
+            # and the browser polls /jobs/<job_id>, picking up rows as they stream in.
+            job = get_job_manager().submit(run_ocr_and_extract, image_data, mime_type=mime_type,
+                                           slot_grid=slot_grid, stream_rows=True)
+            print(f"Queued OCR job {job.id}.")
+
+            # Clear any potential stale data from previous attempts
+            session.pop('extracted_data', None)
+            session['ocr_job_id'] = job.id
+            # The results page preselects the timetable the slots were checked against
+            session['slot_grid'] = slot_grid.key
+
+            if wants_json:
+                return jsonify({
+                    'job_id': job.id,
+                    'status': job.status,
+                    'status_url': url_for('job_status', job_id=job.id),
+                    'results_url': url_for('show_results'),
+                }), 202
+            return redirect(url_for('show_results'))
+
+        except QueueFullError as e:
+            print(f"Rejected upload, OCR queue is full: {e}")
+            if wants_json:
+                return jsonify({'error': 'The server is busy processing other timetables. Please try again shortly.'}), 503
+            flash('The server is busy processing other timetables. Please try again in a minute.', 'warning')
+            return redirect(url_for('index'))
 
         except Exception as e:
-            # Catch broader exceptions during file read or unexpected OCR issues
-            print(f"Error during file processing or OCR call: {e}", exc_info=True) # Log traceback
+            # Catch broader exceptions during file read or job submission
+            print(f"Error during file processing or OCR job submission: {e}")
             flash(f'An error occurred processing the file: {e}', 'danger')
             return redirect(url_for('index'))
 
@@ -124,12 +161,114 @@ def upload_file():
         flash('Invalid file type. Allowed types are png, jpg, jpeg, gif, webp.', 'warning')
         return redirect(url_for('index'))
 
+
+def _collect_batch_images():
+    """
+    Gathers (filename, bytes, mime_type) for every image in a batch request:
+    files sent as repeated `timetable_images` fields and/or images inside any
+    uploaded .zip archive. Returns (items, skipped_filenames).
+    """
+    items, skipped = [], []
+    for file in request.files.getlist('timetable_images') + request.files.getlist('timetable_zip'):
+        filename = secure_filename(file.filename or '')
+        if filename.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(io.BytesIO(file.read())) as archive:
+                    for info in archive.infolist():
+                        member_name = secure_filename(os.path.basename(info.filename))
+                        if info.is_dir() or not member_name:
+                            continue
+                        if not allowed_file(member_name):
+                            skipped.append(f"{filename}/{info.filename}")
+                            continue
+                        # Guard against zip bombs: members obey the same size limit as uploads
+                        if info.file_size > app.config['MAX_CONTENT_LENGTH']:
+                            skipped.append(f"{filename}/{info.filename}")
+                            continue
+                        items.append((member_name, archive.read(info), mime_type_for(member_name)))
+            except zipfile.BadZipFile:
+                skipped.append(filename)
+        elif filename and allowed_file(filename):
+            items.append((filename, file.read(), mime_type_for(filename)))
+        elif filename:
+            skipped.append(filename)
+    return items, skipped
+
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """
+    OCRs many timetable images in one request (several `timetable_images`
+    files and/or a `timetable_zip` archive). Streams newline-delimited JSON:
+    one line per image as soon as it finishes, then a summary line.
+    Optional form/query field `concurrency` lowers the per-batch parallelism;
+    `slot_grid` picks the timetable slot codes are corrected against.
+
+    The whole request is still subject to MAX_CONTENT_LENGTH.
+    """
+    items, skipped = _collect_batch_images()
+    if not items:
+        return jsonify({'error': 'No images found. Send timetable_images files or a timetable_zip archive.',
+                        'skipped': skipped}), 400
+    if len(items) > OCR_BATCH_MAX_IMAGES:
+        return jsonify({'error': f'Too many images in one batch ({len(items)}); the limit is {OCR_BATCH_MAX_IMAGES}.'}), 413
+
+    concurrency = request.values.get('concurrency', type=int)
+    slot_grid_key = request.values.get('slot_grid') or None
+    slot_grid = get_slot_grid_registry().get(slot_grid_key)
+    if slot_grid is None:
+        return jsonify({'error': f"Unknown slot timetable '{slot_grid_key}'."}), 400
+    print(f"Starting OCR batch of {len(items)} image(s) (skipped {len(skipped)}).")
+
+    def generate():
+        started = time.perf_counter()
+        succeeded = 0
+        yield json.dumps({'type': 'batch', 'images': len(items), 'skipped': skipped}) + "\n"
+        for outcome in run_ocr_batch(items, concurrency=concurrency, slot_grid=slot_grid):
+            succeeded += outcome['status'] == 'done'
+            yield json.dumps(dict(outcome, type='image')) + "\n"
+        elapsed = time.perf_counter() - started
+        print(f"OCR batch finished: {succeeded}/{len(items)} succeeded in {elapsed:.1f}s.")
+        yield json.dumps({'type': 'summary', 'images': len(items), 'succeeded': succeeded,
+                          'failed': len(items) - succeeded, 'seconds': round(elapsed, 2)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _collect_finished_job(job):
+    """Moves a finished job's result into the session. Returns False if the job failed."""
+    session.pop('ocr_job_id', None)
+    if job.status == FAILED:
+        session.pop('extracted_data', None)
+        return False
+    session['extracted_data'] = job.result
+    return True
+
+
 @app.route('/results')
 def show_results():
-    """Displays the OCR results (editable table) stored in the session."""
+    """Displays the OCR results (editable table) stored in the session, or a pending OCR job."""
     # Get data from session (could be list, empty list, or None if never set)
     extracted_data = session.get('extracted_data', None)
     google_authenticated = 'credentials' in session # Check if Google credentials are in session
+    pending_job_id = None
+
+    job_id = session.get('ocr_job_id')
+    if extracted_data is None and job_id:
+        job = get_job_manager().get(job_id)
+        if job is None:
+            session.pop('ocr_job_id', None)
+            flash('Your OCR job has expired. Please upload the image again.', 'warning')
+            return redirect(url_for('index'))
+        if job.finished:
+            if not _collect_finished_job(job):
+                flash(job.error, 'danger')
+                return redirect(url_for('index'))
+            extracted_data = job.result
+        else:
+            # Render the (empty) table now; the page polls the job and fills it in
+            pending_job_id = job.id
+            extracted_data = []
 
     # If user lands here without ever uploading, extracted_data will be None
     if extracted_data is None:
@@ -137,9 +276,34 @@ def show_results():
          return redirect(url_for('index'))
 
     # Pass the data (list, possibly empty) to the template for Tabulator
+    if google_authenticated:
+        # Refresh the token now if it's about to expire, so creating events doesn't wait on it
+        prefetch_credentials(session['credentials'])
+    registry = get_slot_grid_registry()
     return render_template('results.html',
                            extracted_data=extracted_data,
-                           google_authenticated=google_authenticated)
+                           pending_job_id=pending_job_id,
+                           google_authenticated=google_authenticated,
+                           conflict_check=CALENDAR_CONFLICT_CHECK,
+                           slot_grids=registry.available(),
+                           selected_slot_grid=session.get('slot_grid') or registry.get().key)
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Returns the status of a background OCR job as JSON (polled by results.html).
+    ?since=N limits streamed partial rows to those after the first N.
+    """
+    since = request.args.get('since', 0, type=int)
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'job_id': job_id, 'status': 'unknown',
+                        'error': 'Job not found or expired. Please upload the image again.'}), 404
+    if job.finished and session.get('ocr_job_id') == job.id:
+        # Persist the result for the /results page and event creation
+        _collect_finished_job(job)
+    return jsonify(job.to_dict(since=max(0, since)))
 
 # --- Google OAuth Routes ---
 
@@ -150,6 +314,8 @@ def authorize():
         print(f"CRITICAL ERROR: {CLIENT_SECRET_FILE} not found.")
         return render_template('error.html', error_message=f"Server configuration error: {CLIENT_SECRET_FILE} not found. Cannot start authentication.")
 
+    import google_auth_oauthlib.flow
+
     # Create flow instance to manage the OAuth 2.0 Authorization Grant Flow steps.
     try:
         flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
@@ -202,6 +368,8 @@ def oauth2callback():
          print(f"CRITICAL ERROR: {CLIENT_SECRET_FILE} not found during callback.")
          return render_template('error.html', error_message=f"Server configuration error: {CLIENT_SECRET_FILE} not found. Cannot complete authentication.")
 
+    import google_auth_oauthlib.flow
+
     # Recreate the flow instance with the same state.
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         CLIENT_SECRET_FILE, scopes=SCOPES, state=state)
@@ -238,6 +406,7 @@ def oauth2callback():
          flash("Error storing authentication credentials.", "danger")
          return redirect(url_for('index'))
 
+    store_credentials(session['credentials'], credentials)
     print("Credentials stored in session.")
     # Clear the state variable used for CSRF protection.
     session.pop('state', None)
@@ -251,22 +420,19 @@ def oauth2callback():
 @app.route('/clear_auth') # More descriptive name than /clear
 def clear_authentication():
     """Clears Google credentials from the session (effectively logs out from Google part)."""
-    session.pop('credentials', None)
+    forget_credentials(session.pop('credentials', None))
     session.pop('extracted_data', None) # Also clear schedule data
     flash('Google authentication cleared. Upload a new image or re-authorize.', 'info')
     return redirect(url_for('index'))
 
 # --- Google Calendar Event Creation ---
 
-@app.route('/create_events', methods=['POST'])
-def create_google_events():
-    """Creates Google Calendar events using data from form and stored credentials."""
-    print("Received request to create calendar events.")
-    if 'credentials' not in session:
-        flash('Authentication required. Please authorize with Google first.', 'warning')
-        # Send user back to results page where they can see the authorize button
-        return redirect(url_for('show_results'))
-
+def read_schedule_form():
+    """
+    Reads the schedule table, date range and slot timetable submitted from the
+    results page. Returns (schedule_data, start_date_str, end_date_str, slot_grid),
+    or None after flashing what was wrong.
+    """
     # --- Get Data from Form ---
     edited_data_json = request.form.get('edited_data')
     start_date_str = request.form.get('start_date')
@@ -275,10 +441,10 @@ def create_google_events():
     # Validate required fields
     if not edited_data_json:
         flash('No schedule data submitted from the table.', 'warning')
-        return redirect(url_for('show_results'))
+        return None
     if not start_date_str or not end_date_str:
         flash('Start date and end date are required.', 'warning')
-        return redirect(url_for('show_results'))
+        return None
 
     # --- Parse Submitted Data ---
     try:
@@ -290,49 +456,113 @@ def create_google_events():
     except json.JSONDecodeError:
         print("Error: Failed to decode JSON data from form.")
         flash('Invalid schedule data format received from table.', 'danger')
-        return redirect(url_for('show_results'))
+        return None
     except ValueError as ve:
          print(f"Error: Invalid schedule data content: {ve}")
          flash(f'Invalid schedule data: {ve}', 'danger')
-         return redirect(url_for('show_results'))
+         return None
     except Exception as e:
          print(f"Unexpected error parsing submitted schedule data: {e}", exc_info=True)
          flash('Error processing submitted schedule data.', 'danger')
-         return redirect(url_for('show_results'))
+         return None
 
     # Check if data is empty after parsing
     if not schedule_data:
         flash('No schedule entries to add. Please add rows to the table.', 'warning')
+        return None
+
+    # --- Pick the Slot Timetable (campus/semester) ---
+    slot_grid_key = request.form.get('slot_grid') or None
+    slot_grid = get_slot_grid_registry().get(slot_grid_key)
+    if slot_grid is None:
+        flash(f"Unknown slot timetable '{slot_grid_key}'. Please choose another one.", 'warning')
+        return None
+    session['slot_grid'] = slot_grid.key
+    print(f"Using slot timetable '{slot_grid.key}' (version {slot_grid.version}).")
+    return schedule_data, start_date_str, end_date_str, slot_grid
+
+
+@app.route('/create_events', methods=['POST'])
+def create_google_events():
+    """
+    Creates Google Calendar events using data from form and stored credentials.
+    With dry_run=1 nothing is written: the planned events and the API calls
+    they would cost are shown for the user to confirm.
+    """
+    print("Received request to create calendar events.")
+    if 'credentials' not in session:
+        flash('Authentication required. Please authorize with Google first.', 'warning')
+        # Send user back to results page where they can see the authorize button
         return redirect(url_for('show_results'))
 
+    form = read_schedule_form()
+    if form is None:
+        return redirect(url_for('show_results'))
+    schedule_data, start_date_str, end_date_str, slot_grid = form
+
     # --- Get Calendar Service ---
     credentials_dict = session['credentials']
     # Use a default timezone or get from user settings if implemented
     user_timezone = request.form.get('timezone', 'UTC')
 
     print("Attempting to get Google Calendar service...")
-    # get_calendar_service now returns (service, refreshed_creds_obj or None)
-    service, refreshed_creds = get_calendar_service(credentials_dict)
-
-    if refreshed_creds and refreshed_creds.valid:
-        # Update session credentials if they were refreshed successfully
-        session['credentials'] = credentials_to_dict(refreshed_creds)
-        print("Session credentials updated after token refresh.")
-    elif not service:
+    # Refreshed tokens stay in the server-side credential cache; the session copy isn't rewritten
+    service, creds = get_calendar_service(credentials_dict)
+
+    if not service:
         # Service creation failed, potentially due to token refresh failure or other API issues
         session.pop('credentials', None) # Clear bad credentials
         flash('Could not connect to Google Calendar service. Authorization might have expired. Please authorize again.', 'danger')
         return redirect(url_for('show_results')) # Redirect to show authorize button again
 
+    try:
+        start_date_obj, end_date_obj = parse_date_range(start_date_str, end_date_str)
+    except ValueError:
+        flash('Invalid start or end date format. Please use YYYY-MM-DD.', 'danger')
+        return redirect(url_for('show_results'))
+    # Cached: a confirmed dry run and create_calendar_events below reuse this plan
+    plan = get_event_plan(schedule_data, slot_grid.table, start_date_obj, end_date_obj, user_timezone)
+    dry_run = request.form.get('dry_run') == '1'
+    # Semester label the events are synced under; blank means the half-year of the start date
+    term = request.form.get('term', '').strip() or None
+
+    # --- Conflict Check: busy times minus the app's own events, matched against the planned occurrences locally ---
+    conflicts = None
+    if CALENDAR_CONFLICT_CHECK and request.form.get('check_conflicts') == '1':
+        conflicts = check_plan_conflicts(service, plan, term=term)
+
+    # --- Dry Run (or clashes found): show the plan and its cost instead of writing ---
+    if dry_run or (conflicts and conflicts['conflicts']):
+        # Only an explicit dry run spends a read call on exact change counts
+        report = preview_event_plan(service if dry_run else None, plan, term=term)
+        print(f"Dry run: {report['events']} event(s), ~{report['cost']['api_calls']} API call(s).")
+        # The confirm button re-posts the same form, without the checks; the plan is reused from the cache
+        return render_template('plan.html', report=report, conflicts=conflicts,
+                               form_fields={key: value for key, value in request.form.items()
+                                            if key not in ('dry_run', 'check_conflicts')})
+
+    outbox = get_calendar_outbox()
+
+    # --- Queue Event Creation (written in the background, survives restarts) ---
+    if outbox is not None:
+        # Only the user's credential-cache key is stored; get_calendar_service above cached the credentials
+        job_id = outbox.enqueue(plan, calendar_user_key(session.get('credentials')), term=term)
+        session.pop('extracted_data', None)
+        # success.html polls the job and fills in the counts as writes complete
+        return render_template('success.html', job_id=job_id, success_count=0, failure_count=0,
+                               messages=list(plan.error_messages))
+
     # --- Perform Event Creation ---
     print(f"Creating events from {start_date_str} to {end_date_str}...")
     success_count, failure_count, error_messages = create_calendar_events(
         service,
         schedule_data,
-        default_time_slots, # The hardcoded time slot mapping
+        slot_grid.table, # Compiled slot table for the chosen campus/semester
         start_date_str,
         end_date_str,
-        user_timezone
+        user_timezone,
+        user_key=calendar_user_key(session.get('credentials')),
+        term=term
     )
     print(f"Event creation result: Success={success_count}, Failures={failure_count}, Errors={len(error_messages)}")
 
@@ -347,6 +577,81 @@ def create_google_events():
                            messages=error_messages) # Pass error messages list
 
 
+@app.route('/calendar_jobs/<job_id>')
+def calendar_job_status(job_id):
+    """Returns the progress of a queued event-creation job as JSON (polled by success.html)."""
+    outbox = get_calendar_outbox()
+    status = outbox.job_status(job_id) if outbox is not None else None
+    # Jobs are only visible to the Google account that queued them
+    if status is None or status.pop('user_key') != calendar_user_key(session.get('credentials')):
+        return jsonify({'job_id': job_id, 'status': 'unknown',
+                        'error': 'Calendar job not found or expired.'}), 404
+    if status['status'] == 'waiting':
+        # A job runs with the credentials cached in memory: put them back if a restart dropped them
+        prefetch_credentials(session['credentials'])
+    return jsonify(status)
+
+
+@app.route('/export_ics', methods=['POST'])
+def export_ics():
+    """
+    Streams the schedule as an .ics file to import into any calendar app. Needs
+    no Google authorization and makes no Calendar API calls.
+    """
+    form = read_schedule_form()
+    if form is None:
+        return redirect(url_for('show_results'))
+    schedule_data, start_date_str, end_date_str, slot_grid = form
+    try:
+        start_date_obj, end_date_obj = parse_date_range(start_date_str, end_date_str)
+    except ValueError:
+        flash('Invalid start or end date format. Please use YYYY-MM-DD.', 'danger')
+        return redirect(url_for('show_results'))
+    user_timezone = request.form.get('timezone', 'UTC')
+
+    # Same events (times, RRULE/UNTIL, coalescing) as create_calendar_events would insert
+    plan = get_event_plan(schedule_data, slot_grid.table, start_date_obj, end_date_obj, user_timezone)
+    if not plan.events:
+        flash('None of the slots could be matched to the slot timetable, so there is nothing to export.', 'warning')
+        for message in plan.error_messages[:5]:
+            flash(message, 'warning')
+        return redirect(url_for('show_results'))
+    print(f"Exporting {len(plan.events)} event(s) as ICS ({len(plan.error_messages)} slot(s) skipped).")
+
+    filename = f"timetable_{start_date_obj:%Y%m%d}_{end_date_obj:%Y%m%d}.ics"
+    return Response(stream_with_context(iter_ics(plan.events, start_date_obj, end_date_obj, user_timezone,
+                                                        term=request.form.get('term', '').strip() or None)),
+                    mimetype='text/calendar',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+# --- Monitoring ---
+
+@app.route('/stats')
+def service_stats():
+    """Returns internal counters (OCR cache hits/misses, etc.) as JSON for monitoring."""
+    cache = get_ocr_cache()
+    similarity_index = get_similarity_index()
+    outbox = get_calendar_outbox()
+    return jsonify({
+        'ocr_cache': cache.stats() if cache is not None else {'enabled': False},
+        'ocr_similarity': similarity_index.stats() if similarity_index is not None else {'enabled': False},
+        'image_preprocess': preprocess_stats(),
+        'ocr_tiling': tiling_stats(),
+        'ocr_jobs': get_job_manager().stats(),
+        'ocr_backend': backend_stats(),
+        'ocr_tokens': token_stats(),
+        'ocr_parse': parse_stats(),
+        'slot_validation': slot_validation_stats(),
+        'slot_grids': get_slot_grid_registry().stats(),
+        'calendar': calendar_stats(),
+        'ics_export': ics_stats(),
+        'calendar_outbox': outbox.stats() if outbox is not None else {'enabled': False},
+        'gemini': limiter_stats(),
+        'ocr_batch': batch_stats(),
+    })
+
+
 # --- Error Handling ---
 @app.errorhandler(404)
 def not_found_error(error):
@@ -0,0 +1,299 @@
+import os
+import re
+import time
+import bisect
+import datetime
+import functools
+import threading
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dotenv import load_dotenv
+
+from slot_table import DAY_TO_WEEKDAY, DAY_TO_RRULE
+from calendar_sync import resolve_term, term_id, TERM_PROPERTY
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Set CALENDAR_CONFLICT_CHECK=0 to hide the "check for conflicts" option before creating events.
+CALENDAR_CONFLICT_CHECK = os.getenv("CALENDAR_CONFLICT_CHECK", "1") not in ("0", "false", "False", "")
+# Conflicting dates listed per planned event (all of them are counted).
+CALENDAR_CONFLICT_MAX_DATES = int(os.getenv("CALENDAR_CONFLICT_MAX_DATES", "5"))
+# Days covered by one freebusy.query; longer terms are queried in several windows, as the
+# API rejects long time ranges.
+CALENDAR_FREEBUSY_CHUNK_DAYS = int(os.getenv("CALENDAR_FREEBUSY_CHUNK_DAYS", "60"))
+
+_RRULE_TO_WEEKDAY = {rrule_day: DAY_TO_WEEKDAY[day] for day, rrule_day in DAY_TO_RRULE.items()}
+_BYDAY = re.compile(r"BYDAY=([A-Z,]+)")
+_UNTIL = re.compile(r"UNTIL=(\d{8})")
+_WEEK = datetime.timedelta(days=7)
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+_stats_lock = threading.Lock()
+_stats = {'checks': 0, 'failed_checks': 0, 'api_calls': 0, 'occurrences': 0, 'busy_periods': 0,
+          'own_periods': 0, 'conflicting_occurrences': 0, 'last_check_ms': 0.0}
+
+
+@functools.lru_cache(maxsize=64)
+def _zone(tz_name):
+    try:
+        return ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return datetime.timezone.utc
+
+
+def _parse_utc(value):
+    """RFC 3339 timestamp from the API -> POSIX seconds."""
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _rfc3339(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).isoformat()
+
+
+def expand_occurrences(plan):
+    """
+    Expands an EventPlan's weekly recurring events into their individual
+    occurrences, without any API call.
+
+    Returns a list of (start, end, event index) sorted by start, with start
+    and end in POSIX seconds. Each occurrence keeps its local wall-clock time,
+    so occurrences after a DST change shift in UTC exactly as in Calendar.
+    """
+    occurrences = []
+    for index, (_, _, body) in enumerate(plan.events):
+        zone = _zone(body['start'].get('timeZone') or plan.timezone or 'UTC')
+        start = datetime.datetime.fromisoformat(body['start']['dateTime'])
+        duration = (datetime.datetime.fromisoformat(body['end']['dateTime']) - start).total_seconds()
+        first_date, start_time = start.date(), start.time()
+        start_seconds = start_time.hour * 3600 + start_time.minute * 60 + start_time.second
+        last_date = plan.end_date
+        weekdays = {start.weekday()}
+        for rule in body.get('recurrence', ()):
+            days, until = _BYDAY.search(rule), _UNTIL.search(rule)
+            if days:
+                weekdays = {_RRULE_TO_WEEKDAY[day] for day in days.group(1).split(",") if day in _RRULE_TO_WEEKDAY}
+            if until:
+                last_date = datetime.datetime.strptime(until.group(1), "%Y%m%d").date()
+        for weekday in weekdays:
+            date = first_date + datetime.timedelta(days=(weekday - first_date.weekday()) % 7)
+            while date <= last_date:
+                # Local midnight as if it were UTC, plus the start time, minus the offset on that day:
+                # several times faster than an aware datetime's timestamp()
+                offset = zone.utcoffset(datetime.datetime.combine(date, start_time)).total_seconds()
+                occurrence_start = (date.toordinal() - _EPOCH_ORDINAL) * 86400 + start_seconds - offset
+                occurrences.append((occurrence_start, occurrence_start + duration, index))
+                date += _WEEK
+    occurrences.sort()
+    return occurrences
+
+
+class BusyIndex:
+    """
+    Interval index over busy periods: sorted, merged into disjoint intervals,
+    so the periods overlapping any interval are found with one binary search.
+    """
+
+    def __init__(self, periods):
+        merged = []
+        for start, end in sorted(periods):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = [start for start, _ in merged]
+        self.ends = [end for _, end in merged]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, start, end):
+        """True if any busy period overlaps [start, end) (touching end to start doesn't count)."""
+        # First period ending after start; being disjoint, the ends are sorted too
+        i = bisect.bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def overlapping(self, start, end):
+        """The busy parts of [start, end), as (start, end) pairs clipped to it."""
+        parts = []
+        i = bisect.bisect_right(self.ends, start)
+        while i < len(self.starts) and self.starts[i] < end:
+            parts.append((max(self.starts[i], start), min(self.ends[i], end)))
+            i += 1
+        return parts
+
+    def covers(self, start, end):
+        """True if [start, end) lies entirely within the busy periods."""
+        # Periods that touch are merged, so a covered interval lies within a single one
+        i = bisect.bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] <= start and end <= self.ends[i]
+
+
+def freebusy_windows(time_min, time_max):
+    """The (start, end) windows query_busy sends one freebusy.query each for."""
+    window = CALENDAR_FREEBUSY_CHUNK_DAYS * 86400
+    windows = []
+    while time_min < time_max:
+        windows.append((time_min, min(time_max, time_min + window)))
+        time_min += window
+    return windows
+
+
+def query_busy(service, time_min, time_max, calendar_id='primary'):
+    """
+    The calendar's busy periods between two POSIX times, as (start, end) pairs:
+    one freebusy.query call per window of CALENDAR_FREEBUSY_CHUNK_DAYS (see
+    freebusy_windows). Periods crossing a window boundary come back split;
+    BusyIndex joins them again. Raises RuntimeError if Calendar reports an
+    error for the calendar (HttpError propagates).
+
+    Returns (periods, calls made).
+    """
+    periods = []
+    calls = 0
+    for window_start, window_end in freebusy_windows(time_min, time_max):
+        body = {
+            'timeMin': _rfc3339(window_start),
+            'timeMax': _rfc3339(window_end),
+            'timeZone': 'UTC',
+            'items': [{'id': calendar_id}],
+        }
+        response = service.freebusy().query(body=body).execute()
+        calls += 1
+        calendar = response.get('calendars', {}).get(calendar_id, {})
+        if calendar.get('errors'):
+            reasons = ", ".join(error.get('reason', 'unknown') for error in calendar['errors'])
+            raise RuntimeError(f"Calendar could not report busy times ({reasons}).")
+        periods.extend((_parse_utc(period['start']), _parse_utc(period['end'])) for period in calendar.get('busy', []))
+    return periods, calls
+
+
+def query_own_busy(service, term, time_min, time_max, calendar_id='primary'):
+    """
+    Times taken by events this app already synced for the term (see
+    calendar_sync.resolve_term), found through their term property: events.list
+    expanded into single occurrences, one call per result page of 2500.
+
+    Returns (periods, calls made).
+    """
+    periods = []
+    calls = 0
+    page_token = None
+    while True:
+        response = service.events().list(
+            calendarId=calendar_id,
+            privateExtendedProperty=f"{TERM_PROPERTY}={term_id(term)}",
+            singleEvents=True,
+            timeMin=_rfc3339(time_min),
+            timeMax=_rfc3339(time_max),
+            maxResults=2500,
+            pageToken=page_token,
+            fields="items(start,end,status),nextPageToken",
+        ).execute()
+        calls += 1
+        for item in response.get('items', []):
+            start, end = item.get('start', {}).get('dateTime'), item.get('end', {}).get('dateTime')
+            if start and end and item.get('status') != 'cancelled':
+                periods.append((_parse_utc(start), _parse_utc(end)))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return periods, calls
+
+
+def find_conflicts(plan, busy_periods, occurrences=None, own_periods=()):
+    """
+    Matches a plan's occurrences (expand_occurrences, computed if not given)
+    against busy periods; no API calls.
+
+    own_periods are the times of events this app synced earlier for the same
+    term (query_own_busy). freebusy reports those as busy like anything else,
+    merged with whatever is adjacent, so an occurrence only conflicts where
+    the busy time it overlaps isn't accounted for by them. Busy time within an
+    own event's time is always taken for that event: freebusy doesn't say
+    whether something else is booked then too.
+
+    Returns (conflicts, occurrence count, merged busy period count), with a
+    conflicts dict per planned event that overlaps anything: its course,
+    slots, number of conflicting occurrences and the first of their dates.
+    """
+    if occurrences is None:
+        occurrences = expand_occurrences(plan)
+    index = BusyIndex(busy_periods)
+    own = BusyIndex(own_periods)
+    by_event = {}
+    for start, end, event_index in occurrences:
+        if index.overlaps(start, end) and (
+                not len(own) or not all(own.covers(*part) for part in index.overlapping(start, end))):
+            by_event.setdefault(event_index, []).append(start)
+
+    conflicts = []
+    for event_index in sorted(by_event):
+        slot_codes, course_code, body = plan.events[event_index]
+        zone = _zone(body['start'].get('timeZone') or plan.timezone or 'UTC')
+        starts = by_event[event_index]
+        conflicts.append({
+            'course_code': course_code,
+            'slots': list(slot_codes),
+            'summary': body.get('summary', course_code),
+            'count': len(starts),
+            'dates': [datetime.datetime.fromtimestamp(start, zone).strftime("%a %Y-%m-%d %H:%M")
+                      for start in starts[:CALENDAR_CONFLICT_MAX_DATES]],
+        })
+    return conflicts, len(occurrences), len(index)
+
+
+def check_plan_conflicts(service, plan, term=None):
+    """
+    Pre-insert conflict pass: freebusy.query over the plan's whole date range
+    (in CALENDAR_FREEBUSY_CHUNK_DAYS windows) and an events.list of the app's
+    own events of the term (term as for create_calendar_events), then
+    find_conflicts in memory. Never raises; a failed check is reported in
+    'error' so event creation can go ahead without it.
+
+    Returns {'conflicts', 'conflicting_occurrences', 'occurrences',
+    'busy_periods', 'own_periods', 'api_calls', 'error'}.
+    """
+    started = time.perf_counter()
+    result = {'conflicts': [], 'conflicting_occurrences': 0, 'occurrences': 0, 'busy_periods': 0, 'own_periods': 0,
+              'api_calls': 0, 'error': None}
+    occurrences = expand_occurrences(plan)
+    result['occurrences'] = len(occurrences)
+    if occurrences:
+        try:
+            time_min, time_max = occurrences[0][0], max(end for _, end, _ in occurrences)
+            busy, calls = query_busy(service, time_min, time_max)
+            result['api_calls'] += calls
+            own, calls = query_own_busy(service, resolve_term(term, plan.start_date), time_min, time_max)
+            result['api_calls'] += calls
+            result['own_periods'] = len(own)
+            conflicts, _, result['busy_periods'] = find_conflicts(plan, busy, occurrences, own)
+            result['conflicts'] = conflicts
+            result['conflicting_occurrences'] = sum(conflict['count'] for conflict in conflicts)
+        except Exception as e:
+            from googleapiclient.errors import HttpError
+            if isinstance(e, HttpError) and getattr(e.resp, 'status', None) == 403:
+                # Usually a session authorized before the free/busy scope was requested
+                result['error'] = "Google Calendar didn't allow reading your free/busy times; authorize again to check for conflicts."
+            else:
+                result['error'] = f"Could not check for conflicts: {e}"
+            print(f"Warning: Conflict check failed: {e}")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"Conflict check: {result['conflicting_occurrences']} of {len(occurrences)} occurrence(s) overlap "
+          f"{result['busy_periods']} busy period(s), {result['own_periods']} of them the app's own events "
+          f"({result['api_calls']} API call(s), {elapsed_ms:.1f} ms).")
+    with _stats_lock:
+        _stats['checks'] += 1
+        _stats['failed_checks'] += result['error'] is not None
+        _stats['api_calls'] += result['api_calls']
+        _stats['occurrences'] += len(occurrences)
+        _stats['busy_periods'] += result['busy_periods']
+        _stats['own_periods'] += result['own_periods']
+        _stats['conflicting_occurrences'] += result['conflicting_occurrences']
+        _stats['last_check_ms'] = round(elapsed_ms, 2)
+    return result
+
+
+def conflict_stats():
+    """Lifetime conflict-check counters for monitoring."""
+    with _stats_lock:
+        return dict(_stats, enabled=CALENDAR_CONFLICT_CHECK)
@@ -0,0 +1,305 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from gemini_limiter import TokenBucket, backoff_delay
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Events per Calendar API batch request. Google accepts up to 1000 calls per batch, but
+# Calendar starts rate limiting large batches; 50 keeps a typical timetable to one round trip.
+# Set to 1 to disable batching and send every call on its own (concurrently).
+CALENDAR_BATCH_SIZE = int(os.getenv("CALENDAR_BATCH_SIZE", "50"))
+# Threads sending individual calls (non-batched mode and retries of failed batch items).
+CALENDAR_INSERT_WORKERS = int(os.getenv("CALENDAR_INSERT_WORKERS", "4"))
+# Per-user request rate; Google's default Calendar quota is 600 requests/minute per user,
+# so this leaves headroom for the user's other apps. Throttling responses lower it adaptively.
+CALENDAR_USER_RATE_PER_MINUTE = float(os.getenv("CALENDAR_USER_RATE_PER_MINUTE", "300"))
+CALENDAR_USER_BURST = float(os.getenv("CALENDAR_USER_BURST", "20"))
+# Attempts per individual call when Google answers with a rate limit or 5xx error.
+CALENDAR_INSERT_ATTEMPTS = int(os.getenv("CALENDAR_INSERT_ATTEMPTS", "4"))
+CALENDAR_BACKOFF_BASE_SECONDS = float(os.getenv("CALENDAR_BACKOFF_BASE_SECONDS", "1"))
+CALENDAR_BACKOFF_MAX_SECONDS = float(os.getenv("CALENDAR_BACKOFF_MAX_SECONDS", "16"))
+# How long an insert waits for a rate-limit token before it is reported as failed.
+CALENDAR_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("CALENDAR_ACQUIRE_TIMEOUT_SECONDS", "60"))
+# Per-user limiters kept in memory (least recently used are dropped beyond this).
+CALENDAR_MAX_TRACKED_USERS = int(os.getenv("CALENDAR_MAX_TRACKED_USERS", "1000"))
+
+# One Calendar write. kind is 'insert', 'patch' or 'delete'; event_id is None for
+# plain inserts; slot_codes/course_code are for counting and error messages.
+EventChange = namedtuple("EventChange", "kind event_id body slot_codes course_code")
+
+# 'update' is an insert that found its id taken by a cancelled event and restored it.
+CHANGE_COUNTERS = {'insert': 'inserted', 'patch': 'patched', 'update': 'revived', 'delete': 'deleted'}
+
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+RETRYABLE_STATUSES = (500, 502, 503, 504)
+
+_limiters = OrderedDict()
+_limiters_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'batches': 0, 'batched_calls': 0, 'individual_calls': 0, 'rate_limited': 0,
+          'retries': 0, 'failed': 0, 'inserted': 0, 'patched': 0, 'deleted': 0, 'revived': 0}
+
+
+def get_user_rate_limiter(user_key):
+    """Returns the adaptive token bucket for one Google user (None shares one anonymous bucket)."""
+    with _limiters_lock:
+        limiter = _limiters.get(user_key)
+        if limiter is None:
+            limiter = TokenBucket(rate_per_minute=CALENDAR_USER_RATE_PER_MINUTE, burst=CALENDAR_USER_BURST)
+            _limiters[user_key] = limiter
+            while len(_limiters) > CALENDAR_MAX_TRACKED_USERS:
+                _limiters.popitem(last=False)
+        else:
+            _limiters.move_to_end(user_key)
+        return limiter
+
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+
+def describe_http_error(error):
+    """'API Error <status>: <message>' for an HttpError, as shown to the user."""
+    error_detail = f"API Error {error.resp.status}"
+    try: # Try to get more specific error message from response
+        err_json = json.loads(error.content.decode())
+        error_detail += f": {err_json.get('error', {}).get('message', 'Unknown API error')}"
+    except: pass # Ignore if content isn't JSON
+    return error_detail
+
+
+def _http_status(error):
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+def _request(service, change):
+    """Builds the API request for one change."""
+    events = service.events()
+    if change.kind == 'delete':
+        return events.delete(calendarId='primary', eventId=change.event_id)
+    if change.kind == 'patch':
+        return events.patch(calendarId='primary', eventId=change.event_id, body=change.body)
+    if change.kind == 'update':
+        return events.update(calendarId='primary', eventId=change.event_id, body=change.body)
+    body = change.body if change.event_id is None else dict(change.body, id=change.event_id)
+    return events.insert(calendarId='primary', body=body)
+
+
+def _succeeded(change):
+    """Slots a successful change accounts for (deletes don't stand for any)."""
+    _count(**{CHANGE_COUNTERS[change.kind]: 1})
+    return 0 if change.kind == 'delete' else len(change.slot_codes)
+
+
+def _describe_change(change):
+    if change.kind == 'delete':
+        return f"Removing outdated event {change.event_id}"
+    return f"Slot {', '.join(change.slot_codes)} ({change.course_code})"
+
+
+def _is_rate_limited(error):
+    status = _http_status(error)
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    try:
+        errors = json.loads(error.content.decode()).get('error', {}).get('errors', [])
+        return any(item.get('reason') in RATE_LIMIT_REASONS for item in errors)
+    except Exception:
+        return False
+
+
+def _apply_batches(service, changes, limiter, on_result):
+    """Sends changes as batch requests on the calling thread; returns (success_count, indexes to retry)."""
+    success_count = 0
+    retry_indexes = []
+    for chunk_start in range(0, len(changes), CALENDAR_BATCH_SIZE):
+        chunk = changes[chunk_start:chunk_start + CALENDAR_BATCH_SIZE]
+        outcomes = {} # request_id -> exception (None on success)
+
+        def on_item(request_id, response, exception):
+            outcomes[request_id] = exception
+
+        # Every call inside a batch counts against the user's quota. If the limiter runs dry,
+        # the calls that already got a token still go out as a (smaller) batch
+        granted = 0
+        while granted < len(chunk) and limiter.acquire(timeout=CALENDAR_ACQUIRE_TIMEOUT_SECONDS):
+            granted += 1
+        timed_out = granted < len(chunk)
+        if timed_out:
+            print("Timed out waiting for Calendar rate limit tokens; sending the rest individually.")
+            retry_indexes.extend(range(chunk_start + granted, len(changes)))
+            chunk = chunk[:granted]
+            if not chunk:
+                break
+        batch = service.new_batch_http_request(callback=on_item)
+        for offset, change in enumerate(chunk):
+            batch.add(_request(service, change), request_id=str(chunk_start + offset))
+        try:
+            batch.execute()
+        except Exception as e:
+            print(f"Batch of {len(chunk)} Calendar change(s) failed ({e}); retrying them individually.")
+        _count(batches=1, batched_calls=len(chunk))
+
+        throttled = False
+        for index in range(chunk_start, chunk_start + len(chunk)):
+            exception = outcomes.get(str(index), "missing")
+            if exception is None:
+                slots = _succeeded(changes[index])
+                success_count += slots
+                if on_result is not None:
+                    on_result(index, slots, None, False)
+            else:
+                throttled = throttled or _is_rate_limited(exception)
+                retry_indexes.append(index)
+        if throttled:
+            _count(rate_limited=1)
+            limiter.on_throttle()
+        else:
+            limiter.on_success()
+        if timed_out:
+            break
+    return success_count, sorted(retry_indexes)
+
+
+def _apply_one(service, limiter, change):
+    """
+    Applies one change with rate limiting and backoff. Returns (slots, error
+    message or None, retryable); retryable marks failures that may succeed
+    later (rate limits, quota, 5xx, network errors).
+
+    An insert whose deterministic id already exists, for example an event the
+    user deleted, which Calendar keeps as cancelled, is turned into an update
+    that restores it. Deleting an event that is already gone counts as success.
+    """
+    from googleapiclient.errors import HttpError
+
+    for attempt in range(CALENDAR_INSERT_ATTEMPTS):
+        if not limiter.acquire(timeout=CALENDAR_ACQUIRE_TIMEOUT_SECONDS):
+            return 0, f"{_describe_change(change)}: Timed out waiting for the Calendar rate limit.", True
+        _count(individual_calls=1)
+        try:
+            # Built and executed on this thread, so it runs on the thread's own pooled
+            # connection (see calendar_service.build_calendar_service)
+            _request(service, change).execute()
+            limiter.on_success()
+            return _succeeded(change), None, False
+        except HttpError as error:
+            status = _http_status(error)
+            if change.kind == 'insert' and change.event_id and status == 409:
+                change = change._replace(kind='update', body=dict(change.body, status='confirmed'))
+                continue
+            if change.kind == 'delete' and status in (404, 410):
+                return _succeeded(change), None, False
+            rate_limited = _is_rate_limited(error)
+            if rate_limited:
+                _count(rate_limited=1)
+                limiter.on_throttle()
+            retryable = rate_limited or status in RETRYABLE_STATUSES
+            if retryable and attempt < CALENDAR_INSERT_ATTEMPTS - 1:
+                _count(retries=1)
+                time.sleep(backoff_delay(attempt, base=CALENDAR_BACKOFF_BASE_SECONDS, cap=CALENDAR_BACKOFF_MAX_SECONDS))
+                continue
+            print(f"An API error occurred: {_describe_change(change)}: {error}")
+            return 0, f"{_describe_change(change)}: {describe_http_error(error)}", retryable
+        except Exception as e:
+            # Usually a connection problem, which a later attempt can get past
+            print(f"An unexpected error occurred: {_describe_change(change)}: {e}")
+            return 0, f"{_describe_change(change)}: Unexpected error - {e}", True
+    return 0, f"{_describe_change(change)}: Gave up after {CALENDAR_INSERT_ATTEMPTS} attempts.", True
+
+
+def apply_event_changes(service, changes, user_key=None, on_result=None):
+    """
+    Applies Calendar writes (EventChange list) for one user, batched where
+    possible and concurrently otherwise, within that user's rate limit.
+
+    Changes go out as batch requests (CALENDAR_BATCH_SIZE calls per round trip);
+    items that fail inside a batch, or every item when batching is off, are
+    sent individually on CALENDAR_INSERT_WORKERS threads. All calls for a user
+    share one adaptive token bucket: 403 rateLimitExceeded / 429 halve its rate
+    and the request is retried with jittered backoff, so a large schedule takes
+    as long as the rate limit requires rather than round trips x events.
+
+    Returns (success_count, error_messages); success_count counts slots, so an
+    event covering several slots counts once for each. Error messages are in
+    `changes` order regardless of which thread finished first.
+
+    service must come from calendar_service.build_calendar_service (as every
+    service from get_calendar_service does): its requests run on a connection
+    of the thread that builds them, which is what makes the worker threads safe.
+
+    on_result(index, slots, error, retryable), if given, is called as soon as
+    each change has its final outcome (from worker threads, so it must be
+    thread-safe), for callers that record progress as it happens.
+    """
+    limiter = get_user_rate_limiter(user_key)
+    if CALENDAR_BATCH_SIZE > 1:
+        success_count, individual_indexes = _apply_batches(service, changes, limiter, on_result)
+        if individual_indexes:
+            print(f"Retrying {len(individual_indexes)} Calendar change(s) individually after batch failures.")
+    else:
+        success_count, individual_indexes = 0, list(range(len(changes)))
+
+    error_messages = []
+    if individual_indexes:
+        workers = max(1, min(CALENDAR_INSERT_WORKERS, len(individual_indexes)))
+
+        def apply(index):
+            slots, error, retryable = _apply_one(service, limiter, changes[index])
+            if on_result is not None:
+                on_result(index, slots, error, retryable)
+            return slots, error
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="calendar-insert") as executor:
+            outcomes = list(executor.map(apply, individual_indexes))
+        for slots, error in outcomes:
+            success_count += slots
+            if error is not None:
+                error_messages.append(error)
+        _count(failed=len(error_messages))
+    return success_count, error_messages
+
+
+def insert_events(service, pending_inserts, user_key=None):
+    """Inserts (slot_codes, course_code, event_body) items; see apply_event_changes."""
+    changes = [EventChange('insert', None, event, slot_codes, course_code)
+               for slot_codes, course_code, event in pending_inserts]
+    return apply_event_changes(service, changes, user_key=user_key)
+
+
+def estimate_write_cost(call_count):
+    """
+    API calls, HTTP round trips and the least time the per-user rate limit allows
+    for call_count writes with the current batching settings (no retries assumed).
+    """
+    if CALENDAR_BATCH_SIZE > 1:
+        http_requests = math.ceil(call_count / CALENDAR_BATCH_SIZE)
+    else:
+        http_requests = call_count
+    throttled_calls = max(0.0, call_count - CALENDAR_USER_BURST)
+    return {'api_calls': call_count, 'http_requests': http_requests,
+            'min_seconds': round(throttled_calls * 60 / CALENDAR_USER_RATE_PER_MINUTE, 1)}
+
+
+def insert_stats():
+    """Lifetime insert counters and settings for monitoring."""
+    with _stats_lock:
+        stats = dict(_stats)
+    with _limiters_lock:
+        stats['tracked_users'] = len(_limiters)
+    stats.update(batch_size=CALENDAR_BATCH_SIZE, workers=CALENDAR_INSERT_WORKERS,
+                 user_rate_per_minute=CALENDAR_USER_RATE_PER_MINUTE)
+    return stats
@@ -0,0 +1,470 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from calendar_inserts import EventChange, apply_event_changes
+from calendar_sync import plan_sync, event_id_for, resolve_term, CALENDAR_INCREMENTAL_SYNC
+from calendar_service import get_pooled_calendar_service
+from credential_cache import get_credential_cache
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Set CALENDAR_OUTBOX_ENABLED=0 to write events synchronously inside the /create_events request.
+CALENDAR_OUTBOX_ENABLED = os.getenv("CALENDAR_OUTBOX_ENABLED", "1") not in ("0", "false", "False", "")
+# SQLite file holding queued event-creation jobs and each of their Calendar writes.
+CALENDAR_OUTBOX_PATH = os.getenv("CALENDAR_OUTBOX_PATH", os.path.join("cache", "calendar_outbox.sqlite3"))
+# Jobs written at once. Jobs of the same user never run side by side (they share one quota).
+CALENDAR_OUTBOX_WORKERS = int(os.getenv("CALENDAR_OUTBOX_WORKERS", "2"))
+# Writes that failed on rate limits, quota or server errors are tried this many times in all,
+# rescheduled after CALENDAR_OUTBOX_RETRY_SECONDS, doubling each time (at most an hour).
+CALENDAR_OUTBOX_MAX_ATTEMPTS = int(os.getenv("CALENDAR_OUTBOX_MAX_ATTEMPTS", "5"))
+CALENDAR_OUTBOX_RETRY_SECONDS = float(os.getenv("CALENDAR_OUTBOX_RETRY_SECONDS", "60"))
+# A running job that reported no progress for this long (its process died) is taken over.
+CALENDAR_OUTBOX_LEASE_SECONDS = float(os.getenv("CALENDAR_OUTBOX_LEASE_SECONDS", "300"))
+# Finished jobs are kept this long for their progress page; unfinished jobs older than this fail as expired.
+CALENDAR_OUTBOX_TTL_SECONDS = int(os.getenv("CALENDAR_OUTBOX_TTL_SECONDS", str(7 * 24 * 3600)))
+# How often the dispatcher looks for jobs that are due; new jobs wake it at once.
+CALENDAR_OUTBOX_POLL_SECONDS = float(os.getenv("CALENDAR_OUTBOX_POLL_SECONDS", "5"))
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+WAITING = "waiting"  # Some writes failed temporarily, or the user's credentials aren't here; retried at next_attempt_at
+DONE = "done"
+FAILED = "failed"
+
+# Write states
+PENDING = "pending"
+WRITTEN = "written"
+REJECTED = "rejected"
+
+MAX_REPORTED_ERRORS = 50
+
+
+class CalendarOutbox:
+    """
+    Durable queue of event-creation jobs, written to Google Calendar by
+    background workers so /create_events returns immediately.
+
+    A job stores its planned events; the first run turns them into individual
+    writes (diffed against the term's existing events with incremental sync)
+    and every write's outcome is committed as soon as Google answers. After a
+    restart or a quota stop only writes still pending are sent again, and since
+    every event has a deterministic id a write that did go through before the
+    crash comes back as a conflict and becomes an update instead of a copy.
+
+    Writes that fail temporarily are retried with growing delays, so a job that
+    hits the daily quota finishes once quota is available again.
+
+    No OAuth credentials are written to the file: a job only records the
+    user's credential-cache key and runs with the credentials held in memory
+    (see credential_cache). A job whose user isn't cached in this process,
+    e.g. after a restart, waits until their next request caches them again:
+    nothing resumes it on its own, and if the user doesn't come back (or keep
+    its progress page open) it expires after CALENDAR_OUTBOX_TTL_SECONDS.
+    Several processes can share the file: jobs are claimed with a lease that
+    a dead process's jobs outlive.
+    """
+
+    def __init__(self, path=CALENDAR_OUTBOX_PATH, workers=CALENDAR_OUTBOX_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._active = {}  # job_id -> user_key of jobs running in this process
+        self._wakeup = threading.Event()
+        self._last_purge = 0.0
+        self.enqueued = 0
+        self.writes = 0
+        self.retries_scheduled = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS calendar_jobs (
+                   job_id           TEXT PRIMARY KEY,
+                   user_key         TEXT,
+                   term             TEXT NOT NULL,
+                   incremental      INTEGER NOT NULL,
+                   status           TEXT NOT NULL,
+                   plan_json        TEXT NOT NULL,
+                   plan_errors_json TEXT NOT NULL,
+                   event_count      INTEGER NOT NULL,
+                   slot_count       INTEGER NOT NULL,
+                   unchanged_slots  INTEGER NOT NULL DEFAULT 0,
+                   prepared         INTEGER NOT NULL DEFAULT 0,
+                   needs_user       INTEGER NOT NULL DEFAULT 0,
+                   runs             INTEGER NOT NULL DEFAULT 0,
+                   next_attempt_at  REAL NOT NULL,
+                   lease_until      REAL,
+                   created_at       REAL NOT NULL,
+                   updated_at       REAL NOT NULL,
+                   finished_at      REAL,
+                   error            TEXT
+               )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS calendar_writes (
+                   job_id          TEXT NOT NULL,
+                   seq             INTEGER NOT NULL,
+                   kind            TEXT NOT NULL,
+                   event_id        TEXT,
+                   body_json       TEXT,
+                   slot_codes_json TEXT NOT NULL,
+                   course_code     TEXT NOT NULL,
+                   status          TEXT NOT NULL,
+                   attempts        INTEGER NOT NULL DEFAULT 0,
+                   slots           INTEGER NOT NULL DEFAULT 0,
+                   error           TEXT,
+                   PRIMARY KEY (job_id, seq)
+               )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_calendar_jobs_due ON calendar_jobs (status, next_attempt_at)"
+        )
+        self._conn.commit()
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="calendar-outbox")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="calendar-outbox-dispatcher",
+                                            daemon=True)
+        self._dispatcher.start()
+
+    # --- Queueing ---
+
+    def enqueue(self, plan, user_key, term=None, incremental=None):
+        """
+        Queues an EventPlan for writing; returns the job id to follow its progress
+        with. user_key (calendar_user_key) names the user's credentials in the
+        credential cache, which must hold them, e.g. after get_calendar_service.
+        term and incremental are as for create_calendar_events.
+        """
+        if incremental is None:
+            incremental = CALENDAR_INCREMENTAL_SYNC
+        term = resolve_term(term, plan.start_date)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        events = [[list(event.slot_codes), event.course_code, event.body] for event in plan.events]
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO calendar_jobs
+                       (job_id, user_key, term, incremental, status, plan_json, plan_errors_json,
+                        event_count, slot_count, next_attempt_at, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (job_id, user_key, term, int(bool(incremental)), QUEUED, json.dumps(events),
+                 json.dumps(list(plan.error_messages)), len(events), plan.slot_count, now, now, now),
+            )
+            self._conn.commit()
+            self.enqueued += 1
+        print(f"Queued Calendar job {job_id}: {len(events)} event(s).")
+        self._wakeup.set()
+        return job_id
+
+    # --- Dispatching ---
+
+    def _dispatch_loop(self):
+        while True:
+            self._wakeup.wait(timeout=CALENDAR_OUTBOX_POLL_SECONDS)
+            self._wakeup.clear()
+            try:
+                self._dispatch()
+            except Exception as e:
+                print(f"Calendar outbox dispatcher error: {e}")
+
+    def _dispatch(self):
+        """Claims due jobs (new, retry time reached, or abandoned) up to the free worker count."""
+        now = time.time()
+        claimed = []
+        with self._lock:
+            if now - self._last_purge > 60:
+                self._purge_locked(now)
+            if len(self._active) >= self.workers:
+                return
+            rows = self._conn.execute(
+                """SELECT job_id, user_key FROM calendar_jobs
+                   WHERE (status IN (?, ?) AND next_attempt_at <= ?) OR (status = ? AND lease_until < ?)
+                   ORDER BY next_attempt_at""",
+                (QUEUED, WAITING, now, RUNNING, now),
+            ).fetchall()
+            for job_id, user_key in rows:
+                if len(self._active) >= self.workers:
+                    break
+                if job_id in self._active or (user_key is not None and user_key in self._active.values()):
+                    continue
+                # The status condition makes the claim atomic between processes sharing the file
+                cursor = self._conn.execute(
+                    """UPDATE calendar_jobs SET status = ?, needs_user = 0, lease_until = ?, updated_at = ?
+                       WHERE job_id = ? AND ((status IN (?, ?) AND next_attempt_at <= ?) OR (status = ? AND lease_until < ?))""",
+                    (RUNNING, now + CALENDAR_OUTBOX_LEASE_SECONDS, now, job_id, QUEUED, WAITING, now, RUNNING, now),
+                )
+                if cursor.rowcount == 1:
+                    self._active[job_id] = user_key
+                    claimed.append(job_id)
+            self._conn.commit()
+        for job_id in claimed:
+            self._executor.submit(self._run_job, job_id)
+
+    def _run_job(self, job_id):
+        try:
+            self._drain(job_id)
+        except Exception as e:
+            print(f"Calendar job {job_id} failed: {e}")
+            self._finish(job_id, FAILED, f"Unexpected error: {e}")
+        finally:
+            with self._lock:
+                self._active.pop(job_id, None)
+            self._wakeup.set()
+
+    # --- Running a Job ---
+
+    def _drain(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT user_key, term, incremental, plan_json, prepared
+                   FROM calendar_jobs WHERE job_id = ?""",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return
+        user_key, term, incremental, plan_json, prepared = row
+        # Only looked up, never seeded: a user not cached here hasn't been seen since a restart (or
+        # their grant was revoked), and the job waits for them; it expires after CALENDAR_OUTBOX_TTL_SECONDS
+        credentials = get_credential_cache().get(user_key, None) if user_key is not None else None
+        if credentials is None:
+            self._wait_for_credentials(job_id)
+            return
+        service = get_pooled_calendar_service(credentials)
+        if not prepared:
+            self._prepare(job_id, service, term, incremental, plan_json)
+
+        writes = self._pending_writes(job_id)
+        if writes:
+            print(f"Calendar job {job_id}: sending {len(writes)} pending write(s).")
+
+            def on_result(index, slots, error, retryable):
+                self._record(job_id, writes[index][0], slots, error, retryable)
+
+            apply_event_changes(service, [change for _, change in writes], user_key=user_key, on_result=on_result)
+        self._settle(job_id)
+
+    def _prepare(self, job_id, service, term, incremental, plan_json):
+        """Turns the job's planned events into individual writes (once per job)."""
+        events = [(tuple(slot_codes), course_code, body) for slot_codes, course_code, body in json.loads(plan_json)]
+        if incremental:
+            changes, unchanged_slots, _ = plan_sync(service, events, term)
+        else:
+            # Deterministic ids still matter here: they make a resumed insert that already went through a no-op
+            changes = [EventChange('insert', event_id_for(term, course_code, slot_codes), body, slot_codes, course_code)
+                       for slot_codes, course_code, body in events]
+            unchanged_slots = 0
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM calendar_writes WHERE job_id = ?", (job_id,))
+            self._conn.executemany(
+                """INSERT INTO calendar_writes (job_id, seq, kind, event_id, body_json, slot_codes_json, course_code, status)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(job_id, seq, change.kind, change.event_id,
+                  json.dumps(change.body) if change.body is not None else None,
+                  json.dumps(list(change.slot_codes)), change.course_code, PENDING)
+                 for seq, change in enumerate(changes)],
+            )
+            self._conn.execute(
+                "UPDATE calendar_jobs SET prepared = 1, unchanged_slots = ?, lease_until = ?, updated_at = ? WHERE job_id = ?",
+                (unchanged_slots, now + CALENDAR_OUTBOX_LEASE_SECONDS, now, job_id),
+            )
+            self._conn.commit()
+
+    def _pending_writes(self, job_id):
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT seq, kind, event_id, body_json, slot_codes_json, course_code FROM calendar_writes
+                   WHERE job_id = ? AND status = ? ORDER BY seq""",
+                (job_id, PENDING),
+            ).fetchall()
+        return [(seq, EventChange(kind, event_id, json.loads(body_json) if body_json else None,
+                                  tuple(json.loads(slot_codes_json)), course_code))
+                for seq, kind, event_id, body_json, slot_codes_json, course_code in rows]
+
+    def _record(self, job_id, seq, slots, error, retryable):
+        """Commits one write's outcome and extends the job's lease (called from insert threads)."""
+        status = WRITTEN if error is None else (PENDING if retryable else REJECTED)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE calendar_writes SET status = ?, slots = ?, error = ?, attempts = attempts + 1 WHERE job_id = ? AND seq = ?",
+                (status, slots, error, job_id, seq),
+            )
+            self._conn.execute(
+                "UPDATE calendar_jobs SET lease_until = ?, updated_at = ? WHERE job_id = ?",
+                (now + CALENDAR_OUTBOX_LEASE_SECONDS, now, job_id),
+            )
+            self._conn.commit()
+            self.writes += 1
+
+    def _settle(self, job_id):
+        """After a run: finishes the job, or schedules another run for writes that may still succeed."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE calendar_writes SET status = ? WHERE job_id = ? AND status = ? AND attempts >= ?",
+                (REJECTED, job_id, PENDING, CALENDAR_OUTBOX_MAX_ATTEMPTS),
+            )
+            pending, runs = self._conn.execute(
+                """SELECT (SELECT COUNT(*) FROM calendar_writes WHERE job_id = ? AND status = ?), runs
+                   FROM calendar_jobs WHERE job_id = ?""",
+                (job_id, PENDING, job_id),
+            ).fetchone()
+            if pending:
+                delay = min(3600.0, CALENDAR_OUTBOX_RETRY_SECONDS * 2 ** runs)
+                self._conn.execute(
+                    """UPDATE calendar_jobs SET status = ?, runs = runs + 1, next_attempt_at = ?, lease_until = NULL,
+                           updated_at = ? WHERE job_id = ?""",
+                    (WAITING, now + delay, now, job_id),
+                )
+                self.retries_scheduled += 1
+                print(f"Calendar job {job_id}: {pending} write(s) failed temporarily; retrying in {delay:.0f}s.")
+            self._conn.commit()
+        if not pending:
+            self._finish(job_id, DONE)
+
+    def _wait_for_credentials(self, job_id):
+        """Puts a job back until its user's credentials are in this process's credential cache."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """UPDATE calendar_jobs SET status = ?, needs_user = 1, next_attempt_at = ?, lease_until = NULL,
+                       updated_at = ? WHERE job_id = ?""",
+                (WAITING, now + CALENDAR_OUTBOX_RETRY_SECONDS, now, job_id),
+            )
+            self._conn.commit()
+        print(f"Calendar job {job_id}: no usable Google authorization for its user here; "
+              f"retrying in {CALENDAR_OUTBOX_RETRY_SECONDS:.0f}s.")
+
+    def _finish(self, job_id, status, error=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """UPDATE calendar_jobs SET status = ?, error = ?, lease_until = NULL,
+                       finished_at = ?, updated_at = ? WHERE job_id = ?""",
+                (status, error, now, now, job_id),
+            )
+            self._conn.commit()
+        print(f"Calendar job {job_id} {status}." + (f" {error}" if error else ""))
+
+    def _purge_locked(self, now):
+        self._last_purge = now
+        cutoff = now - CALENDAR_OUTBOX_TTL_SECONDS
+        expired = self._conn.execute(
+            """UPDATE calendar_jobs SET status = ?, error = ?, finished_at = ?, updated_at = ?
+               WHERE status IN (?, ?) AND created_at < ?""",
+            (FAILED, "The job expired before all events could be written. Authorize again and resubmit to finish it.",
+             now, now, QUEUED, WAITING, cutoff),
+        ).rowcount
+        if expired:
+            print(f"Calendar outbox: {expired} unfinished job(s) expired.")
+        self._conn.execute(
+            """DELETE FROM calendar_writes WHERE job_id IN
+                   (SELECT job_id FROM calendar_jobs WHERE status IN (?, ?) AND finished_at < ?)""",
+            (DONE, FAILED, cutoff),
+        )
+        self._conn.execute("DELETE FROM calendar_jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, cutoff))
+        self._conn.commit()
+
+    # --- Reporting ---
+
+    def job_status(self, job_id):
+        """Progress of one job as a JSON-serializable dict, or None if it is unknown or purged."""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT status, user_key, event_count, slot_count, unchanged_slots, prepared, needs_user,
+                          plan_errors_json, next_attempt_at, created_at, finished_at, error
+                   FROM calendar_jobs WHERE job_id = ?""",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            counts = {status: (count, slots) for status, count, slots in self._conn.execute(
+                "SELECT status, COUNT(*), COALESCE(SUM(slots), 0) FROM calendar_writes WHERE job_id = ? GROUP BY status",
+                (job_id,),
+            )}
+            write_errors = [error for (error,) in self._conn.execute(
+                "SELECT error FROM calendar_writes WHERE job_id = ? AND status = ? ORDER BY seq LIMIT ?",
+                (job_id, REJECTED, MAX_REPORTED_ERRORS),
+            )]
+        (status, user_key, event_count, slot_count, unchanged_slots, prepared, needs_user,
+         plan_errors_json, next_attempt_at, created_at, finished_at, error) = row
+        written, written_slots = counts.get(WRITTEN, (0, 0))
+        rejected = counts.get(REJECTED, (0, 0))[0]
+        pending = counts.get(PENDING, (0, 0))[0] if prepared else event_count
+        success_count = unchanged_slots + written_slots
+        finished = status in (DONE, FAILED)
+        data = {
+            'job_id': job_id,
+            'status': status,
+            'user_key': user_key,
+            'writes_total': written + rejected + pending,
+            'writes_done': written,
+            'writes_failed': rejected,
+            'writes_pending': pending,
+            'success_count': success_count,
+            'failure_count': max(0, slot_count - success_count) if finished else None,
+            'messages': json.loads(plan_errors_json) + write_errors + ([error] if error else []),
+            'elapsed_seconds': round((finished_at or time.time()) - created_at, 1),
+        }
+        if status == WAITING:
+            data['retry_in_seconds'] = max(0, round(next_attempt_at - time.time()))
+            # Paused until the user is seen again (nothing else resumes it); it fails once expires_in_seconds pass
+            data['waiting_for_user'] = bool(needs_user)
+            data['expires_in_seconds'] = max(0, round(created_at + CALENDAR_OUTBOX_TTL_SECONDS - time.time()))
+        return data
+
+    def stats(self):
+        """Returns job counts by state and lifetime counters for monitoring."""
+        with self._lock:
+            by_status = dict(self._conn.execute("SELECT status, COUNT(*) FROM calendar_jobs GROUP BY status").fetchall())
+            pending_writes = self._conn.execute(
+                "SELECT COUNT(*) FROM calendar_writes WHERE status = ?", (PENDING,)
+            ).fetchone()[0]
+            active = len(self._active)
+        return {
+            'workers': self.workers,
+            'running_here': active,
+            'jobs': {status: by_status.get(status, 0) for status in (QUEUED, RUNNING, WAITING, DONE, FAILED)},
+            'pending_writes': pending_writes,
+            'enqueued': self.enqueued,
+            'writes': self.writes,
+            'retries_scheduled': self.retries_scheduled,
+        }
+
+
+# --- Shared Instance ---
+_outbox_instance = None
+_outbox_instance_lock = threading.Lock()
+
+
+def get_calendar_outbox():
+    """
+    Returns the process-wide outbox, starting its dispatcher and opening its
+    file on first use (None when disabled or the file can't be opened).
+    """
+    global _outbox_instance
+    if not CALENDAR_OUTBOX_ENABLED:
+        return None
+    if _outbox_instance is None:
+        with _outbox_instance_lock:
+            if _outbox_instance is None:
+                try:
+                    _outbox_instance = CalendarOutbox()
+                except Exception as e:
+                    print(f"Warning: Could not open Calendar outbox at '{CALENDAR_OUTBOX_PATH}': {e}")
+                    return None
+    return _outbox_instance
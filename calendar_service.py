@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Calendar service objects kept for reuse, one per Google user (least recently used dropped).
+CALENDAR_SERVICE_CACHE_SIZE = int(os.getenv("CALENDAR_SERVICE_CACHE_SIZE", "128"))
+CALENDAR_HTTP_TIMEOUT_SECONDS = float(os.getenv("CALENDAR_HTTP_TIMEOUT_SECONDS", "30"))
+
+_discovery_document = None
+_services = OrderedDict()  # credential key -> (credentials, service)
+_lock = threading.Lock()
+_thread_local = threading.local()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'build_ms': 0.0}
+
+
+def calendar_discovery_document():
+    """
+    The Calendar v3 discovery document bundled with googleapiclient, parsed once
+    per process. Nothing is fetched over the network.
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        with _lock:
+            if _discovery_document is None:
+                from googleapiclient.discovery_cache import get_static_doc
+                document = get_static_doc("calendar", "v3")
+                if document is None:
+                    raise RuntimeError("googleapiclient has no bundled Calendar v3 discovery document")
+                _discovery_document = json.loads(document)
+    return _discovery_document
+
+
+def _thread_http(credentials):
+    """
+    This thread's authorized HTTP client for credentials. httplib2 clients keep
+    their connections alive between requests but must not be shared across
+    threads, so each thread gets its own, reused for every request it makes.
+    """
+    pool = getattr(_thread_local, 'pool', None)
+    if pool is None:
+        pool = _thread_local.pool = weakref.WeakKeyDictionary()
+    http = pool.get(credentials)
+    if http is None:
+        import httplib2
+        import google_auth_httplib2
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=CALENDAR_HTTP_TIMEOUT_SECONDS))
+        pool[credentials] = http
+    return http
+
+
+def build_calendar_service(credentials):
+    """
+    Builds a Calendar v3 service from the cached discovery document. Requests
+    made through it run on the calling thread's pooled connection, so one
+    service can be shared by concurrent requests and worker threads.
+    """
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.http import HttpRequest
+
+    def request_builder(http, *args, **kwargs):
+        return HttpRequest(_thread_http(credentials), *args, **kwargs)
+
+    return build_from_document(calendar_discovery_document(), http=_thread_http(credentials),
+                               requestBuilder=request_builder)
+
+
+def _credentials_key(credentials):
+    identity = f"{getattr(credentials, 'client_id', '')}|{credentials.refresh_token or credentials.token}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+def get_pooled_calendar_service(credentials):
+    """
+    Returns a Calendar service for these credentials, reusing the one built for
+    the same Google user (client id + refresh token) earlier when there is one.
+    A cached service keeps its own Credentials object, which AuthorizedHttp
+    refreshes by itself when the access token expires.
+    """
+    key = _credentials_key(credentials)
+    with _lock:
+        entry = _services.get(key)
+        if entry is not None:
+            _services.move_to_end(key)
+            _stats['hits'] += 1
+            return entry[1]
+
+    started = time.perf_counter()
+    service = build_calendar_service(credentials)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _lock:
+        _stats['misses'] += 1
+        _stats['build_ms'] += elapsed_ms
+        _services[key] = (credentials, service)
+        _services.move_to_end(key)
+        while len(_services) > CALENDAR_SERVICE_CACHE_SIZE:
+            _services.popitem(last=False)
+            _stats['evictions'] += 1
+    return service
+
+
+def service_cache_stats():
+    """Service cache hit/miss counters and the average cost of a build, for monitoring."""
+    with _lock:
+        misses = _stats['misses']
+        return {
+            'cached_services': len(_services),
+            'max_services': CALENDAR_SERVICE_CACHE_SIZE,
+            'hits': _stats['hits'],
+            'misses': misses,
+            'evictions': _stats['evictions'],
+            'avg_build_ms': round(_stats['build_ms'] / misses, 2) if misses else 0.0,
+            'discovery_document_loaded': _discovery_document is not None,
+        }
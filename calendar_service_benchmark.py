@@ -0,0 +1,60 @@
+"""
+Measures what it costs to get a Calendar service object for a request.
+
+Compares googleapiclient's build('calendar', 'v3') on every request, as
+get_calendar_service used to do, with building from the once-parsed bundled
+discovery document and with the pooled per-user service cache. No network
+access is needed: anonymous credentials are used and no request is sent.
+
+Usage:
+    python calendar_service_benchmark.py [--repeat 50]
+"""
+import sys
+import time
+import argparse
+
+
+def time_ms(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Calendar service construction.")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+    from calendar_service import build_calendar_service, get_pooled_calendar_service, calendar_discovery_document
+
+    credentials = Credentials(token="benchmark-token", refresh_token="benchmark-refresh",
+                              client_id="benchmark-client", client_secret="benchmark-secret",
+                              token_uri="https://oauth2.googleapis.com/token")
+
+    first_load_ms = time_ms(calendar_discovery_document, 1)
+    per_request_build_ms = time_ms(lambda: build('calendar', 'v3', credentials=credentials, cache_discovery=False),
+                                   args.repeat)
+    from_document_ms = time_ms(lambda: build_calendar_service(credentials), args.repeat)
+    get_pooled_calendar_service(credentials)  # Warm the cache
+    pooled_ms = time_ms(lambda: get_pooled_calendar_service(credentials), args.repeat)
+
+    print(f"Calendar service per request (best of {args.repeat}):")
+    print(f"  {'build() every request':<30}{per_request_build_ms:9.3f} ms")
+    print(f"  {'build from cached document':<30}{from_document_ms:9.3f} ms")
+    print(f"  {'pooled service (cache hit)':<30}{pooled_ms:9.3f} ms")
+    print(f"  (one-time discovery document load: {first_load_ms:.1f} ms)")
+    if pooled_ms >= per_request_build_ms:
+        print("\nFAIL: the pooled service is not faster than building one per request")
+        return 1
+    print(f"\nOK: {per_request_build_ms / max(pooled_ms, 1e-6):.0f}x less time spent getting a service per request")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import os
+import json
+import base64
+import hashlib
+from dotenv import load_dotenv
+
+from calendar_inserts import EventChange
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Diff against the events a previous run created instead of inserting everything again.
+CALENDAR_INCREMENTAL_SYNC = os.getenv("CALENDAR_INCREMENTAL_SYNC", "1") not in ("0", "false", "False", "")
+
+# Private extended properties stamped on every synced event.
+TERM_PROPERTY = "timetableTerm"
+HASH_PROPERTY = "timetableHash"
+
+
+def term_id(term):
+    """Short stable id for a term (see resolve_term), stored on each event."""
+    return hashlib.sha256(term.encode("utf-8")).hexdigest()[:16]
+
+
+def default_term(start_date_obj):
+    """
+    Term for a schedule without a semester label: the half-year its start date
+    falls in ("2026-H1" for December to June starts, "2026-H2" for July to
+    November), so moving the start date by a few days keeps the same term.
+    """
+    if start_date_obj.month == 12:
+        return f"{start_date_obj.year + 1}-H1"
+    return f"{start_date_obj.year}-H{1 if start_date_obj.month <= 6 else 2}"
+
+
+def resolve_term(term, start_date_obj):
+    """
+    Returns the term a schedule syncs under: the user's semester label, or
+    default_term(start_date) without one. Event ids and the term property
+    derive from it, so it must stay the same between runs.
+    """
+    return (term or "").strip() or default_term(start_date_obj)
+
+
+def event_id_for(term, course_code, slot_codes):
+    """
+    Deterministic Calendar event id for one course's slot(s) in a term. Calendar
+    ids must use base32hex characters (a-v, 0-9), so re-running a sync addresses
+    the same event instead of creating a copy.
+    """
+    key = f"{term}|{course_code.strip().upper()}|{','.join(sorted(slot_codes))}"
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return "tt" + base64.b32hexencode(digest).decode("ascii").lower().rstrip("=")[:30]
+
+
+def _content_hash(body):
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def list_synced_events(service, term):
+    """Returns {event_id: content_hash} for this term's events already in the calendar."""
+    existing = {}
+    page_token = None
+    while True:
+        response = service.events().list(
+            calendarId='primary',
+            privateExtendedProperty=f"{TERM_PROPERTY}={term_id(term)}",
+            maxResults=2500,
+            pageToken=page_token,
+            fields="items(id,extendedProperties/private),nextPageToken",
+        ).execute()
+        for item in response.get('items', []):
+            private = item.get('extendedProperties', {}).get('private', {})
+            existing[item['id']] = private.get(HASH_PROPERTY)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return existing
+
+
+def plan_sync(service, pending_inserts, term):
+    """
+    Turns the events a run wants to exist into the minimal set of changes.
+
+    pending_inserts is a list of (slot_codes, course_code, event_body). Events
+    already present with identical content are left alone, changed ones are
+    patched, new ones inserted under their deterministic id, and events from an
+    earlier run of the same term that are no longer wanted are deleted.
+
+    Returns (changes, unchanged_slot_count, summary).
+    """
+    desired = {}
+    for slot_codes, course_code, event in pending_inserts:
+        event_id = event_id_for(term, course_code, slot_codes)
+        content_hash = _content_hash(event)
+        body = dict(event, extendedProperties={'private': {TERM_PROPERTY: term_id(term), HASH_PROPERTY: content_hash}})
+        desired[event_id] = (slot_codes, course_code, body, content_hash)
+
+    try:
+        existing = list_synced_events(service, term)
+    except Exception as e:
+        # Inserting under deterministic ids still can't create duplicates; conflicts turn into updates
+        print(f"Warning: Could not list existing events, inserting everything by id: {e}")
+        existing = {}
+
+    changes = []
+    unchanged_slots = 0
+    summary = {'insert': 0, 'patch': 0, 'delete': 0, 'unchanged': 0}
+    for event_id, (slot_codes, course_code, body, content_hash) in desired.items():
+        if event_id not in existing:
+            changes.append(EventChange('insert', event_id, body, slot_codes, course_code))
+            summary['insert'] += 1
+        elif existing[event_id] != content_hash:
+            changes.append(EventChange('patch', event_id, body, slot_codes, course_code))
+            summary['patch'] += 1
+        else:
+            unchanged_slots += len(slot_codes)
+            summary['unchanged'] += 1
+    for event_id in existing:
+        if event_id not in desired:
+            changes.append(EventChange('delete', event_id, None, [], ""))
+            summary['delete'] += 1
+    print(f"Calendar sync plan: {summary['insert']} to insert, {summary['patch']} to update, "
+          f"{summary['delete']} to delete, {summary['unchanged']} unchanged.")
+    return changes, unchanged_slots, summary
@@ -0,0 +1,102 @@
+"""
+Microbenchmark for the pre-insert conflict check, minus its API calls.
+
+Plans a synthetic schedule, expands its recurring events into occurrences and
+matches them against random busy periods with the interval index, checking
+the result against a brute-force comparison of every pair. Half the planned
+events are taken to exist from an earlier run: freebusy reports them as busy
+too, and they must not count as conflicts.
+
+Usage:
+    python conflict_benchmark.py [--courses 20] [--busy 300] [--repeat 200]
+"""
+import io
+import sys
+import random
+import timeit
+import argparse
+import contextlib
+
+from ocr_script import slot_table
+from google_calendar_utils import plan_calendar_events, parse_date_range
+from calendar_conflicts import expand_occurrences, find_conflicts, freebusy_windows, CALENDAR_FREEBUSY_CHUNK_DAYS
+
+
+def sample_schedule(courses):
+    codes = sorted(slot_table.codes)
+    rng = random.Random(0)
+    return [{"course_code": f"CSE{1000 + i}", "course_name": f"Course {i}", "faculty_name": f"Dr. Faculty {i}",
+             "venue": f"SJT{100 + i}", "slots": rng.sample(codes, 3)} for i in range(courses)]
+
+
+def sample_busy(occurrences, count):
+    """Busy periods of 30 minutes to 3 hours spread over the term."""
+    rng = random.Random(1)
+    first, last = occurrences[0][0], occurrences[-1][1]
+    periods = []
+    for _ in range(count):
+        start = rng.uniform(first, last) // 900 * 900
+        periods.append((start, start + rng.choice((1800, 3600, 5400, 10800))))
+    return periods
+
+
+def brute_force(occurrences, busy, own):
+    """Conflicting occurrences: busy time within them that no own event accounts for."""
+    count = 0
+    for start, end, _ in occurrences:
+        for busy_start, busy_end in busy:
+            low, high = max(start, busy_start), min(end, busy_end)
+            if low >= high:
+                continue
+            # Walk the own events over [low, high) in start order; a gap is busy time of someone else
+            for own_start, own_end in sorted(own):
+                if own_start <= low < own_end:
+                    low = own_end
+            if low < high:
+                count += 1
+                break
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark expanding a plan and finding its conflicts locally.")
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--busy", type=int, default=300, help="Busy periods returned by the (simulated) freebusy query.")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--timezone", default="Asia/Kolkata")
+    args = parser.parse_args()
+
+    start_date, end_date = parse_date_range("2025-01-06", "2025-05-09")
+    with contextlib.redirect_stdout(io.StringIO()):  # The planner logs each coalesced course
+        plan = plan_calendar_events(sample_schedule(args.courses), slot_table, start_date, end_date, args.timezone)
+    occurrences = expand_occurrences(plan)
+    own = [(start, end) for start, end, event_index in occurrences if event_index % 2 == 0]
+    busy = sample_busy(occurrences, args.busy) + own
+
+    conflicts, occurrence_count, _ = find_conflicts(plan, busy, occurrences, own)
+    expected = brute_force(occurrences, busy, own)
+    found = sum(conflict['count'] for conflict in conflicts)
+    if found != expected:
+        print(f"FAIL: the interval index found {found} conflicting occurrences, brute force {expected}")
+        return 1
+
+    timings = [
+        ("expand", lambda: expand_occurrences(plan)),
+        ("match", lambda: find_conflicts(plan, busy, occurrences, own)),
+        ("expand + match", lambda: find_conflicts(plan, busy, own_periods=own)),
+    ]
+    print(f"{args.courses}-course schedule: {len(plan.events)} events, {occurrence_count} occurrences, "
+          f"{len(busy)} busy periods ({len(own)} of them own events), {found} conflicting occurrences")
+    for name, func in timings:
+        seconds = min(timeit.repeat(func, number=args.repeat, repeat=3)) / args.repeat
+        print(f"  {name:<16}{seconds * 1000:9.3f} ms")
+    windows = len(freebusy_windows(occurrences[0][0], max(end for _, end, _ in occurrences)))
+    own_pages = -(-len(own) // 2500)
+    print(f"\nOK: matches brute force; against Calendar the check makes {windows + max(own_pages, 1)} API call(s): "
+          f"{windows} freebusy.query (windows of up to {CALENDAR_FREEBUSY_CHUNK_DAYS} days) and "
+          f"{max(own_pages, 1)} events.list page(s) of the term's own events")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
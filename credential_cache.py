@@ -0,0 +1,229 @@
+import os
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Users whose OAuth credentials are kept in memory (least recently used are dropped beyond this).
+CREDENTIAL_CACHE_MAX_USERS = int(os.getenv("CREDENTIAL_CACHE_MAX_USERS", "1000"))
+# Access tokens expiring within this many seconds are refreshed in the background while the
+# current one is still used. Keep it above google-auth's own expiry skew (~4 minutes), after
+# which it treats a token as expired.
+CREDENTIAL_REFRESH_MARGIN_SECONDS = float(os.getenv("CREDENTIAL_REFRESH_MARGIN_SECONDS", "600"))
+# Threads doing token refreshes.
+CREDENTIAL_REFRESH_WORKERS = int(os.getenv("CREDENTIAL_REFRESH_WORKERS", "2"))
+# How long a request waits for a refresh when it has no usable access token at all.
+CREDENTIAL_REFRESH_TIMEOUT_SECONDS = float(os.getenv("CREDENTIAL_REFRESH_TIMEOUT_SECONDS", "20"))
+
+_thread_local = threading.local()
+
+
+def _seconds_left(credentials):
+    """Seconds until the access token expires, or None when the expiry isn't known."""
+    expiry = credentials.expiry
+    if expiry is None:
+        return None
+    if expiry.tzinfo is not None:
+        expiry = expiry.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (expiry - now).total_seconds()
+
+
+def _auth_request():
+    """This thread's token-endpoint transport, so refreshes reuse one keep-alive connection."""
+    request = getattr(_thread_local, 'request', None)
+    if request is None:
+        from google.auth.transport.requests import Request
+        request = _thread_local.request = Request()
+    return request
+
+
+class _CachedCredentials:
+    __slots__ = ('credentials', 'refresh', 'last_used')
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.refresh = None  # Future of the refresh in flight, if any
+        self.last_used = time.time()
+
+
+class CredentialCache:
+    """
+    Server-side OAuth credentials, one Credentials object per Google user.
+
+    The session cookie only seeds the cache: once a user's credentials are here,
+    refreshed tokens are kept here and the cookie's (possibly stale) access token
+    is ignored, so nothing depends on the browser sending the updated cookie back.
+
+    Refreshes never run on a request thread. A token within
+    CREDENTIAL_REFRESH_MARGIN_SECONDS of expiry is refreshed in the background
+    while requests keep using it. Only a request holding no usable token at all
+    waits, and then on the same refresh as every other request for that user
+    (single flight), so concurrent tabs cause one token call, not one each.
+
+    A refresh the token endpoint rejects (revoked or expired grant) drops the
+    user's entry, and the caller has to send them through authorization again.
+    With several server processes every process keeps its own cache and falls
+    back to the cookie on a miss.
+    """
+
+    def __init__(self, max_users=CREDENTIAL_CACHE_MAX_USERS, margin_seconds=CREDENTIAL_REFRESH_MARGIN_SECONDS,
+                 workers=CREDENTIAL_REFRESH_WORKERS):
+        self.max_users = max_users
+        self.margin_seconds = margin_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="credential-refresh")
+        self._entries = OrderedDict()  # user key -> _CachedCredentials
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_ms = 0.0
+        self.refresh_failures = 0
+        self.joined_refreshes = 0
+        self.blocking_waits = 0
+        self.evictions = 0
+
+    def _entry(self, user_key, credentials_dict, scopes):
+        with self._lock:
+            entry = self._entries.get(user_key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(user_key)
+                return entry
+            self.misses += 1
+        if not credentials_dict:
+            return None
+        from google.oauth2.credentials import Credentials
+        try:
+            credentials = Credentials.from_authorized_user_info(credentials_dict, scopes)
+        except Exception as e:
+            print(f"Error rebuilding credentials from dict: {e}")
+            return None
+        return self.put(user_key, credentials)
+
+    def put(self, user_key, credentials):
+        """Caches credentials for a user (e.g. straight after authorization); returns the entry kept."""
+        with self._lock:
+            entry = self._entries.get(user_key)
+            if entry is None or entry.credentials is not credentials:
+                entry = self._entries[user_key] = _CachedCredentials(credentials)
+            self._entries.move_to_end(user_key)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def forget(self, user_key):
+        """Drops a user's cached credentials (on sign-out)."""
+        with self._lock:
+            self._entries.pop(user_key, None)
+
+    def _start_refresh(self, user_key, entry):
+        """Returns the refresh in flight for this entry, starting one if there is none."""
+        with self._lock:
+            if entry.refresh is None:
+                entry.refresh = self._executor.submit(self._refresh, user_key, entry)
+            else:
+                self.joined_refreshes += 1
+            return entry.refresh
+
+    def _refresh(self, user_key, entry):
+        from google.auth.exceptions import RefreshError
+
+        started = time.perf_counter()
+        drop = False
+        try:
+            entry.credentials.refresh(_auth_request())
+            succeeded = True
+        except RefreshError as e:
+            succeeded = False
+            # invalid_grant and the like won't go away by retrying: the user must authorize again
+            drop = not getattr(e, 'retryable', False)
+            print(f"Error refreshing token: {e}")
+        except Exception as e:
+            succeeded = False
+            print(f"Error refreshing token: {e}")
+        with self._lock:
+            entry.refresh = None
+            self.refreshes += 1
+            self.refresh_ms += (time.perf_counter() - started) * 1000
+            if not succeeded:
+                self.refresh_failures += 1
+            if drop and self._entries.get(user_key) is entry:
+                del self._entries[user_key]
+        return succeeded
+
+    def get(self, user_key, credentials_dict, scopes=None, wait=True):
+        """
+        Returns the user's Credentials with a usable access token, or None when
+        there is none and it can't be refreshed. credentials_dict (the session
+        copy) is only read when the user isn't cached yet.
+
+        With wait=False nothing blocks: a needed refresh is only started, and
+        the credentials are returned whether or not they are usable yet.
+        """
+        entry = self._entry(user_key, credentials_dict, scopes)
+        if entry is None:
+            return None
+        entry.last_used = time.time()
+        credentials = entry.credentials
+        seconds_left = _seconds_left(credentials)
+        if credentials.valid and seconds_left is not None and seconds_left > self.margin_seconds:
+            return credentials
+        if not credentials.refresh_token:
+            return credentials if credentials.valid or not wait else None
+        # Expiring soon, expired, or of unknown age (sessions from before expiry was stored)
+        future = self._start_refresh(user_key, entry)
+        if credentials.valid or not wait:
+            return credentials
+        with self._lock:
+            self.blocking_waits += 1
+        try:
+            succeeded = future.result(timeout=CREDENTIAL_REFRESH_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            print(f"Token refresh did not finish within {CREDENTIAL_REFRESH_TIMEOUT_SECONDS:.0f}s.")
+            return None
+        return credentials if succeeded and credentials.valid else None
+
+    def prefetch(self, user_key, credentials_dict, scopes=None):
+        """Caches the user's credentials and starts a refresh if one will be needed soon, without waiting."""
+        self.get(user_key, credentials_dict, scopes, wait=False)
+
+    def stats(self):
+        """Returns cache size and refresh counters for monitoring."""
+        with self._lock:
+            return {
+                'cached_users': len(self._entries),
+                'max_users': self.max_users,
+                'refresh_margin_seconds': self.margin_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'avg_refresh_ms': round(self.refresh_ms / self.refreshes, 1) if self.refreshes else 0.0,
+                'refresh_failures': self.refresh_failures,
+                'joined_refreshes': self.joined_refreshes,
+                'blocking_waits': self.blocking_waits,
+                'evictions': self.evictions,
+            }
+
+
+# --- Shared Instance ---
+_cache_instance = None
+_cache_instance_lock = threading.Lock()
+
+
+def get_credential_cache():
+    """Returns the process-wide credential cache, creating its refresh pool on first use."""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_instance_lock:
+            if _cache_instance is None:
+                _cache_instance = CredentialCache()
+    return _cache_instance
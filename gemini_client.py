@@ -0,0 +1,70 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+API_KEY = os.getenv("GEMINI_API_KEY") # Use environment variable
+
+# google.generativeai pulls in grpc/protobuf and takes a noticeable share of app
+# startup, so it is imported and configured on first use rather than at import time.
+_genai = None
+_configured = None  # None = not attempted yet, then True/False
+_models = {}
+_lock = threading.Lock()
+
+
+def _configure_locked():
+    global _genai, _configured
+    if _configured is not None:
+        return _configured
+    if not API_KEY:
+        print("Warning: GEMINI_API_KEY not found in environment variables or .env file.")
+        print("OCR functionality will likely fail.")
+        _configured = False
+        return _configured
+    try:
+        import google.generativeai as genai
+        genai.configure(api_key=API_KEY)
+        _genai = genai
+        _configured = True
+        print("Gemini API Key configured successfully.")
+    except Exception as e:
+        print(f"Error configuring Gemini API: {e}")
+        print("OCR functionality will likely fail.")
+        _configured = False
+    return _configured
+
+
+def is_gemini_configured():
+    """Imports and configures the Gemini SDK on first call; returns whether it is usable."""
+    if _configured is None:
+        with _lock:
+            _configure_locked()
+    return bool(_configured)
+
+
+def get_genai():
+    """Returns the configured google.generativeai module, or None if it is unavailable."""
+    return _genai if is_gemini_configured() else None
+
+
+def get_gemini_model(model_name):
+    """
+    Returns a GenerativeModel for model_name, created once and shared by every
+    request so its underlying client (and HTTP/gRPC connections) stay warm.
+    GenerativeModel.generate_content is safe to call from several threads.
+    """
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    if not is_gemini_configured():
+        return None
+    with _lock:
+        model = _models.get(model_name)
+        if model is None:
+            model = _genai.GenerativeModel(model_name)
+            _models[model_name] = model
+    return model
@@ -0,0 +1,324 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Sustained Gemini request rate shared by every upload in this process (or host, with sqlite).
+GEMINI_RATE_PER_MINUTE = float(os.getenv("GEMINI_RATE_PER_MINUTE", "15"))
+# Requests that may be sent back-to-back before the rate applies.
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "5"))
+# How long a request waits for a token before giving up.
+GEMINI_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("GEMINI_ACQUIRE_TIMEOUT_SECONDS", "30"))
+# "memory" limits a single process; "sqlite" shares the bucket between worker processes on one host.
+GEMINI_LIMITER_BACKEND = os.getenv("GEMINI_LIMITER_BACKEND", "memory").lower()
+GEMINI_LIMITER_PATH = os.getenv("GEMINI_LIMITER_PATH", os.path.join("cache", "gemini_limiter.sqlite3"))
+# Retry backoff: base * 2**attempt, capped, with full jitter.
+GEMINI_BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", "2"))
+GEMINI_BACKOFF_MAX_SECONDS = float(os.getenv("GEMINI_BACKOFF_MAX_SECONDS", "30"))
+# Circuit breaker: open after this many consecutive 503/429s, fail fast for the cool-down.
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "60"))
+
+# Throttling halves the effective rate down to this fraction of the configured rate;
+# each success wins back a tenth of the configured rate.
+MIN_RATE_FRACTION = 0.1
+RECOVERY_FRACTION = 0.1
+
+
+def backoff_delay(attempt, base=GEMINI_BACKOFF_BASE_SECONDS, cap=GEMINI_BACKOFF_MAX_SECONDS):
+    """Exponential backoff with full jitter for the given zero-based retry attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    In-process token bucket with an adaptive rate (AIMD): throttling responses
+    halve the refill rate, successes slowly restore it.
+    """
+
+    def __init__(self, rate_per_minute=GEMINI_RATE_PER_MINUTE, burst=GEMINI_BURST):
+        self.base_rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._rate = self.base_rate
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.timeouts = 0
+        self.waited_seconds = 0.0
+
+    def _refill_locked(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _try_take(self):
+        """Takes a token if available; otherwise returns the seconds until one will be."""
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self._rate
+
+    def acquire(self, timeout=GEMINI_ACQUIRE_TIMEOUT_SECONDS):
+        """Blocks until a token is available; returns False if that would exceed timeout."""
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            wait = self._try_take()
+            now = time.monotonic()
+            if wait == 0.0:
+                with self._lock:
+                    self.granted += 1
+                    self.waited_seconds += now - start
+                return True
+            if now + wait > deadline:
+                with self._lock:
+                    self.timeouts += 1
+                return False
+            time.sleep(wait)
+
+    def _set_rate(self, rate):
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            self._rate = rate
+
+    def on_throttle(self):
+        """Multiplicative decrease after a 429/503."""
+        self._set_rate(max(self.base_rate * MIN_RATE_FRACTION, self._rate / 2))
+
+    def on_success(self):
+        """Additive increase back toward the configured rate."""
+        self._set_rate(min(self.base_rate, self._rate + self.base_rate * RECOVERY_FRACTION))
+
+    def stats(self):
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            return {
+                'backend': 'memory',
+                'rate_per_minute': round(self._rate * 60, 2),
+                'configured_rate_per_minute': round(self.base_rate * 60, 2),
+                'burst': self.burst,
+                'tokens': round(self._tokens, 2),
+                'granted': self.granted,
+                'timeouts': self.timeouts,
+                'waited_seconds': round(self.waited_seconds, 2),
+            }
+
+
+class SqliteTokenBucket(TokenBucket):
+    """
+    Token bucket whose state lives in a SQLite row, so every worker process on
+    the host draws from the same budget. Updates run in IMMEDIATE transactions.
+    Wall-clock time is used since monotonic clocks aren't comparable across processes.
+    """
+
+    def __init__(self, path=GEMINI_LIMITER_PATH, rate_per_minute=GEMINI_RATE_PER_MINUTE,
+                 burst=GEMINI_BURST, name="gemini"):
+        super().__init__(rate_per_minute, burst)
+        self.path = path
+        self.name = name
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: transactions are managed explicitly below
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS token_buckets (
+                   name    TEXT PRIMARY KEY,
+                   tokens  REAL NOT NULL,
+                   rate    REAL NOT NULL,
+                   updated REAL NOT NULL
+               )"""
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO token_buckets (name, tokens, rate, updated) VALUES (?, ?, ?, ?)",
+            (name, burst, self.base_rate, time.time()),
+        )
+
+    def _update(self, func):
+        """Runs func(tokens, rate, now) -> (tokens, rate, result) atomically across processes."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, rate, updated = self._conn.execute(
+                    "SELECT tokens, rate, updated FROM token_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                now = time.time()
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * rate)
+                tokens, rate, result = func(tokens, rate, now)
+                self._conn.execute(
+                    "UPDATE token_buckets SET tokens = ?, rate = ?, updated = ? WHERE name = ?",
+                    (tokens, rate, now, self.name),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _try_take(self):
+        def take(tokens, rate, now):
+            if tokens >= 1:
+                return tokens - 1, rate, 0.0
+            return tokens, rate, (1 - tokens) / rate
+        return self._update(take)
+
+    def on_throttle(self):
+        self._update(lambda tokens, rate, now: (tokens, max(self.base_rate * MIN_RATE_FRACTION, rate / 2), None))
+
+    def on_success(self):
+        self._update(lambda tokens, rate, now: (tokens, min(self.base_rate, rate + self.base_rate * RECOVERY_FRACTION), None))
+
+    def stats(self):
+        tokens, rate = self._update(lambda tokens, rate, now: (tokens, rate, (tokens, rate)))
+        with self._lock:
+            return {
+                'backend': 'sqlite',
+                'rate_per_minute': round(rate * 60, 2),
+                'configured_rate_per_minute': round(self.base_rate * 60, 2),
+                'burst': self.burst,
+                'tokens': round(tokens, 2),
+                'granted': self.granted,
+                'timeouts': self.timeouts,
+                'waited_seconds': round(self.waited_seconds, 2),
+            }
+
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated overload responses from Gemini.
+
+    closed    -> requests flow; consecutive 503/429s are counted.
+    open      -> requests are refused until the cool-down passes.
+    half_open -> a single probe request is let through; success closes the
+                 breaker, another overload re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=GEMINI_BREAKER_THRESHOLD, cooldown_seconds=GEMINI_BREAKER_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Returns True if a request may be sent now."""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                    self.rejected += 1
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """Records a 503/429-style overload response."""
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def record_neutral(self):
+        """
+        Ends a half-open probe that failed for reasons unrelated to overload.
+
+        The consecutive-failure count is deliberately left alone: a timeout, bad
+        key or blocked prompt says nothing about whether Gemini has recovered, so
+        it neither extends nor breaks a streak of overload responses. Only a
+        success resets it.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_after(self):
+        """Seconds until the breaker will let a probe through (0 when not open)."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.cooldown_seconds - (time.monotonic() - self._opened_at))
+
+    def stats(self):
+        retry_after = self.retry_after()
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._consecutive_failures,
+                'threshold': self.threshold,
+                'cooldown_seconds': self.cooldown_seconds,
+                'retry_after_seconds': round(retry_after, 1),
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+            }
+
+
+# --- Shared Instances ---
+_bucket_instance = None
+_breaker_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Returns the shared Gemini token bucket (sqlite-backed if configured and available)."""
+    global _bucket_instance
+    if _bucket_instance is None:
+        with _instance_lock:
+            if _bucket_instance is None:
+                if GEMINI_LIMITER_BACKEND == "sqlite":
+                    try:
+                        _bucket_instance = SqliteTokenBucket()
+                    except Exception as e:
+                        print(f"Warning: Could not open shared rate limiter at '{GEMINI_LIMITER_PATH}', "
+                              f"falling back to in-process limiting: {e}")
+                if _bucket_instance is None:
+                    _bucket_instance = TokenBucket()
+    return _bucket_instance
+
+
+def get_circuit_breaker():
+    """Returns the process-wide Gemini circuit breaker."""
+    global _breaker_instance
+    if _breaker_instance is None:
+        with _instance_lock:
+            if _breaker_instance is None:
+                _breaker_instance = CircuitBreaker()
+    return _breaker_instance
+
+
+def limiter_stats():
+    """Rate limiter and circuit breaker state for monitoring."""
+    return {
+        'rate_limiter': get_rate_limiter().stats(),
+        'circuit_breaker': get_circuit_breaker().stats(),
+    }
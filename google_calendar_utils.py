@@ -3,65 +3,89 @@ import os.path
 import pickle
 import re # For splitting slots string
 import json
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from slot_table import SlotTable, compile_slot_table, DAY_TO_WEEKDAY, DAY_TO_RRULE
+from calendar_inserts import insert_events, apply_event_changes, insert_stats, estimate_write_cost
+from calendar_sync import plan_sync, resolve_term, CALENDAR_INCREMENTAL_SYNC
+from calendar_service import get_pooled_calendar_service, service_cache_stats
+from credential_cache import get_credential_cache
+from calendar_conflicts import conflict_stats
+
+# Merge a course's slots that share a start/end time into one multi-day recurring event.
+CALENDAR_COALESCE_SLOTS = os.getenv("CALENDAR_COALESCE_SLOTS", "1") not in ("0", "false", "False", "")
+
+# Plans kept for reuse, e.g. between a dry run and the confirmed run (least recently used dropped).
+CALENDAR_PLAN_CACHE_SIZE = int(os.getenv("CALENDAR_PLAN_CACHE_SIZE", "256"))
+
+# One event to write: the course's slot(s) it covers and its Calendar API body.
+PlannedEvent = namedtuple("PlannedEvent", "slot_codes course_code body")
+# Everything planned for one schedule; see plan_calendar_events. Collections are tuples so
+# a cached plan can be shared between requests; event bodies are never modified after planning.
+EventPlan = namedtuple("EventPlan", "events slot_count error_messages events_saved start_date end_date timezone")
+# Reminders of every planned event; one object shared by all bodies, as they are never modified.
+_EVENT_REMINDERS = {'useDefault': False, 'overrides': [{'method': 'popup', 'minutes': 15}]}
+
+_plan_cache = OrderedDict()  # (id(slot table), input hash) -> (slot table, EventPlan)
+_stats_lock = threading.Lock()
+_stats = {'events_planned': 0, 'events_saved_by_coalescing': 0, 'sync_runs': 0, 'events_unchanged': 0,
+          'plan_cache_hits': 0, 'plan_cache_misses': 0, 'dry_runs': 0}
+
+# Google client libraries are imported inside the functions that use them:
+# googleapiclient in particular is slow to import and only needed once a user
+# actually creates events.
 
 # If modifying these SCOPES, delete the file token.pickle or clear session credentials.
-SCOPES = ['https://www.googleapis.com/auth/calendar.events']
+# calendar.freebusy is only for the pre-insert conflict check (calendar_conflicts.py).
+SCOPES = ['https://www.googleapis.com/auth/calendar.events', 'https://www.googleapis.com/auth/calendar.freebusy']
 CLIENT_SECRET_FILE = 'client_secret.json'
 # Note: Using pickle for token storage is less ideal for web apps vs. database storage.
 # For simplicity here, we keep it, but be aware of concurrency issues if scaling.
 TOKEN_PICKLE_FILE = 'token.pickle' # Less relevant now we use session storage
 
-# Define the mapping from day names to weekday numbers (Monday=0)
-DAY_TO_WEEKDAY = {
-    "Monday": 0, "Tuesday": 1, "Wednesday": 2,
-    "Thursday": 3, "Friday": 4, "Saturday": 5, "Sunday": 6
-}
-# Define the RRULE day mapping for Google Calendar
-DAY_TO_RRULE = {
-    "Monday": "MO", "Tuesday": "TU", "Wednesday": "WE",
-    "Thursday": "TH", "Friday": "FR", "Saturday": "SA", "Sunday": "SU"
-}
+
 
 
 def get_credentials_from_session(credentials_dict):
-    """Rebuilds credentials object from dictionary stored in session."""
-    creds = None
+    """
+    Returns the user's credentials with a usable access token, or None (the user
+    has to authorize again). They come from the server-side credential cache,
+    which refreshes tokens ahead of expiry off the request path and keeps the
+    refreshed ones itself; the session dict only seeds it for a new user.
+    """
     if not credentials_dict:
         print("Error: No credentials dictionary provided.")
         return None
+    # Refresh with the scopes the user actually granted: sessions authorized before a scope
+    # was added to SCOPES keep working (without the features that need it)
+    return get_credential_cache().get(calendar_user_key(credentials_dict), credentials_dict,
+                                      credentials_dict.get('scopes') or SCOPES)
 
-    try:
-        creds = Credentials.from_authorized_user_info(credentials_dict, SCOPES)
 
-        # Check if token needs refresh and attempt it
-        if creds and not creds.valid and creds.refresh_token:
-            print("Refreshing expired token...")
-            try:
-                creds.refresh(Request())
-                # IMPORTANT: The calling code (app.py) needs to update the session
-                # with the potentially refreshed credentials. This function returns
-                # the refreshed creds object.
-                print("Token refreshed successfully.")
-            except Exception as e:
-                print(f"Error refreshing token: {e}")
-                # Let the calling code handle this (e.g., force re-auth)
-                return None # Indicate refresh failure
+def prefetch_credentials(credentials_dict):
+    """Starts a token refresh for the user now if the next Calendar call would need one."""
+    if credentials_dict:
+        get_credential_cache().prefetch(calendar_user_key(credentials_dict), credentials_dict,
+                                        credentials_dict.get('scopes') or SCOPES)
 
-        return creds
 
-    except Exception as e:
-        print(f"Error rebuilding credentials from dict: {e}")
-        return None
+def store_credentials(credentials_dict, credentials):
+    """Caches freshly authorized credentials (credentials_dict is their session copy)."""
+    get_credential_cache().put(calendar_user_key(credentials_dict), credentials)
+
+
+def forget_credentials(credentials_dict):
+    """Drops the user's server-side credentials on sign-out."""
+    if credentials_dict:
+        get_credential_cache().forget(calendar_user_key(credentials_dict))
 
 
 def get_calendar_service(credentials_dict=None):
     """Builds the Google Calendar service object using credentials from session dict."""
+    from googleapiclient.errors import HttpError
+
     creds = get_credentials_from_session(credentials_dict)
 
     if not creds:
@@ -75,8 +99,8 @@ def get_calendar_service(credentials_dict=None):
          return None, None
 
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        print("Google Calendar service created successfully.")
+        # Built from the bundled discovery document and reused across requests for this user
+        service = get_pooled_calendar_service(creds)
         # Return both service and the (potentially refreshed) creds object
         return service, creds
     except HttpError as error:
@@ -98,56 +122,82 @@ def find_next_weekday(target_weekday, start_date_obj):
     return start_date_obj + datetime.timedelta(days=days_ahead)
 
 
-def create_calendar_events(service, schedule_data, time_slots_mapping, start_date_str, end_date_str, user_timezone='UTC'):
+def _group_slots(course_slots):
     """
-    Creates Google Calendar events based on the schedule within a specified date range.
+    Groups one course's (slot_code, SlotTime, first_event_date) entries by identical
+    start/end time, keeping first-seen order, so e.g. A11/A12/A13 (Mon/Wed/Fri
+    08:30-10:00) become one weekly event with BYDAY=MO,WE,FR.
+    """
+    groups = {}
+    for entry in course_slots:
+        slot_info = entry[1]
+        groups.setdefault((slot_info.start_time, slot_info.end_time), []).append(entry)
+    return list(groups.values())
+
+
+def calendar_stats():
+    """Lifetime event-planning counters for monitoring."""
+    with _stats_lock:
+        stats = dict(_stats, coalesce_slots=CALENDAR_COALESCE_SLOTS, incremental_sync=CALENDAR_INCREMENTAL_SYNC)
+    stats['inserts'] = insert_stats()
+    stats['services'] = service_cache_stats()
+    stats['credentials'] = get_credential_cache().stats()
+    stats['conflicts'] = conflict_stats()
+    return stats
+
+
+def calendar_user_key(credentials_dict):
+    """Stable, non-secret key for a user's Calendar quota, derived from their OAuth credentials."""
+    if not credentials_dict:
+        return None
+    identity = credentials_dict.get('refresh_token') or credentials_dict.get('token') or ""
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
 
-    Args:
-        service: Authorized Google Calendar service instance.
-        schedule_data (list): List of dicts (potentially edited) from the frontend.
-        time_slots_mapping (dict): The mapping from slots to days/times.
-        start_date_str (str): Start date in 'YYYY-MM-DD' format.
-        end_date_str (str): End date in 'YYYY-MM-DD' format.
-        user_timezone (str): The IANA timezone string (e.g., 'America/New_York').
 
-    Returns:
-        tuple: (success_count, failure_count, error_messages)
-    """
-    success_count = 0
-    failure_count = 0
-    error_messages = []
-    total_slots_to_process = 0
+def _estimate_slot_count(schedule_data):
+    """Slot count of unprocessed schedule data, for reporting every slot as failed."""
+    try:
+        return sum(len(course.get("slots", [])) if isinstance(course.get("slots"), list) else len(re.split(r'[,\s]+', course.get("slots",""))) for course in schedule_data)
+    except:
+        return len(schedule_data) # Rough estimate
 
-    if not service:
-        error_messages.append("Calendar service is not available.")
-        # Estimate failure count based on input data
-        try:
-             total_slots_to_process = sum(len(course.get("slots", [])) if isinstance(course.get("slots"), list) else len(re.split(r'[,\s]+', course.get("slots",""))) for course in schedule_data)
-        except:
-            total_slots_to_process = len(schedule_data) # Rough estimate
-        return 0, total_slots_to_process, error_messages
 
-    if not schedule_data:
-        print("No schedule data provided to create events.")
-        return 0, 0, []
+def parse_date_range(start_date_str, end_date_str):
+    """Parses 'YYYY-MM-DD' start/end dates into date objects; raises ValueError on a bad format."""
+    start_date_obj = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date_obj = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    return start_date_obj, end_date_obj
 
-    # --- Parse Start and End Dates ---
-    try:
-        start_date_obj = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        end_date_obj = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
-        # Format end date for RRULE UNTIL (inclusive, using YYYYMMDD format)
-        # Google Calendar API expects YYYYMMDD or YYYYMMDDTHHMMSSZ. YYYYMMDD is simpler.
-        # It represents the end of the day on that date in the calendar's timezone.
-        until_date_str = end_date_obj.strftime('%Y%m%d')
-    except ValueError:
-        error_messages.append("Invalid start or end date format. Please use YYYY-MM-DD.")
-        try:
-             total_slots_to_process = sum(len(course.get("slots", [])) if isinstance(course.get("slots"), list) else len(re.split(r'[,\s]+', course.get("slots",""))) for course in schedule_data)
-        except:
-            total_slots_to_process = len(schedule_data)
-        return 0, total_slots_to_process, error_messages
+
+def plan_calendar_events(schedule_data, time_slots_mapping, start_date_obj, end_date_obj, user_timezone='UTC',
+                         coalesce=None):
+    """
+    Turns schedule rows into weekly recurring event bodies (Calendar API format)
+    without calling any API: the planning half of create_calendar_events, also
+    used by the ICS export and dry runs.
+
+    Returns an EventPlan: events is a tuple of PlannedEvent, slot_count the
+    number of slots attempted and error_messages the slots that couldn't be
+    planned. Apply it with execute_event_plan.
+    """
+    if coalesce is None:
+        coalesce = CALENDAR_COALESCE_SLOTS
+    total_slots_to_process = 0
+    error_messages = []
+    # Format end date for RRULE UNTIL (inclusive, using YYYYMMDD format)
+    # Google Calendar API expects YYYYMMDD or YYYYMMDDTHHMMSSZ. YYYYMMDD is simpler.
+    # It represents the end of the day on that date in the calendar's timezone.
+    until_date_str = end_date_obj.strftime('%Y%m%d')
+
+    slot_table = compile_slot_table(time_slots_mapping)
+    # First event date (and its ISO form) for each weekday, worked out once instead of per slot
+    first_dates = [find_next_weekday(weekday, start_date_obj) for weekday in range(7)]
+    first_date_strs = [date.isoformat() for date in first_dates]
+    recurrence_prefix = f'RRULE:FREQ=WEEKLY;UNTIL={until_date_str};BYDAY='
 
     # --- Process Each Course Entry ---
+    pending_inserts = [] # (slot_codes, course_code, event body) for every event to create
+    events_saved = 0
     processed_slot_identifiers = set() # Use (course_code, slot_code) to track uniqueness per course
 
     for course_index, course in enumerate(schedule_data):
@@ -162,7 +212,7 @@ def create_calendar_events(service, schedule_data, time_slots_mapping, start_dat
         if isinstance(slots_raw, str):
             slots = [s.strip().upper() for s in re.split(r'[,\s]+', slots_raw) if s.strip()]
         elif isinstance(slots_raw, list):
-            slots = [str(s).strip().upper() for s in slots_raw if str(s).strip()]
+            slots = [s for s in (str(s).strip().upper() for s in slots_raw) if s]
         else:
             print(f"Warning: Invalid slots format for {course_code}: {slots_raw}. Skipping slots.")
 
@@ -171,6 +221,7 @@ def create_calendar_events(service, schedule_data, time_slots_mapping, start_dat
             continue # Skip course if no valid slots
 
         total_slots_to_process += len(slots) # Increment count of slots we will attempt
+        course_slots = [] # (slot_code, SlotTime, first_event_date) for this course's valid slots
 
         for slot_code in slots:
              # Avoid creating duplicate events if the same slot appears multiple times for the *same* course
@@ -181,84 +232,243 @@ def create_calendar_events(service, schedule_data, time_slots_mapping, start_dat
                  continue
              processed_slot_identifiers.add(slot_identifier)
 
-             found_slot_mapping = False
-             for day, day_slots in time_slots_mapping.items():
-                 if slot_code in day_slots:
-                     found_slot_mapping = True
-                     slot_info = day_slots[slot_code]
-                     start_time_str = slot_info["start"]
-                     end_time_str = slot_info["end"]
-                     target_weekday = DAY_TO_WEEKDAY[day]
-                     rrule_day = DAY_TO_RRULE[day]
-
-                     try:
-                         # Calculate the date for the *first* event occurring on or after start_date
-                         first_event_date = find_next_weekday(target_weekday, start_date_obj)
-
-                         # Check if the first event date is beyond the end date
-                         if first_event_date > end_date_obj:
-                             print(f"Info: First occurrence of slot {slot_code} ({day} {start_time_str}) on {first_event_date} is after the end date {end_date_obj}. Skipping.")
-                             # This specific slot instance is skipped, does not count as failure.
-                             # We already counted it in total_slots_to_process, so decrement failure potential
-                             # failure_count remains unchanged, success_count remains unchanged
-                             break # Stop searching days for this specific slot_code
-
-                         # Format datetime strings using ISO format
-                         start_datetime_str = f"{first_event_date.isoformat()}T{start_time_str}:00"
-                         end_datetime_str = f"{first_event_date.isoformat()}T{end_time_str}:00"
-
-                         # Create Event Body with Recurrence Rule ending on UNTIL date
-                         event_summary = f"{course_code} - {course_name}"
-                         event_description_parts = []
-                         if faculty: event_description_parts.append(f"Faculty: {faculty}")
-                         if venue: event_description_parts.append(f"Venue: {venue}") # Add venue to desc
-                         event_description_parts.append(f"Slot: {slot_code}")
-                         event_description = "\n".join(event_description_parts)
-
-                         event = {
-                             'summary': event_summary,
-                             'location': venue, # Location field
-                             'description': event_description,
-                             'start': {'dateTime': start_datetime_str, 'timeZone': user_timezone},
-                             'end': {'dateTime': end_datetime_str, 'timeZone': user_timezone},
-                             'recurrence': [
-                                 # UNTIL date is inclusive
-                                 f'RRULE:FREQ=WEEKLY;UNTIL={until_date_str};BYDAY={rrule_day}'
-                             ],
-                             'reminders': {'useDefault': False, 'overrides': [{'method': 'popup', 'minutes': 15}]},
-                         }
-
-                         # Insert Event
-                         created_event = service.events().insert(calendarId='primary', body=event).execute()
-                         # print(f"Event created: {created_event.get('htmlLink')}")
-                         success_count += 1
-                         break # Stop searching days once slot is found and processed for this course
-
-                     except HttpError as error:
-                         print(f"An API error occurred creating event for slot {slot_code} ({course_code}): {error}")
-                         error_detail = f"API Error {error.resp.status}"
-                         try: # Try to get more specific error message from response
-                             err_json = json.loads(error.content.decode())
-                             error_detail += f": {err_json.get('error', {}).get('message', 'Unknown API error')}"
-                         except: pass # Ignore if content isn't JSON
-                         error_messages.append(f"Slot {slot_code} ({course_code}): {error_detail}")
-                         # failure_count is implicitly tracked (total - success)
-                         break # Stop searching days for this slot on error
-                     except Exception as e:
-                         print(f"An unexpected error occurred creating event for slot {slot_code} ({course_code}): {e}")
-                         error_messages.append(f"Slot {slot_code} ({course_code}): Unexpected error - {e}")
-                         # failure_count is implicitly tracked
-                         break # Stop searching days for this slot on error
-
-             if not found_slot_mapping:
+             slot_info = slot_table.get(slot_code)
+             if slot_info is not None:
+                 # The date of the *first* event occurring on or after start_date
+                 first_event_date = first_dates[slot_info.weekday]
+
+                 # Check if the first event date is beyond the end date
+                 if first_event_date > end_date_obj:
+                     print(f"Info: First occurrence of slot {slot_code} ({slot_info.day} {slot_info.start}) on {first_event_date} is after the end date {end_date_obj}. Skipping.")
+                     # This specific slot instance is skipped, does not count as failure.
+                     # We already counted it in total_slots_to_process, so decrement failure potential
+                     # failure_count remains unchanged, success_count remains unchanged
+                     continue
+                 course_slots.append((slot_code, slot_info, first_event_date))
+             else:
                  print(f"Warning: Slot code '{slot_code}' for course '{course_code}' not found in time_slots mapping.")
                  error_messages.append(f"Slot '{slot_code}' (Course: {course_code}) not found in mapping.")
                  # This slot couldn't be processed, counts towards failure implicitly.
 
+        # --- Plan this course's events: one per slot, or one per distinct time when coalescing ---
+        groups = _group_slots(course_slots) if coalesce else [[entry] for entry in course_slots]
+        events_saved += len(course_slots) - len(groups)
+        if not groups:
+            continue
+        # Shared by all of this course's events
+        event_summary = f"{course_code} - {course_name}"
+        description_prefix = (f"Faculty: {faculty}\n" if faculty else "") + (f"Venue: {venue}\n" if venue else "")
+        for group in groups:
+            slot_codes = [slot_code for slot_code, _, _ in group]
+            try:
+                slot_info = group[0][1]
+                if len(group) == 1:
+                    first_event_date = group[0][2]
+                    rrule_days = slot_info.rrule_day
+                else:
+                    first_event_date = min(date for _, _, date in group)
+                    rrule_days = ",".join(dict.fromkeys(info.rrule_day for _, info, _ in
+                                                        sorted(group, key=lambda entry: entry[1].weekday)))
+
+                # Format datetime strings using ISO format
+                first_date_str = first_date_strs[first_event_date.weekday()]
+                start_datetime_str = f"{first_date_str}T{slot_info.start_time}"
+                end_datetime_str = f"{first_date_str}T{slot_info.end_time}"
+
+                # Create Event Body with Recurrence Rule ending on UNTIL date
+                event_description = f"{description_prefix}{'Slots' if len(slot_codes) > 1 else 'Slot'}: {', '.join(slot_codes)}"
+
+                event = {
+                    'summary': event_summary,
+                    'location': venue, # Location field
+                    'description': event_description,
+                    'start': {'dateTime': start_datetime_str, 'timeZone': user_timezone},
+                    'end': {'dateTime': end_datetime_str, 'timeZone': user_timezone},
+                    'recurrence': [
+                        # UNTIL date is inclusive
+                        recurrence_prefix + rrule_days
+                    ],
+                    'reminders': _EVENT_REMINDERS,
+                }
+
+                # Queued; inserted in batches once every course has been processed
+                pending_inserts.append(PlannedEvent(tuple(slot_codes), course_code, event))
+
+            except Exception as e:
+                print(f"An unexpected error occurred preparing event for slot(s) {', '.join(slot_codes)} ({course_code}): {e}")
+                error_messages.append(f"Slot {', '.join(slot_codes)} ({course_code}): Unexpected error - {e}")
+                # failure_count is implicitly tracked
+
+    if events_saved:
+        print(f"Coalesced same-time slots: {len(pending_inserts)} event(s) instead of {len(pending_inserts) + events_saved}.")
+    return EventPlan(tuple(pending_inserts), total_slots_to_process, tuple(error_messages), events_saved,
+                     start_date_obj, end_date_obj, user_timezone)
+
+
+def get_event_plan(schedule_data, time_slots_mapping, start_date_obj, end_date_obj, user_timezone='UTC',
+                   coalesce=None):
+    """
+    plan_calendar_events, memoized on the schedule, slot table and options, so a
+    dry run followed by the confirmed run (or a repeated submission) plans once.
+    Only compiled SlotTables are cached; a reloaded grid is a new table and so
+    never reuses a plan made against the old one.
+    """
+    if coalesce is None:
+        coalesce = CALENDAR_COALESCE_SLOTS
+    if not isinstance(time_slots_mapping, SlotTable) or CALENDAR_PLAN_CACHE_SIZE <= 0:
+        return plan_calendar_events(schedule_data, time_slots_mapping, start_date_obj, end_date_obj,
+                                    user_timezone, coalesce=coalesce)
+    payload = json.dumps([schedule_data, start_date_obj.isoformat(), end_date_obj.isoformat(), user_timezone, coalesce],
+                         sort_keys=True, default=str)
+    key = (id(time_slots_mapping), hashlib.sha256(payload.encode("utf-8")).hexdigest())
+    with _stats_lock:
+        entry = _plan_cache.get(key)
+        # The table is kept in the entry, so its id can't be reused while the plan is cached
+        if entry is not None and entry[0] is time_slots_mapping:
+            _plan_cache.move_to_end(key)
+            _stats['plan_cache_hits'] += 1
+            return entry[1]
+        _stats['plan_cache_misses'] += 1
+    plan = plan_calendar_events(schedule_data, time_slots_mapping, start_date_obj, end_date_obj,
+                                user_timezone, coalesce=coalesce)
+    with _stats_lock:
+        _plan_cache[key] = (time_slots_mapping, plan)
+        while len(_plan_cache) > CALENDAR_PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+def estimate_plan_cost(plan, incremental=None, sync_summary=None):
+    """
+    Calendar API cost of executing a plan, computed without calling the API.
+    With a sync_summary (see preview_event_plan) write counts are exact;
+    otherwise they are an upper bound that assumes every event is written.
+    """
+    if incremental is None:
+        incremental = CALENDAR_INCREMENTAL_SYNC
+    if sync_summary is None:
+        writes = len(plan.events)
+    else:
+        writes = sync_summary['insert'] + sync_summary['patch'] + sync_summary['delete']
+    cost = estimate_write_cost(writes)
+    if incremental:
+        # One events.list page (up to 2500 events) to diff against the term's existing events
+        cost['api_calls'] += 1
+        cost['http_requests'] += 1
+    cost['exact'] = sync_summary is not None or not incremental
+    return cost
+
+
+def preview_event_plan(service, plan, term=None, incremental=None):
+    """
+    Dry run: what executing the plan would do, without writing anything. With
+    incremental sync and a service, the term's existing events are listed (one
+    read call) so the insert/update/delete counts are exact.
+    """
+    if incremental is None:
+        incremental = CALENDAR_INCREMENTAL_SYNC
+    sync_summary = None
+    if incremental and service is not None:
+        _, _, sync_summary = plan_sync(service, plan.events, resolve_term(term, plan.start_date))
+    with _stats_lock:
+        _stats['dry_runs'] += 1
+    return {
+        'events': len(plan.events),
+        'slots': plan.slot_count,
+        'events_saved_by_coalescing': plan.events_saved,
+        'unplanned': list(plan.error_messages),
+        'incremental': incremental,
+        'changes': sync_summary,
+        'cost': estimate_plan_cost(plan, incremental, sync_summary),
+    }
+
+
+def execute_event_plan(service, plan, user_key=None, term=None, incremental=None):
+    """
+    Applies an EventPlan to the user's calendar: the network half of
+    create_calendar_events. See create_calendar_events for the arguments and
+    the (success_count, failure_count, error_messages) result.
+    """
+    if incremental is None:
+        incremental = CALENDAR_INCREMENTAL_SYNC
+    success_count = 0
+    error_messages = list(plan.error_messages)
+    with _stats_lock:
+        _stats['events_planned'] += len(plan.events)
+        _stats['events_saved_by_coalescing'] += plan.events_saved
+
+    # --- Write Events (batched, then concurrent for anything left over) ---
+    if incremental:
+        # Re-running only touches what changed; unchanged events already count as done
+        changes, unchanged_slots, sync_summary = plan_sync(service, plan.events, resolve_term(term, plan.start_date))
+        success_count += unchanged_slots
+        written_count, write_errors = apply_event_changes(service, changes, user_key=user_key)
+        with _stats_lock:
+            _stats['sync_runs'] += 1
+            _stats['events_unchanged'] += sync_summary['unchanged']
+    else:
+        written_count, write_errors = insert_events(service, plan.events, user_key=user_key)
+    success_count += written_count
+    error_messages.extend(write_errors)
 
     # Calculate final failure count
-    failure_count = total_slots_to_process - success_count
-    # Ensure failure count isn't negative if total_slots_to_process was miscalculated
+    failure_count = plan.slot_count - success_count
+    # Ensure failure count isn't negative if the plan's slot count was miscalculated
     failure_count = max(0, failure_count)
 
-    return success_count, failure_count, error_messages
\ No newline at end of file
+    return success_count, failure_count, error_messages
+
+
+def create_calendar_events(service, schedule_data, time_slots_mapping, start_date_str, end_date_str, user_timezone='UTC',
+                           coalesce=None, user_key=None, term=None, incremental=None):
+    """
+    Creates Google Calendar events based on the schedule within a specified date range.
+
+    With coalesce (default CALENDAR_COALESCE_SLOTS), a course's slots that share
+    a start/end time become a single event recurring on each of their weekdays.
+    The events are planned by get_event_plan (no API calls, cached) and written
+    by execute_event_plan.
+
+    Args:
+        service: Authorized Google Calendar service instance.
+        schedule_data (list): List of dicts (potentially edited) from the frontend.
+        time_slots_mapping (SlotTable or dict): The compiled slot table, or a raw
+            {day: {slot: {start, end}}} mapping (compiled on the fly).
+        start_date_str (str): Start date in 'YYYY-MM-DD' format.
+        end_date_str (str): End date in 'YYYY-MM-DD' format.
+        user_timezone (str): The IANA timezone string (e.g., 'America/New_York').
+        coalesce (bool): Merge same-time slots of a course into one event.
+        user_key (str): Identifies the Google user whose rate limit the inserts share
+            (see calendar_user_key).
+        term (str): Semester label the events belong to (default: the half-year of
+            the start date, see calendar_sync.resolve_term). Event ids are derived
+            from term, course and slots, so re-runs must use the same term.
+        incremental (bool): Sync against the term's existing events (insert, patch or
+            delete only what changed) instead of inserting everything; default
+            CALENDAR_INCREMENTAL_SYNC.
+
+    Returns:
+        tuple: (success_count, failure_count, error_messages). Counts are per slot,
+        so a coalesced event counts once for every slot it covers.
+    """
+    error_messages = []
+
+    if not service:
+        error_messages.append("Calendar service is not available.")
+        # Estimate failure count based on input data
+        return 0, _estimate_slot_count(schedule_data), error_messages
+
+    if not schedule_data:
+        print("No schedule data provided to create events.")
+        return 0, 0, []
+
+    # --- Parse Start and End Dates ---
+    try:
+        start_date_obj, end_date_obj = parse_date_range(start_date_str, end_date_str)
+    except ValueError:
+        error_messages.append("Invalid start or end date format. Please use YYYY-MM-DD.")
+        return 0, _estimate_slot_count(schedule_data), error_messages
+
+    # Plan (pure, cached), then execute (network)
+    plan = get_event_plan(schedule_data, time_slots_mapping, start_date_obj, end_date_obj, user_timezone, coalesce=coalesce)
+    return execute_event_plan(service, plan, user_key=user_key, term=term, incremental=incremental)
@@ -0,0 +1,76 @@
+"""
+Microbenchmark for the ICS export.
+
+Times planning a synthetic schedule and streaming it as an .ics file (the
+whole /export_ics path minus HTTP), the same with the plan served from the
+plan cache (a repeated export), and the ICS generator on its own, and checks the output is well-formed (CRLF line endings, no content line longer
+than 75 octets).
+
+Usage:
+    python ics_benchmark.py [--courses 20] [--repeat 2000] [--min-rate 1000]
+"""
+import io
+import sys
+import random
+import timeit
+import argparse
+import contextlib
+
+from ocr_script import slot_table
+from google_calendar_utils import plan_calendar_events, get_event_plan, parse_date_range
+from ics_export import iter_ics
+
+
+def sample_schedule(courses):
+    codes = sorted(slot_table.codes)
+    rng = random.Random(0)
+    return [{"course_code": f"CSE{1000 + i}", "course_name": f"Course {i}, Part {i % 3}",
+             "faculty_name": f"Dr. Faculty {i}", "venue": f"SJT{100 + i}",
+             "slots": rng.sample(codes, 3)} for i in range(courses)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark planning and streaming an ICS export.")
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--timezone", default="Asia/Kolkata")
+    parser.add_argument("--min-rate", type=float, default=1000, help="Schedules per second the generator must reach.")
+    args = parser.parse_args()
+
+    schedule = sample_schedule(args.courses)
+    start_date, end_date = parse_date_range("2025-01-06", "2025-05-09")
+
+    def plan():
+        return plan_calendar_events(schedule, slot_table, start_date, end_date, args.timezone).events
+
+    def generate(events):
+        return "".join(iter_ics(events, start_date, end_date, args.timezone))
+
+    with contextlib.redirect_stdout(io.StringIO()):  # The planner logs each coalesced course
+        events = plan()
+        ics = generate(events)
+        total_s = min(timeit.repeat(lambda: generate(plan()), number=args.repeat, repeat=3)) / args.repeat
+        cached_s = min(timeit.repeat(
+            lambda: generate(get_event_plan(schedule, slot_table, start_date, end_date, args.timezone).events),
+            number=args.repeat, repeat=3)) / args.repeat
+        generate_s = min(timeit.repeat(lambda: generate(events), number=args.repeat, repeat=3)) / args.repeat
+
+    lines = ics.split("\r\n")
+    if lines[-1] != "" or any("\n" in line or len(line.encode("utf-8")) > 75 for line in lines):
+        print("FAIL: export has bare newlines or unfolded lines over 75 octets")
+        return 1
+
+    rate = 1 / generate_s
+    print(f"{args.courses}-course schedule, {len(events)} events, {len(ics)} bytes, best of 3 x {args.repeat}")
+    print(f"  {'plan + export':<16}{total_s * 1000:9.3f} ms  ({1 / total_s:7.0f} schedules/s)")
+    print(f"  {'cached + export':<16}{cached_s * 1000:9.3f} ms  ({1 / cached_s:7.0f} schedules/s)")
+    print(f"  {'export only':<16}{generate_s * 1000:9.3f} ms  ({rate:7.0f} schedules/s)")
+    if rate < args.min_rate:
+        print(f"\nFAIL: the generator's {rate:.0f} schedules/s is below {args.min_rate:.0f}")
+        return 1
+    print("\nOK: no Calendar API calls, within the throughput target")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
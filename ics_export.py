@@ -0,0 +1,191 @@
+import os
+import re
+import hashlib
+import datetime
+import functools
+import threading
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dotenv import load_dotenv
+
+from calendar_sync import resolve_term
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+ICS_PRODID = os.getenv("ICS_PRODID", "-//VIT Calendar App//Timetable Export//EN")
+# Domain part of event UIDs. UIDs are derived from term, course and slots, so importing
+# an updated export replaces the earlier events instead of duplicating them.
+ICS_UID_DOMAIN = os.getenv("ICS_UID_DOMAIN", "vit-calendar-app")
+
+_NEEDS_ESCAPE = re.compile(r"[\\;,\n\r]")
+_UNTIL_DATE = re.compile(r"UNTIL=(\d{8})(?=;|$)")
+_UTC = datetime.timezone.utc
+
+_stats_lock = threading.Lock()
+_stats = {'exports': 0, 'events': 0}
+
+
+def _escape(text):
+    """Escapes a TEXT value (RFC 5545 3.3.11)."""
+    text = str(text)
+    if _NEEDS_ESCAPE.search(text) is None:
+        return text
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n").replace("\r", ""))
+
+
+def _fold(line):
+    """Terminates a content line, folding it at 75 octets without splitting a UTF-8 character."""
+    if len(line) <= 75 and line.isascii():
+        return line + "\r\n"
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    start, limit = 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1  # Don't cut inside a multi-byte character
+        parts.append(encoded[start:end].decode("utf-8"))
+        start, limit = end, 74  # Continuation lines start with a space
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _uid(term, course_code, slot_codes):
+    """Stable UID for one course's slot(s) in a term (same key as calendar_sync.event_id_for)."""
+    key = f"{term}|{course_code.strip().upper()}|{','.join(sorted(slot_codes))}"
+    return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}@{ICS_UID_DOMAIN}"
+
+
+def _ics_datetime(iso_datetime):
+    """'2025-01-06T08:30:00' -> '20250106T083000' (local time, used with TZID)."""
+    return iso_datetime.replace("-", "").replace(":", "")[:15]
+
+
+def _utc_offset(delta):
+    total = int(delta.total_seconds())
+    sign = "+" if total >= 0 else "-"
+    total = abs(total)
+    return f"{sign}{total // 3600:02d}{total % 3600 // 60:02d}"
+
+
+@functools.lru_cache(maxsize=64)
+def _zone(tz_name):
+    try:
+        return ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=256)
+def _vtimezone(tz_name, first_date, last_date):
+    """
+    VTIMEZONE component for tz_name between first_date and last_date. Each UTC offset
+    change in that range (found by scanning the zone in UTC, to the quarter hour)
+    is listed as its own STANDARD/DAYLIGHT observance, so no RRULE is needed.
+    """
+    zone = _zone(tz_name)
+    day = datetime.timedelta(days=1)
+    quarter_hour = datetime.timedelta(minutes=15)
+    moment = datetime.datetime.combine(first_date, datetime.time(), tzinfo=_UTC) - day
+    end = datetime.datetime.combine(last_date, datetime.time(), tzinfo=_UTC) + 2 * day
+
+    def offset(at):
+        return at.astimezone(zone).utcoffset()
+
+    # (utc moment the offset starts, offset before, offset after)
+    observances = [(moment, offset(moment), offset(moment))]
+    while moment < end:
+        following = moment + day
+        if offset(following) != offset(moment):
+            change = moment
+            while offset(change) == offset(moment):
+                change += quarter_hour
+            observances.append((change, offset(moment), offset(change)))
+        moment = following
+
+    lines = ["BEGIN:VTIMEZONE", f"TZID:{tz_name}"]
+    for starts, offset_from, offset_to in observances:
+        local = starts.astimezone(zone)
+        kind = "DAYLIGHT" if local.dst() else "STANDARD"
+        lines += [f"BEGIN:{kind}",
+                  # Observance start in the local time that was in effect before it
+                  f"DTSTART:{(starts + offset_from).replace(tzinfo=None):%Y%m%dT%H%M%S}",
+                  f"TZOFFSETFROM:{_utc_offset(offset_from)}",
+                  f"TZOFFSETTO:{_utc_offset(offset_to)}",
+                  f"TZNAME:{_escape(local.tzname())}",
+                  f"END:{kind}"]
+    lines.append("END:VTIMEZONE")
+    return "".join(_fold(line) for line in lines)
+
+
+@functools.lru_cache(maxsize=1024)
+def _rrule_line(rule, tz_name):
+    """
+    The RRULE sent to Google, with its UNTIL date made a UTC date-time as RFC 5545
+    3.3.10 requires next to a DTSTART with a TZID: the end of the inclusive end
+    date in the event's timezone.
+    """
+    def utc_until(match):
+        date = datetime.datetime.strptime(match.group(1), "%Y%m%d").date()
+        local_end = datetime.datetime.combine(date, datetime.time(23, 59, 59), tzinfo=_zone(tz_name))
+        return f"UNTIL={local_end.astimezone(_UTC):%Y%m%dT%H%M%SZ}"
+
+    return _fold(_UNTIL_DATE.sub(utc_until, rule))
+
+
+def _vevent(body, uid, dtstamp, tz_name):
+    # Only lines holding user text can exceed 75 octets; the rest skip _fold
+    summary = _escape(body['summary'])
+    parts = [f"BEGIN:VEVENT\r\nUID:{uid}\r\nDTSTAMP:{dtstamp}\r\n",
+             _fold(f"DTSTART;TZID={tz_name}:{_ics_datetime(body['start']['dateTime'])}"),
+             _fold(f"DTEND;TZID={tz_name}:{_ics_datetime(body['end']['dateTime'])}"),
+             _fold(f"SUMMARY:{summary}")]
+    if body.get('location'):
+        parts.append(_fold(f"LOCATION:{_escape(body['location'])}"))
+    if body.get('description'):
+        parts.append(_fold(f"DESCRIPTION:{_escape(body['description'])}"))
+    for rule in body.get('recurrence', ()):
+        parts.append(_rrule_line(rule, tz_name))
+    for reminder in body.get('reminders', {}).get('overrides', ()):
+        parts.append(f"BEGIN:VALARM\r\nACTION:DISPLAY\r\n{_fold(f'DESCRIPTION:{summary}')}"
+                     f"TRIGGER:-PT{int(reminder['minutes'])}M\r\nEND:VALARM\r\n")
+    parts.append("END:VEVENT\r\n")
+    return "".join(parts)
+
+
+def iter_ics(events, start_date_obj, end_date_obj, user_timezone='UTC', term=None):
+    """
+    Yields an RFC 5545 calendar for planned events, a component at a time, so
+    it can be streamed while it is generated.
+
+    events is plan_calendar_events(...).events: (slot_codes, course_code, body)
+    with bodies in Calendar API format, so the file has exactly the events,
+    times and recurrence rules Google Calendar would get. Nothing is sent to
+    any API. An unknown timezone falls back to UTC. term is the semester label
+    (see calendar_sync.resolve_term).
+    """
+    tz_name = user_timezone if _zone(user_timezone) is not None else 'UTC'
+    if tz_name != user_timezone:
+        print(f"Warning: Unknown timezone '{user_timezone}' for ICS export, using UTC.")
+    term = resolve_term(term, start_date_obj)
+    dtstamp = datetime.datetime.now(_UTC).strftime("%Y%m%dT%H%M%SZ")
+
+    yield "".join(_fold(line) for line in (
+        "BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{ICS_PRODID}", "CALSCALE:GREGORIAN", "METHOD:PUBLISH",
+        "X-WR-CALNAME:Timetable", f"X-WR-TIMEZONE:{tz_name}"))
+    yield _vtimezone(tz_name, start_date_obj, end_date_obj)
+    for slot_codes, course_code, body in events:
+        yield _vevent(body, _uid(term, course_code, slot_codes), dtstamp, tz_name)
+    yield "END:VCALENDAR\r\n"
+    with _stats_lock:
+        _stats['exports'] += 1
+        _stats['events'] += len(events)
+
+
+def ics_stats():
+    """Lifetime ICS export counters for monitoring."""
+    with _stats_lock:
+        return dict(_stats)
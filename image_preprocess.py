@@ -0,0 +1,157 @@
+import os
+import io
+import time
+import threading
+from dotenv import load_dotenv
+from PIL import Image, ImageOps, ImageChops
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Set OCR_PREPROCESS_ENABLED=0 to send the original upload to Gemini unchanged.
+OCR_PREPROCESS_ENABLED = os.getenv("OCR_PREPROCESS_ENABLED", "1") not in ("0", "false", "False", "")
+# Longest side (pixels) after downscaling; timetable text stays legible well below phone-camera sizes.
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "2048"))
+# Output encoding: "PNG" (lossless, best for screenshots) or "JPEG"/"WEBP" (best for photos).
+OCR_OUTPUT_FORMAT = os.getenv("OCR_OUTPUT_FORMAT", "WEBP").upper()
+OCR_OUTPUT_QUALITY = int(os.getenv("OCR_OUTPUT_QUALITY", "85"))
+# Pixels differing from the border colour by more than this count as table content when cropping.
+OCR_CROP_THRESHOLD = int(os.getenv("OCR_CROP_THRESHOLD", "40"))
+OCR_CROP_MARGIN = int(os.getenv("OCR_CROP_MARGIN", "16"))
+
+OUTPUT_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# Changes to any of these produce a different image, so they are part of the OCR cache key.
+PREPROCESS_VERSION = (
+    f"pp1-{OCR_MAX_DIMENSION}-{OCR_OUTPUT_FORMAT}-{OCR_OUTPUT_QUALITY}-{OCR_CROP_THRESHOLD}-{OCR_CROP_MARGIN}"
+    if OCR_PREPROCESS_ENABLED else "raw"
+)
+
+STAGES = ("decode", "orient", "crop", "resize", "grayscale", "encode")
+
+
+def _crop_to_content(img):
+    """
+    Crops away the uniform border around the timetable. The background colour
+    is sampled from the corners; anything noticeably different counts as content.
+    """
+    gray = img.convert("L")
+    width, height = gray.size
+    corners = [gray.getpixel((0, 0)), gray.getpixel((width - 1, 0)),
+               gray.getpixel((0, height - 1)), gray.getpixel((width - 1, height - 1))]
+    background = Image.new("L", gray.size, sorted(corners)[len(corners) // 2])
+    diff = ImageChops.difference(gray, background).point(lambda p: 255 if p > OCR_CROP_THRESHOLD else 0)
+    bbox = diff.getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    left, top = max(0, left - OCR_CROP_MARGIN), max(0, top - OCR_CROP_MARGIN)
+    right, bottom = min(width, right + OCR_CROP_MARGIN), min(height, bottom + OCR_CROP_MARGIN)
+    # Don't bother when the crop would barely change anything
+    if (right - left) * (bottom - top) > 0.95 * width * height:
+        return img
+    return img.crop((left, top, right, bottom))
+
+
+def preprocess_image(image_data, mime_type="image/png"):
+    """
+    Shrinks an uploaded timetable image before it is sent to Gemini:
+    auto-orient, crop to the table, downscale to OCR_MAX_DIMENSION, convert to
+    grayscale and re-encode as OCR_OUTPUT_FORMAT.
+
+    Returns (image_bytes, mime_type, stats). stats holds per-stage timings (ms)
+    and byte sizes. If anything fails, or the result would be larger than the
+    input, the original bytes and mime type are returned unchanged.
+    """
+    stats = {'input_bytes': len(image_data), 'output_bytes': len(image_data),
+             'stages_ms': {}, 'applied': False}
+    if not OCR_PREPROCESS_ENABLED:
+        return image_data, mime_type, stats
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        stats['stages_ms'][stage] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
+    try:
+        def decode():
+            image = Image.open(io.BytesIO(image_data))
+            image.load()
+            return image
+
+        img = timed("decode", decode)
+        stats['input_size'] = list(img.size)
+        img = timed("orient", ImageOps.exif_transpose, img)
+        img = timed("crop", _crop_to_content, img)
+
+        def resize(image):
+            longest = max(image.size)
+            if longest <= OCR_MAX_DIMENSION:
+                return image
+            scale = OCR_MAX_DIMENSION / longest
+            new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            return image.resize(new_size, Image.Resampling.LANCZOS)
+
+        img = timed("resize", resize, img)
+        img = timed("grayscale", lambda image: image.convert("L"), img)
+        stats['output_size'] = list(img.size)
+
+        output_format = OCR_OUTPUT_FORMAT if OCR_OUTPUT_FORMAT in OUTPUT_MIME_TYPES else "PNG"
+
+        def encode(image):
+            buffer = io.BytesIO()
+            if output_format == "PNG":
+                image.save(buffer, format="PNG", optimize=True)
+            else:
+                image.save(buffer, format=output_format, quality=OCR_OUTPUT_QUALITY)
+            return buffer.getvalue()
+
+        processed = timed("encode", encode, img)
+    except Exception as e:
+        print(f"Warning: Image preprocessing failed, sending original upload: {e}")
+        stats['error'] = str(e)
+        return image_data, mime_type, stats
+
+    stats['total_ms'] = round(sum(stats['stages_ms'].values()), 2)
+    if len(processed) >= len(image_data):
+        # Already compact (e.g. a small screenshot); keep the original
+        return image_data, mime_type, stats
+
+    stats['output_bytes'] = len(processed)
+    stats['applied'] = True
+    _record(stats)
+    return processed, OUTPUT_MIME_TYPES[output_format], stats
+
+
+# --- Aggregate Counters (for /stats) ---
+_totals_lock = threading.Lock()
+_totals = {'images': 0, 'input_bytes': 0, 'output_bytes': 0,
+           'stages_ms': {stage: 0.0 for stage in STAGES}}
+
+
+def _record(stats):
+    with _totals_lock:
+        _totals['images'] += 1
+        _totals['input_bytes'] += stats['input_bytes']
+        _totals['output_bytes'] += stats['output_bytes']
+        for stage, ms in stats['stages_ms'].items():
+            _totals['stages_ms'][stage] += ms
+
+
+def preprocess_stats():
+    """Returns cumulative byte savings and average per-stage timings for monitoring."""
+    with _totals_lock:
+        images = _totals['images']
+        return {
+            'enabled': OCR_PREPROCESS_ENABLED,
+            'images': images,
+            'input_bytes': _totals['input_bytes'],
+            'output_bytes': _totals['output_bytes'],
+            'size_ratio': round(_totals['output_bytes'] / _totals['input_bytes'], 4) if _totals['input_bytes'] else 0.0,
+            'avg_stage_ms': {stage: round(ms / images, 2) if images else 0.0
+                             for stage, ms in _totals['stages_ms'].items()},
+            'max_dimension': OCR_MAX_DIMENSION,
+            'output_format': OCR_OUTPUT_FORMAT,
+        }
@@ -0,0 +1,164 @@
+import os
+import io
+import math
+import threading
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Set OCR_TILING_ENABLED=0 to always OCR large images in a single call.
+OCR_TILING_ENABLED = os.getenv("OCR_TILING_ENABLED", "1") not in ("0", "false", "False", "")
+# Images taller than this (pixels, after auto-orient) are split into horizontal bands.
+OCR_TILE_MIN_HEIGHT = int(os.getenv("OCR_TILE_MIN_HEIGHT", "3000"))
+# Target band height; each band then fits under OCR_MAX_DIMENSION with little or no downscaling.
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "1600"))
+# Pixels each band repeats from the one above, so a row cut at a boundary appears whole in one band.
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "160"))
+# Upper bound on bands per image (bands grow taller instead).
+OCR_TILE_MAX_TILES = int(os.getenv("OCR_TILE_MAX_TILES", "8"))
+# Bands of one image OCR'd at once; every call still goes through the shared rate limiter.
+OCR_TILE_CONCURRENCY = int(os.getenv("OCR_TILE_CONCURRENCY", "4"))
+
+# A pixel darker than this counts as ink when looking for row boundaries.
+_INK_THRESHOLD = 128
+# Rows with less ink than this (blank gap) or more (full-width rule line) are row boundaries.
+_BLANK_FRACTION = 0.01
+_RULE_FRACTION = 0.85
+
+_stats_lock = threading.Lock()
+_stats = {'images': 0, 'tiles': 0, 'boundary_cuts': 0, 'blind_cuts': 0, 'fallbacks': 0}
+
+
+def _row_ink_fractions(gray):
+    """Fraction of dark pixels in each pixel row of a grayscale image."""
+    ink = gray.point(lambda p: 255 if p < _INK_THRESHOLD else 0)
+    # A box-filtered 1-pixel-wide resize averages each row in C
+    column = ink.resize((1, gray.height), Image.Resampling.BOX)
+    return [value / 255 for value in column.getdata()]
+
+
+def _find_cuts(fractions, band_height, search):
+    """
+    Picks y positions to cut at, roughly band_height apart, snapping each to the
+    nearest table row boundary (blank gap or rule line) within `search` pixels
+    above the target. Returns (cuts, boundary_cuts).
+    """
+    height = len(fractions)
+    cuts, boundary_cuts = [], 0
+    position = 0
+    while height - position > band_height * 1.25:
+        target = position + band_height
+        chosen = None
+        for y in range(target, max(position + band_height // 2, target - search), -1):
+            if fractions[y] <= _BLANK_FRACTION or fractions[y] >= _RULE_FRACTION:
+                chosen = y
+                break
+        if chosen is None:
+            chosen = target
+        else:
+            boundary_cuts += 1
+        cuts.append(chosen)
+        position = chosen
+    return cuts, boundary_cuts
+
+
+def split_into_tiles(image_data):
+    """
+    Splits a very tall timetable image into overlapping horizontal bands,
+    cutting along table row boundaries where possible.
+
+    Returns a list of PNG-encoded band images (top to bottom), or None when the
+    image is small enough for a single call, tiling is disabled, or the image
+    can't be decoded.
+    """
+    if not OCR_TILING_ENABLED:
+        return None
+    try:
+        img = Image.open(io.BytesIO(image_data))
+        img.load()
+        img = ImageOps.exif_transpose(img)
+        if img.height <= OCR_TILE_MIN_HEIGHT:
+            return None
+
+        tile_count = min(OCR_TILE_MAX_TILES, math.ceil(img.height / OCR_TILE_HEIGHT))
+        band_height = math.ceil(img.height / tile_count)
+        fractions = _row_ink_fractions(img.convert("L"))
+        cuts, boundary_cuts = _find_cuts(fractions, band_height, search=band_height // 4)
+
+        tiles = []
+        edges = [0] + cuts + [img.height]
+        for top, bottom in zip(edges, edges[1:]):
+            band = img.crop((0, max(0, top - OCR_TILE_OVERLAP), img.width, bottom))
+            buffer = io.BytesIO()
+            band.save(buffer, format="PNG")
+            tiles.append(buffer.getvalue())
+    except Exception as e:
+        print(f"Warning: Could not split image into tiles, using a single OCR call: {e}")
+        return None
+
+    with _stats_lock:
+        _stats['images'] += 1
+        _stats['tiles'] += len(tiles)
+        _stats['boundary_cuts'] += boundary_cuts
+        _stats['blind_cuts'] += len(cuts) - boundary_cuts
+    print(f"Split {img.width}x{img.height} image into {len(tiles)} band(s) "
+          f"({boundary_cuts}/{len(cuts)} cuts on row boundaries).")
+    return tiles
+
+
+def _row_matches(existing, row):
+    """Whether two same-course rows are the same table row seen in two overlapping bands."""
+    if not existing['slots'] or not row['slots']:
+        return True
+    if set(existing['slots']) & set(row['slots']):
+        return True
+    return bool(existing['venue']) and existing['venue'] == row['venue']
+
+
+def merge_tile_rows(tile_results):
+    """
+    Merges the rows OCR'd from each band (in top-to-bottom order) into one list.
+
+    Rows are matched by course_code (course_name for rows without a code); a
+    match whose slots or venue agree is the same row read twice in an overlap
+    zone, so the two are combined (missing fields filled, slots unioned).
+    Same-code rows that don't agree, e.g. a theory and a lab entry, stay separate.
+    """
+    merged = []
+    by_key = {}
+    for rows in tile_results:
+        for row in rows:
+            key = row['course_code'].upper() or row['course_name'].lower()
+            if not key:
+                key = (row['faculty_name'], row['venue'], tuple(row['slots']))
+            match = next((existing for existing in by_key.get(key, []) if _row_matches(existing, row)), None)
+            if match is None:
+                row = dict(row, slots=list(row['slots']))
+                merged.append(row)
+                by_key.setdefault(key, []).append(row)
+                continue
+            for field in ('course_code', 'course_name', 'faculty_name', 'venue'):
+                if not match[field] and row[field]:
+                    match[field] = row[field]
+            match['slots'].extend(slot for slot in row['slots'] if slot not in match['slots'])
+            if 'confidence' in row:
+                match['confidence'] = min(match.get('confidence', 1.0), row['confidence'])
+                match['slot_issues'] = match.get('slot_issues', []) + row.get('slot_issues', [])
+    return merged
+
+
+def record_tiling_fallback():
+    """Counts a tiled OCR run that had to fall back to a single call."""
+    with _stats_lock:
+        _stats['fallbacks'] += 1
+
+
+def tiling_stats():
+    """Returns tiling counters and settings for monitoring."""
+    with _stats_lock:
+        return dict(_stats, enabled=OCR_TILING_ENABLED, min_height=OCR_TILE_MIN_HEIGHT,
+                    tile_height=OCR_TILE_HEIGHT, overlap=OCR_TILE_OVERLAP,
+                    concurrency=OCR_TILE_CONCURRENCY)
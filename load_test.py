@@ -0,0 +1,165 @@
+"""
+Offline load test for the OCR pipeline using the replay OCR backend.
+
+Record some real responses first (OCR_BACKEND=record, then upload a few
+timetables), then e.g.:
+
+    python load_test.py --requests 2000 --threads 16
+    python load_test.py --via-app --requests 500          # through /upload + /jobs
+    python load_test.py --profile --requests 200          # cProfile of everything except the model
+    OCR_REPLAY_LATENCY_MS=800 OCR_REPLAY_ERROR_RATE=0.05 python load_test.py
+
+Caching and preprocessing are off by default so every request exercises the
+full path; pass --with-cache / --with-preprocess to include them.
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import threading
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+def load_images(paths):
+    """Reads image files (or every image in the given directories)."""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    images.append(os.path.join(path, name))
+        else:
+            images.append(path)
+    data = []
+    for path in images:
+        with open(path, 'rb') as f:
+            data.append((os.path.basename(path), f.read()))
+    return data
+
+
+def synthetic_images(count):
+    """Small distinct PNGs; with OCR_REPLAY_MISS=any each maps onto some recording."""
+    from PIL import Image
+    images = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new("L", (64, 64), i % 256).save(buffer, format="PNG")
+        images.append((f"synthetic_{i}.png", buffer.getvalue()))
+    return images
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_load(call, images, total, threads):
+    """Calls call(filename, data) `total` times across `threads` threads; returns (latencies, failures, seconds)."""
+    latencies, failures = [], []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            filename, data = images[i % len(images)]
+            started = time.perf_counter()
+            ok = call(filename, data)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failures.append(filename)
+
+    started = time.perf_counter()
+    if threads <= 1:
+        worker()  # Inline, so a profiler on this thread sees the calls
+    else:
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+    return latencies, failures, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline OCR pipeline load test (replay backend).")
+    parser.add_argument("images", nargs="*", help="Image files/directories (default: synthetic images)")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--via-app", action="store_true", help="Go through Flask /upload and poll /jobs/<id>")
+    parser.add_argument("--profile", action="store_true", help="Run under cProfile and print the top functions")
+    parser.add_argument("--with-cache", action="store_true")
+    parser.add_argument("--with-preprocess", action="store_true")
+    args = parser.parse_args()
+
+    # Must be set before the app modules read their configuration
+    os.environ.setdefault("OCR_BACKEND", "replay")
+    if not args.with_cache:
+        os.environ["OCR_CACHE_ENABLED"] = "0"
+    if not args.with_preprocess:
+        os.environ["OCR_PREPROCESS_ENABLED"] = "0"
+
+    images = load_images(args.images) if args.images else synthetic_images(256)
+
+    if args.via_app:
+        from app import app
+        app.config['TESTING'] = True
+        local = threading.local()
+
+        def call(filename, data):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = app.test_client()
+            response = client.post('/upload', data={'timetable_image': (io.BytesIO(data), filename)},
+                                   headers={'Accept': 'application/json'})
+            if response.status_code != 202:
+                return False
+            status_url = response.get_json()['status_url']
+            while True:
+                job = client.get(status_url).get_json()
+                if job['status'] in ('done', 'failed', 'unknown'):
+                    return job['status'] == 'done'
+                time.sleep(0.005)
+    else:
+        from ocr_script import run_ocr_and_extract
+
+        def call(filename, data):
+            return run_ocr_and_extract(data, mime_type="image/png", max_retries=1) is not None
+
+    # The pipeline prints per-call progress; silence it so output doesn't dominate the timing
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        if args.profile:
+            # cProfile only sees the calling thread, so profiling runs single-threaded
+            args.threads = 1
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            profiler.enable()
+            latencies, failures, seconds = run_load(call, images, args.requests, args.threads)
+            profiler.disable()
+        else:
+            latencies, failures, seconds = run_load(call, images, args.requests, args.threads)
+    finally:
+        sys.stdout = real_stdout
+
+    print(f"{len(latencies)} requests in {seconds:.2f}s -> {len(latencies) / seconds:.0f} req/s "
+          f"({args.threads} threads, {'app' if args.via_app else 'pipeline'} mode)")
+    print(f"latency ms: p50 {percentile(latencies, 0.5) * 1000:.2f}  p95 {percentile(latencies, 0.95) * 1000:.2f}  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f}  max {max(latencies) * 1000:.2f}")
+    print(f"failures: {len(failures)}")
+    if args.profile:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
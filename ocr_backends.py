@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+from gemini_client import get_genai, get_gemini_model
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# "gemini" (default) calls the model; "record" calls it and saves every response;
+# "replay" serves saved responses offline with synthetic latency/errors (for load tests).
+OCR_BACKEND = os.getenv("OCR_BACKEND", "gemini").lower()
+OCR_RECORDINGS_DIR = os.getenv("OCR_RECORDINGS_DIR", os.path.join("cache", "ocr_recordings"))
+# Replay latency: a number of milliseconds, or "recorded" to reuse each recording's real latency.
+OCR_REPLAY_LATENCY_MS = os.getenv("OCR_REPLAY_LATENCY_MS", "0")
+# Random +/- spread applied to the latency, as a fraction (0.2 = +/-20%).
+OCR_REPLAY_JITTER = float(os.getenv("OCR_REPLAY_JITTER", "0"))
+# Fraction of replayed calls that fail with a synthetic 503 (exercises retries/circuit breaker).
+OCR_REPLAY_ERROR_RATE = float(os.getenv("OCR_REPLAY_ERROR_RATE", "0"))
+# On a replay miss: "error" raises, "any" serves some recording (chosen by image hash).
+OCR_REPLAY_MISS = os.getenv("OCR_REPLAY_MISS", "any").lower()
+
+# --- Token Accounting ---
+# Per-mode totals from the responses' usage metadata ('compact' = structured-output calls).
+_usage_lock = threading.Lock()
+_usage = {}
+
+
+def record_token_usage(mode, usage_metadata):
+    """Adds one call's usage metadata (prompt/candidates/total token counts) to the totals."""
+    if usage_metadata is None:
+        return
+    with _usage_lock:
+        totals = _usage.setdefault(mode, {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'total_tokens': 0})
+        totals['calls'] += 1
+        totals['prompt_tokens'] += getattr(usage_metadata, 'prompt_token_count', 0) or 0
+        totals['output_tokens'] += getattr(usage_metadata, 'candidates_token_count', 0) or 0
+        totals['total_tokens'] += getattr(usage_metadata, 'total_token_count', 0) or 0
+
+
+def token_stats():
+    """Token totals and per-call averages by prompt mode, for monitoring."""
+    with _usage_lock:
+        stats = {}
+        for mode, totals in _usage.items():
+            calls = totals['calls']
+            stats[mode] = dict(totals,
+                               avg_prompt_tokens=round(totals['prompt_tokens'] / calls, 1),
+                               avg_output_tokens=round(totals['output_tokens'] / calls, 1))
+        return stats
+
+
+class OcrBlockedError(Exception):
+    """The backend refused or stopped the response (safety block, unexpected stop); retrying won't help."""
+
+
+class OcrBackend:
+    """
+    Interface for the model that turns a timetable image into JSON text.
+
+    generate() returns the complete response text; generate_stream() yields
+    text chunks as they arrive. generation_config (e.g. a response schema) is
+    passed through to the model as-is. Transient failures are raised as ordinary
+    exceptions (the retry loop in run_ocr_and_extract classifies them by
+    message), and non-retryable refusals as OcrBlockedError.
+    """
+
+    name = "base"
+    model_name = "unknown"
+    # Whether calls consume Gemini quota (and so must pass the shared rate limiter)
+    uses_quota = True
+
+    def is_available(self):
+        return True
+
+    def generate(self, prompt_part, image_data, mime_type, generation_config=None):
+        raise NotImplementedError
+
+    def generate_stream(self, prompt_part, image_data, mime_type, generation_config=None):
+        # Backends without native streaming deliver the whole text as one chunk
+        yield self.generate(prompt_part, image_data, mime_type, generation_config)
+
+
+class GeminiBackend(OcrBackend):
+    """Sends the prompt and inline image to a shared Gemini GenerativeModel."""
+
+    name = "gemini"
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def is_available(self):
+        return get_genai() is not None
+
+    def _contents(self, prompt_part, image_data, mime_type):
+        return {
+            "parts": [
+                prompt_part,
+                {
+                    "inline_data": {
+                        "mime_type": mime_type,
+                        "data": base64.b64encode(image_data).decode("utf-8"),
+                    }
+                },
+            ]
+        }
+
+    def _call(self, func):
+        genai = get_genai()
+        try:
+            return func()
+        except genai.types.generation_types.StopCandidateException as e:
+            raise OcrBlockedError(f"Generation stopped unexpectedly: {e}") from e
+        except genai.types.generation_types.BlockedPromptException as e:
+            raise OcrBlockedError(f"Response blocked due to safety reasons: {e}") from e
+
+    def generate(self, prompt_part, image_data, mime_type, generation_config=None):
+        model = get_gemini_model(self.model_name)
+        contents = self._contents(prompt_part, image_data, mime_type)
+        response = self._call(lambda: model.generate_content(contents, generation_config=generation_config))
+        text = self._call(lambda: response.text)
+        record_token_usage(_usage_mode(generation_config), getattr(response, 'usage_metadata', None))
+        return text
+
+    def generate_stream(self, prompt_part, image_data, mime_type, generation_config=None):
+        model = get_gemini_model(self.model_name)
+        contents = self._contents(prompt_part, image_data, mime_type)
+        response = self._call(lambda: model.generate_content(contents, generation_config=generation_config,
+                                                             stream=True))
+        iterator = iter(response)
+        usage_metadata = None
+        while True:
+            chunk = self._call(lambda: next(iterator, None))
+            if chunk is None:
+                break
+            # Each chunk reports the running totals; the last one covers the whole call
+            usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+            yield self._call(lambda: chunk.text)
+        record_token_usage(_usage_mode(generation_config), usage_metadata)
+
+
+def _usage_mode(generation_config):
+    return 'compact' if generation_config and generation_config.get('response_schema') else 'standard'
+
+
+def _image_key(image_data):
+    return hashlib.sha256(image_data).hexdigest()
+
+
+class RecordingBackend(OcrBackend):
+    """
+    Wraps a real backend and saves every successful response as
+    OCR_RECORDINGS_DIR/<sha256 of image>.json for later replay.
+    """
+
+    name = "record"
+
+    def __init__(self, inner, directory=OCR_RECORDINGS_DIR):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def is_available(self):
+        return self.inner.is_available()
+
+    def _save(self, image_data, text, latency_ms):
+        record = {'model': self.model_name, 'text': text,
+                  'latency_ms': round(latency_ms, 1), 'recorded_at': time.time()}
+        path = os.path.join(self.directory, f"{_image_key(image_data)}.json")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+        except OSError as e:
+            print(f"Warning: Could not save OCR recording to '{path}': {e}")
+
+    def generate(self, prompt_part, image_data, mime_type, generation_config=None):
+        started = time.perf_counter()
+        text = self.inner.generate(prompt_part, image_data, mime_type, generation_config)
+        self._save(image_data, text, (time.perf_counter() - started) * 1000)
+        return text
+
+    def generate_stream(self, prompt_part, image_data, mime_type, generation_config=None):
+        started = time.perf_counter()
+        parts = []
+        for chunk in self.inner.generate_stream(prompt_part, image_data, mime_type, generation_config):
+            parts.append(chunk)
+            yield chunk
+        self._save(image_data, "".join(parts), (time.perf_counter() - started) * 1000)
+
+
+class ReplayBackend(OcrBackend):
+    """
+    Serves recorded responses without any network access, with configurable
+    synthetic latency, jitter and error rate. Recordings are loaded into
+    memory once, so throughput is limited only by the rest of the pipeline.
+    """
+
+    name = "replay"
+    uses_quota = False
+
+    def __init__(self, directory=OCR_RECORDINGS_DIR, latency_ms=OCR_REPLAY_LATENCY_MS,
+                 jitter=OCR_REPLAY_JITTER, error_rate=OCR_REPLAY_ERROR_RATE, on_miss=OCR_REPLAY_MISS):
+        self.directory = directory
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.on_miss = on_miss
+        self._recordings = {}
+        self._lock = threading.Lock()
+        self.served = 0
+        self.misses = 0
+        self.synthetic_errors = 0
+        if os.path.isdir(directory):
+            for entry in sorted(os.listdir(directory)):
+                if not entry.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(directory, entry), encoding='utf-8') as f:
+                        self._recordings[entry[:-5]] = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Warning: Skipping unreadable OCR recording '{entry}': {e}")
+        self._keys = sorted(self._recordings)
+        models = {r.get('model') for r in self._recordings.values()}
+        self.model_name = f"replay:{models.pop() if len(models) == 1 else 'mixed'}"
+        print(f"Replay OCR backend loaded {len(self._keys)} recording(s) from '{directory}'.")
+
+    def is_available(self):
+        return bool(self._keys) or self.on_miss == "error"
+
+    def _lookup(self, image_data):
+        key = _image_key(image_data)
+        record = self._recordings.get(key)
+        if record is None:
+            with self._lock:
+                self.misses += 1
+            if self.on_miss != "any" or not self._keys:
+                raise LookupError(f"No OCR recording for image {key[:12]}")
+            record = self._recordings[self._keys[int(key, 16) % len(self._keys)]]
+        return record
+
+    def _delay_seconds(self, record):
+        if self.latency_ms == "recorded":
+            base = float(record.get('latency_ms', 0))
+        else:
+            base = float(self.latency_ms)
+        if self.jitter:
+            base *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0.0, base) / 1000
+
+    def _maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.synthetic_errors += 1
+            raise RuntimeError("503 Service Unavailable (synthetic replay error)")
+
+    def generate(self, prompt_part, image_data, mime_type, generation_config=None):
+        record = self._lookup(image_data)
+        delay = self._delay_seconds(record)
+        if delay:
+            time.sleep(delay)
+        self._maybe_fail()
+        with self._lock:
+            self.served += 1
+        return record['text']
+
+    def generate_stream(self, prompt_part, image_data, mime_type, generation_config=None, chunk_chars=64):
+        record = self._lookup(image_data)
+        text = record['text']
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+        # Spread the latency over the chunks so time-to-first-row behaves like the real stream
+        per_chunk = self._delay_seconds(record) / len(chunks)
+        self._maybe_fail()
+        for chunk in chunks:
+            if per_chunk:
+                time.sleep(per_chunk)
+            yield chunk
+        with self._lock:
+            self.served += 1
+
+    def stats(self):
+        with self._lock:
+            return {'recordings': len(self._keys), 'served': self.served, 'misses': self.misses,
+                    'synthetic_errors': self.synthetic_errors, 'latency_ms': self.latency_ms,
+                    'error_rate': self.error_rate}
+
+
+# --- Shared Instance ---
+_backend_instance = None
+_backend_instance_lock = threading.Lock()
+
+
+def get_ocr_backend(model_name):
+    """Returns the process-wide OCR backend selected by OCR_BACKEND."""
+    global _backend_instance
+    if _backend_instance is None:
+        with _backend_instance_lock:
+            if _backend_instance is None:
+                if OCR_BACKEND == "replay":
+                    _backend_instance = ReplayBackend()
+                elif OCR_BACKEND == "record":
+                    _backend_instance = RecordingBackend(GeminiBackend(model_name))
+                else:
+                    if OCR_BACKEND != "gemini":
+                        print(f"Warning: Unknown OCR_BACKEND '{OCR_BACKEND}', using gemini.")
+                    _backend_instance = GeminiBackend(model_name)
+    return _backend_instance
+
+
+def backend_stats():
+    """Which backend is active (plus replay counters) for monitoring."""
+    backend = _backend_instance
+    if backend is None:
+        return {'backend': OCR_BACKEND, 'initialized': False}
+    data = {'backend': backend.name, 'model': backend.model_name}
+    if isinstance(backend, ReplayBackend):
+        data.update(backend.stats())
+    return data
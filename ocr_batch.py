@@ -0,0 +1,77 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from ocr_script import run_ocr_and_extract
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Default number of images a single batch OCRs at once (clients may ask for fewer, never more).
+OCR_BATCH_CONCURRENCY = int(os.getenv("OCR_BATCH_CONCURRENCY", "4"))
+# Ceiling on in-flight batch OCR calls across all batches, so parallel batches share one budget.
+OCR_BATCH_MAX_CONCURRENCY = int(os.getenv("OCR_BATCH_MAX_CONCURRENCY", "8"))
+# Largest number of images accepted in one batch.
+OCR_BATCH_MAX_IMAGES = int(os.getenv("OCR_BATCH_MAX_IMAGES", "200"))
+
+_global_slots = threading.BoundedSemaphore(OCR_BATCH_MAX_CONCURRENCY)
+_stats_lock = threading.Lock()
+_stats = {'batches': 0, 'images': 0, 'succeeded': 0, 'failed': 0}
+
+
+def _ocr_one(index, filename, image_data, mime_type, slot_grid):
+    """OCRs a single batch item; never raises, so one bad image can't sink the batch."""
+    started = time.perf_counter()
+    with _global_slots:
+        try:
+            result = run_ocr_and_extract(image_data, mime_type=mime_type, slot_grid=slot_grid)
+            error = None if result is not None else "OCR failed (see server logs)."
+        except Exception as e:
+            result, error = None, f"Unexpected error during OCR: {e}"
+    return {
+        'index': index,
+        'filename': filename,
+        'status': 'done' if error is None else 'failed',
+        'result': result,
+        'error': error,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def run_ocr_batch(items, concurrency=None, slot_grid=None):
+    """
+    OCRs a batch of (filename, image_bytes, mime_type) items concurrently and
+    yields one result dict per image in completion order (not input order).
+
+    Concurrency is capped per batch by `concurrency` (default OCR_BATCH_CONCURRENCY)
+    and across batches by OCR_BATCH_MAX_CONCURRENCY; every call also passes
+    through the shared Gemini rate limiter, so quota limits still hold.
+    Slot codes are corrected against slot_grid (see run_ocr_and_extract).
+    """
+    concurrency = max(1, min(concurrency or OCR_BATCH_CONCURRENCY, OCR_BATCH_MAX_CONCURRENCY))
+    with _stats_lock:
+        _stats['batches'] += 1
+        _stats['images'] += len(items)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ocr-batch")
+    try:
+        futures = [executor.submit(_ocr_one, index, filename, data, mime_type, slot_grid)
+                   for index, (filename, data, mime_type) in enumerate(items)]
+        for future in as_completed(futures):
+            outcome = future.result()
+            with _stats_lock:
+                _stats['succeeded' if outcome['status'] == 'done' else 'failed'] += 1
+            yield outcome
+    finally:
+        # If the client goes away mid-batch, don't start the images still waiting
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_stats():
+    """Lifetime batch counters for monitoring."""
+    with _stats_lock:
+        return dict(_stats, default_concurrency=OCR_BATCH_CONCURRENCY,
+                    max_concurrency=OCR_BATCH_MAX_CONCURRENCY)
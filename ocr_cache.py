@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# SQLite file holding OCR results keyed by image content + prompt/model version.
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", os.path.join("cache", "ocr_cache.sqlite3"))
+# Entries older than this are treated as misses and purged (default: 30 days).
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+# LRU limits: whichever is hit first triggers eviction of least recently used rows.
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "5000"))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))  # 50 MB of stored JSON
+# Set OCR_CACHE_ENABLED=0 to bypass the cache entirely.
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+
+
+def make_cache_key(image_data, model_name, prompt_version):
+    """
+    Builds a content-addressed cache key from the raw image bytes and the
+    model/prompt that produced the result, so prompt or model changes never
+    serve stale extractions.
+    """
+    digest = hashlib.sha256(image_data).hexdigest()
+    return f"{digest}:{model_name}:{prompt_version}"
+
+
+class OcrResultCache:
+    """
+    Persistent, size/TTL-bounded LRU cache of processed OCR results.
+
+    Values are the normalized lists returned by process_gemini_response, stored
+    as JSON. A single connection is shared between threads behind a lock; WAL
+    mode lets several worker processes use the same file.
+    """
+
+    def __init__(self, path=OCR_CACHE_PATH, ttl_seconds=OCR_CACHE_TTL_SECONDS,
+                 max_entries=OCR_CACHE_MAX_ENTRIES, max_bytes=OCR_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS ocr_results (
+                   cache_key   TEXT PRIMARY KEY,
+                   result_json TEXT NOT NULL,
+                   size_bytes  INTEGER NOT NULL,
+                   created_at  REAL NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ocr_results_last_access ON ocr_results (last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """Returns the cached result list for key, or None on a miss/expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result_json, created_at FROM ocr_results WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            result_json, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM ocr_results WHERE cache_key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE ocr_results SET last_access = ? WHERE cache_key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(result_json)
+
+    def put(self, key, result):
+        """Stores a result list under key and evicts entries beyond the configured limits."""
+        result_json = json.dumps(result, separators=(",", ":"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO ocr_results
+                       (cache_key, result_json, size_bytes, created_at, last_access)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (key, result_json, len(result_json), now, now),
+            )
+            self.stores += 1
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """Drops expired rows, then least recently used rows until within limits. Caller holds the lock."""
+        if self.ttl_seconds:
+            cursor = self._conn.execute(
+                "DELETE FROM ocr_results WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM ocr_results"
+        ).fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        # Walk from the least recently used end, dropping rows until both limits hold.
+        to_delete = []
+        for cache_key, size_bytes in self._conn.execute(
+            "SELECT cache_key, size_bytes FROM ocr_results ORDER BY last_access ASC"
+        ):
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            to_delete.append((cache_key,))
+            count -= 1
+            total_bytes -= size_bytes
+        self._conn.executemany("DELETE FROM ocr_results WHERE cache_key = ?", to_delete)
+        self.evictions += len(to_delete)
+
+    def clear(self):
+        """Removes every cached result (counters are kept)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM ocr_results")
+            self._conn.commit()
+
+    def stats(self):
+        """Returns hit/miss counters and current size for monitoring."""
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM ocr_results"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'entries': count,
+            'size_bytes': total_bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+        }
+
+
+# --- Shared Instance ---
+_cache_instance = None
+_cache_instance_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    """Returns the process-wide cache, creating it on first use (None when disabled or unavailable)."""
+    global _cache_instance
+    if not OCR_CACHE_ENABLED:
+        return None
+    if _cache_instance is None:
+        with _cache_instance_lock:
+            if _cache_instance is None:
+                try:
+                    _cache_instance = OcrResultCache()
+                except Exception as e:
+                    print(f"Warning: Could not open OCR cache at '{OCR_CACHE_PATH}': {e}")
+                    return None
+    return _cache_instance
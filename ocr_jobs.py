@@ -0,0 +1,181 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Number of OCR jobs that may run at once (each mostly waits on the Gemini API).
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "4"))
+# Jobs waiting for a worker beyond this are rejected so the queue can't grow without bound.
+OCR_MAX_PENDING_JOBS = int(os.getenv("OCR_MAX_PENDING_JOBS", "50"))
+# Finished jobs are kept this long for the browser to collect the result.
+OCR_JOB_TTL_SECONDS = int(os.getenv("OCR_JOB_TTL_SECONDS", "900"))
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when too many OCR jobs are already waiting for a worker."""
+
+
+class OcrJob:
+    """State of one background OCR run, as reported by the status endpoint."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.rows = []  # Partial rows streamed so far (replaced wholesale on each update)
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def set_rows(self, rows):
+        """on_rows callback for streaming OCR: records the rows parsed so far."""
+        self.rows = rows
+
+    def to_dict(self, include_result=True, since=0):
+        """
+        JSON-serializable view of the job for API responses. While the job runs,
+        'rows' holds streamed rows from index `since` on; 'row_count' is the total
+        so a client can tell when a retry restarted the stream.
+        """
+        rows = self.rows
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'queued_seconds': round((self.started_at or time.time()) - self.created_at, 2),
+        }
+        if self.started_at:
+            data['run_seconds'] = round((self.finished_at or time.time()) - self.started_at, 2)
+        if include_result and self.status == DONE:
+            data['result'] = self.result
+        elif not self.finished:
+            data['row_count'] = len(rows)
+            data['rows'] = rows[since:] if since <= len(rows) else rows
+        return data
+
+
+class OcrJobManager:
+    """
+    Runs OCR calls on a bounded thread pool so web workers return immediately.
+
+    Jobs live in memory and are looked up by id; finished jobs are purged after
+    OCR_JOB_TTL_SECONDS. With several server processes, a job is only visible
+    to the process that accepted it, so run a single process or use sticky sessions.
+    """
+
+    def __init__(self, workers=OCR_WORKERS, max_pending=OCR_MAX_PENDING_JOBS, ttl_seconds=OCR_JOB_TTL_SECONDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, func, *args, stream_rows=False, **kwargs):
+        """
+        Queues func(*args, **kwargs) and returns the OcrJob immediately.
+        func should return the OCR result list, or None to signal failure.
+        With stream_rows, func is also passed on_rows=job.set_rows so partial
+        results show up in the job status while it runs.
+        """
+        with self._lock:
+            self._purge_locked()
+            pending = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFullError(f"{pending} OCR jobs are already waiting")
+            job = OcrJob()
+            self._jobs[job.id] = job
+            self.submitted += 1
+        if stream_rows:
+            kwargs['on_rows'] = job.set_rows
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        job.started_at = time.time()
+        job.status = RUNNING
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            print(f"OCR job {job.id} raised an error: {e}")
+            result = None
+            job.error = f"Unexpected error during OCR: {e}"
+        job.finished_at = time.time()
+        if result is None:
+            job.error = job.error or "OCR process failed critically. Check API key, network, or server logs."
+            job.status = FAILED
+        else:
+            job.result = result
+            job.status = DONE
+        with self._lock:
+            if job.status == DONE:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def get(self, job_id):
+        """Returns the job with this id, or None if it is unknown or has expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge_locked(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        """Returns queue depth and lifetime counters for monitoring."""
+        with self._lock:
+            by_status = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                by_status[job.status] += 1
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'queued': by_status[QUEUED],
+                'running': by_status[RUNNING],
+                'retained_finished': by_status[DONE] + by_status[FAILED],
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+            }
+
+
+# --- Shared Instance ---
+_manager_instance = None
+_manager_instance_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Returns the process-wide job manager, creating its worker pool on first use."""
+    global _manager_instance
+    if _manager_instance is None:
+        with _manager_instance_lock:
+            if _manager_instance is None:
+                _manager_instance = OcrJobManager()
+    return _manager_instance
@@ -1,32 +1,29 @@
 import os
 import re
-import google.generativeai as genai
-from PIL import Image
-import io
-import base64
 import time
 import json # Use json module
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from ocr_cache import get_ocr_cache, make_cache_key
+from ocr_similarity import get_similarity_index, compute_image_signature
+from image_preprocess import preprocess_image, PREPROCESS_VERSION
+from image_tiling import split_into_tiles, merge_tile_rows, record_tiling_fallback, OCR_TILE_CONCURRENCY
+from gemini_limiter import get_rate_limiter, get_circuit_breaker, backoff_delay
+from ocr_backends import get_ocr_backend, OcrBlockedError
+from slot_validation import SlotIndex
+from slot_table import compile_slot_table
+
 # Load environment variables from .env file
 load_dotenv()
 
-# --- Configuration ---
-API_KEY = os.getenv("GEMINI_API_KEY") # Use environment variable
+# The model is reached through an OCR backend (Gemini by default, or record/replay; see
+# ocr_backends). Gemini itself is imported and configured lazily to keep startup fast.
 
-# Configure Gemini API - Moved configuration logic here for clarity
-gemini_configured = False
-if API_KEY:
-    try:
-        genai.configure(api_key=API_KEY)
-        gemini_configured = True
-        print("Gemini API Key configured successfully.")
-    except Exception as e:
-        print(f"Error configuring Gemini API: {e}")
-        print("OCR functionality will likely fail.")
-else:
-    print("Warning: GEMINI_API_KEY not found in environment variables or .env file.")
-    print("OCR functionality will likely fail.")
+# Stream completions (when the caller wants rows as they arrive); set OCR_STREAMING=0 to disable.
+OCR_STREAMING_ENABLED = os.getenv("OCR_STREAMING", "1") not in ("0", "false", "False", "")
 
 # --- Time Slot Mapping (Keep as provided) ---
 time_slots = {
@@ -68,105 +65,17 @@ time_slots = {
     }
 }
 
+# Compiled once: slot code -> weekday/RRULE day/times, shared by OCR validation and event creation
+slot_table = compile_slot_table(time_slots)
+# Valid slot codes, indexed once so OCR'd codes can be corrected before any Calendar calls
+# (used when no slot grid is chosen; see slot_grids.SlotGrid.index)
+slot_index = SlotIndex(slot_table.codes)
 
-# --- Updated process_gemini_response ---
-def process_gemini_response(response_text):
-    """
-    Processes the JSON response from the Gemini API using json.loads.
-    """
-    if not response_text:
-        print("Error: Received empty response text from Gemini.")
-        return []
-    try:
-        # Clean the response: remove potential markdown fences and strip whitespace
-        cleaned_text = response_text.strip()
-        if cleaned_text.startswith("```json"):
-            cleaned_text = cleaned_text[7:]
-        if cleaned_text.endswith("```"):
-            cleaned_text = cleaned_text[:-3]
-        cleaned_text = cleaned_text.strip()
-
-        if not cleaned_text:
-             print("Error: Response text became empty after cleaning markdown fences.")
-             return []
-
-        # Use json.loads for standard JSON parsing
-        data = json.loads(cleaned_text)
-
-        # Basic validation: Check if it's a list
-        if not isinstance(data, list):
-            print(f"Error: Parsed JSON data is not a list. Type: {type(data)}")
-            print(f"Cleaned text was: {cleaned_text}")
-            return []
-
-        # Further validation and normalization
-        validated_data = []
-        for item in data:
-            if isinstance(item, dict):
-                # Normalize keys and default values
-                normalized_item = {
-                    'course_code': str(item.get('course_code', "")).strip(),
-                    'course_name': str(item.get('course_name', "")).strip(),
-                    'faculty_name': str(item.get('faculty_name', "")).strip(),
-                    'venue': str(item.get('venue', "")).strip(),
-                    'slots': [] # Default to empty list
-                }
-
-                # Process slots: ensure it's a list of strings
-                slots_raw = item.get('slots')
-                if isinstance(slots_raw, list):
-                    normalized_item['slots'] = [str(s).strip().upper() for s in slots_raw if str(s).strip()]
-                elif isinstance(slots_raw, str) and slots_raw.strip():
-                     # Split string by comma or space, trim, filter empty, uppercase
-                     normalized_item['slots'] = [s.strip().upper() for s in re.split(r'[,\s]+', slots_raw) if s.strip()]
-
-                validated_data.append(normalized_item)
-            else:
-                print(f"Warning: Skipping non-dictionary item in JSON list: {item}")
-
-        return validated_data
-
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON response: {e}")
-        print(f"Response text (cleaned) that failed parsing was:\n---\n{cleaned_text}\n---")
-        return [] # Return empty list on JSON parsing failure
-    except Exception as e: # Catch other potential errors during validation
-        print(f"An unexpected error occurred during response processing: {e}")
-        print(f"Response text (cleaned) was:\n---\n{cleaned_text}\n---")
-        return []
 
-
-# --- Updated run_ocr_and_extract ---
-def run_ocr_and_extract(image_data, mime_type="image/png", max_retries=3, retry_delay=10):
-    """
-    Runs OCR on image data using Gemini API, requests JSON, extracts schedule data,
-    and retries on timeout/errors.
-    """
-    global gemini_configured
-    if not gemini_configured:
-         print("Error: Gemini API is not configured. Cannot run OCR.")
-         # Return None to indicate a configuration failure upstream
-         # Or potentially raise an Exception
-         return None
-
-    # Configure the model
-    # Using 'gemini-1.5-flash-latest' as it's generally available and capable
-    try:
-        model = genai.GenerativeModel("gemini-1.5-flash-latest")
-    except Exception as e:
-        print(f"Error creating Gemini model: {e}")
-        return None # Cannot proceed without a model
-
-    # Prepare image data
-    try:
-        image_base64 = base64.b64encode(image_data).decode("utf-8")
-    except Exception as e:
-        print(f"Error encoding image to base64: {e}")
-        return None # Cannot proceed without image data
-
-
-    # --- JSON Prompt ---
-    prompt = """
+# --- OCR Prompt ---
+# Bump GEMINI_MODEL_NAME or edit OCR_PROMPT and cached results are invalidated automatically.
+GEMINI_MODEL_NAME = "gemini-1.5-flash-latest"
+OCR_PROMPT = """
 Extract the schedule information from the attached image.
 Provide the extracted data strictly in **JSON format**. The output should be a JSON array (list) of JSON objects (dictionaries).
 
@@ -194,20 +103,516 @@ Example Output Format (Strict JSON):
 ]
 """
 
-    contents = {
-        "parts": [
-            {"text": prompt},
-            {
-                "inline_data": {
-                    "mime_type": mime_type,
-                    "data": image_base64,
-                }
-            },
-        ]
+# Compact mode (OCR_COMPACT_MODE=1): a short prompt plus the model's structured-output
+# support, with one-letter keys that normalize_course_item expands back. The schema
+# enforces the JSON shape, so the prompt no longer has to spell it out, and the
+# response doesn't repeat the long key names for every course.
+OCR_COMPACT_MODE = os.getenv("OCR_COMPACT_MODE", "0") not in ("0", "false", "False", "")
+COMPACT_FIELD_NAMES = {"c": "course_code", "n": "course_name", "f": "faculty_name", "v": "venue", "s": "slots"}
+OCR_COMPACT_PROMPT = (
+    "List every course in this timetable image. c=course code, n=course name, f=faculty, v=venue, "
+    "s=slot codes (split combined slots like \"A11+TA11\" into separate items). Use \"\" or [] when missing."
+)
+OCR_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "c": {"type": "STRING"},
+            "n": {"type": "STRING"},
+            "f": {"type": "STRING"},
+            "v": {"type": "STRING"},
+            "s": {"type": "ARRAY", "items": {"type": "STRING"}},
+        },
+        "required": ["c", "n", "f", "v", "s"],
+    },
+}
+
+_active_prompt = OCR_COMPACT_PROMPT if OCR_COMPACT_MODE else OCR_PROMPT
+OCR_GENERATION_CONFIG = (
+    {"response_mime_type": "application/json", "response_schema": OCR_RESPONSE_SCHEMA}
+    if OCR_COMPACT_MODE else None
+)
+OCR_PROMPT_VERSION = hashlib.sha256(
+    (_active_prompt + json.dumps(OCR_GENERATION_CONFIG, sort_keys=True)).encode("utf-8")
+).hexdigest()[:12]
+# Built once; only the image part changes between requests.
+OCR_PROMPT_PART = {"text": _active_prompt}
+# Cached results depend on both the prompt and what the image looked like after preprocessing.
+OCR_RESULT_VERSION = f"{OCR_PROMPT_VERSION}-{PREPROCESS_VERSION}"
+
+
+# --- Row Normalization ---
+def normalize_course_item(item):
+    """Normalizes one course dict from the model into the shape the results table expects."""
+    # Compact-mode responses use one-letter keys
+    if any(key in item for key in COMPACT_FIELD_NAMES):
+        item = {COMPACT_FIELD_NAMES.get(key, key): value for key, value in item.items()}
+    # Normalize keys and default values
+    normalized_item = {
+        'course_code': str(item.get('course_code', "")).strip(),
+        'course_name': str(item.get('course_name', "")).strip(),
+        'faculty_name': str(item.get('faculty_name', "")).strip(),
+        'venue': str(item.get('venue', "")).strip(),
+        'slots': [] # Default to empty list
     }
 
+    # Process slots: ensure it's a list of strings
+    slots_raw = item.get('slots')
+    if isinstance(slots_raw, list):
+        normalized_item['slots'] = [str(s).strip().upper() for s in slots_raw if str(s).strip()]
+    elif isinstance(slots_raw, str) and slots_raw.strip():
+         # Split string by comma or space, trim, filter empty, uppercase
+         normalized_item['slots'] = [s.strip().upper() for s in re.split(r'[,\s]+', slots_raw) if s.strip()]
+
+    return normalized_item
+
+
+class IncrementalRowParser:
+    """
+    Incrementally parses a streamed JSON array of course objects.
+
+    feed() accepts arbitrary text chunks (split anywhere, even inside strings)
+    and returns the normalized rows whose closing brace arrived in that chunk.
+    Text before the opening '[' (e.g. a ```json fence) is ignored, and string
+    contents are tracked so braces inside values don't confuse the depth count.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._buffer = []  # characters of the object currently being read
+
+    def feed(self, chunk):
+        new_rows = []
+        for char in chunk:
+            if not self._in_array:
+                if char == '[':
+                    self._in_array = True
+                continue
+
+            if self._depth == 0:
+                # Between objects: only '{' (start) matters; ',' / whitespace / ']' are skipped
+                if char == '{':
+                    self._depth = 1
+                    self._buffer = [char]
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    row = self._close_object("".join(self._buffer))
+                    if row is not None:
+                        new_rows.append(row)
+        self.rows.extend(new_rows)
+        return new_rows
+
+    def _close_object(self, text):
+        self._buffer = []
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError as e:
+            print(f"Warning: Skipping malformed streamed object ({e}): {text[:200]}")
+            return None
+        if not isinstance(item, dict):
+            return None
+        return normalize_course_item(item)
+
+
+# --- Tolerant Response Parsing ---
+# Trailing commas before a closing bracket/brace, e.g. `[{...},]` or `{"a": 1,}`
+_TRAILING_COMMA = re.compile(r',\s*([\]}])')
+
+_parse_stats_lock = threading.Lock()
+_parse_stats = {'strict': 0, 'recovered': 0, 'failed': 0, 'empty': 0, 'unrecoverable_fragments': 0}
+
+
+def _loads_lenient(text):
+    """json.loads, retrying once with trailing commas removed."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA.sub(r'\1', text))
+
+
+def _find_course_list(data):
+    """Returns the list of course dicts in parsed JSON: the list itself, a single course dict, or a list under a wrapper key."""
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        if 'course_code' in data or 'slots' in data:
+            return [data]
+        for value in data.values():
+            if isinstance(value, list) and any(isinstance(v, dict) for v in value):
+                return value
+    return None
+
+
+def _scan_objects(text, start):
+    """
+    Splits text[start:] into top-level {...} spans, tracking strings/escapes.
+    Returns (object_texts, stray_fragments, truncated_tail): stray fragments are
+    non-JSON text found between objects, truncated_tail an object that never closed.
+    """
+    objects, strays = [], []
+    depth = 0
+    in_string = escaped = False
+    object_start = None
+    stray_start = start
+    for i in range(start, len(text)):
+        char = text[i]
+        if depth == 0:
+            if char == '{':
+                stray = text[stray_start:i].strip(" \t\r\n,[]")
+                if stray:
+                    strays.append(stray)
+                depth, object_start = 1, i
+            continue
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                objects.append(text[object_start:i + 1])
+                stray_start = i + 1
+    truncated = text[object_start:] if depth > 0 else None
+    if depth == 0:
+        stray = text[stray_start:].strip(" \t\r\n,[]`")
+        if stray:
+            strays.append(stray)
+    return objects, strays, truncated
+
+
+def parse_gemini_response(response_text):
+    """
+    Parses a model response into normalized course rows, salvaging what it can.
+
+    Clean JSON goes through a single json.loads (the fast path). Otherwise any
+    wrapper text (markdown fences, prose before/after) is skipped, trailing
+    commas are tolerated, and every complete course object is kept even if
+    the array is truncated or one object is malformed.
+
+    Returns (rows, report). report['mode'] is 'strict', 'recovered', 'failed'
+    or 'empty'; report['unrecoverable'] lists data fragments that had to be
+    dropped and report['stripped'] the wrapper text around the JSON.
+    """
+    report = {'mode': 'empty', 'unrecoverable': [], 'stripped': [], 'truncated': False}
+    cleaned_text = (response_text or "").strip()
+    if cleaned_text.startswith("```"):
+        # Drop an opening fence with any language tag (```json, ```JSON, ``` ...)
+        cleaned_text = cleaned_text.split("\n", 1)[1] if "\n" in cleaned_text else ""
+    if cleaned_text.endswith("```"):
+        cleaned_text = cleaned_text[:-3]
+    cleaned_text = cleaned_text.strip()
+    if not cleaned_text:
+        return [], report
+
+    # Fast path: the response is exactly what the prompt asked for
+    if cleaned_text[0] == '[':
+        try:
+            data = json.loads(cleaned_text)
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, list):
+            report['mode'] = 'strict'
+            rows = []
+            for item in data:
+                if isinstance(item, dict):
+                    rows.append(normalize_course_item(item))
+                else:
+                    report['unrecoverable'].append(str(item)[:200])
+            return rows, report
+
+    # Slow path: find the JSON inside whatever surrounds it
+    report['mode'] = 'recovered'
+    starts = [i for i in (cleaned_text.find('['), cleaned_text.find('{')) if i != -1]
+    if not starts:
+        report['mode'] = 'failed'
+        report['unrecoverable'].append(cleaned_text[:200])
+        return [], report
+    start = min(starts)
+    if start > 0:
+        report['stripped'].append(cleaned_text[:start].strip()[:200])
+
+    # Whole-document attempt (handles wrappers like {"courses": [...]} and trailing commas)
+    closing = ']' if cleaned_text[start] == '[' else '}'
+    end = cleaned_text.rfind(closing)
+    if end > start:
+        try:
+            courses = _find_course_list(_loads_lenient(cleaned_text[start:end + 1]))
+        except json.JSONDecodeError:
+            courses = None
+        if courses is not None:
+            rows = []
+            for item in courses:
+                if isinstance(item, dict):
+                    rows.append(normalize_course_item(item))
+                else:
+                    report['unrecoverable'].append(str(item)[:200])
+            trailing = cleaned_text[end + 1:].strip()
+            if trailing:
+                report['stripped'].append(trailing[:200])
+            return rows, report
+
+    # Object-by-object salvage (truncated arrays, one broken object among good ones)
+    objects, strays, truncated = _scan_objects(cleaned_text, start)
+    report['unrecoverable'].extend(fragment[:200] for fragment in strays)
+    rows = []
+    for object_text in objects:
+        try:
+            item = _loads_lenient(object_text)
+        except json.JSONDecodeError:
+            report['unrecoverable'].append(object_text[:200])
+            continue
+        if isinstance(item, dict):
+            rows.append(normalize_course_item(item))
+    if truncated:
+        report['truncated'] = True
+        report['unrecoverable'].append(truncated[:200])
+    if not rows:
+        report['mode'] = 'failed'
+    return rows, report
+
+
+def process_gemini_response(response_text, index=None):
+    """
+    Processes the JSON response from the Gemini API into normalized course rows.
+    Malformed responses are salvaged where possible (see parse_gemini_response).
+
+    Slot codes are checked against index (the chosen slot grid's SlotIndex;
+    default: the built-in time_slots) and corrected where the fix is
+    unambiguous ("A1l" -> "A11", "B2 1" -> "B21"); each row gets a 'confidence'
+    and the 'slot_issues' that were fixed or left unresolved.
+    """
+    rows, report = parse_gemini_response(response_text)
+    (index or slot_index).validate_rows(rows)
+    _log_slot_issues(rows)
+    mode = report['mode']
+    with _parse_stats_lock:
+        _parse_stats[mode] += 1
+        _parse_stats['unrecoverable_fragments'] += len(report['unrecoverable'])
+
+    if mode == 'empty':
+        print("Error: Received empty response text from Gemini.")
+    elif mode == 'failed':
+        print(f"Error: Could not recover any course data from response. Unparseable parts: {report['unrecoverable']}")
+    elif mode == 'recovered':
+        print(f"Warning: Response was not clean JSON; recovered {len(rows)} course(s)"
+              f"{' from a truncated array' if report['truncated'] else ''}.")
+        if report['unrecoverable']:
+            print(f"Dropped unrecoverable parts: {report['unrecoverable']}")
+    elif report['unrecoverable']:
+        print(f"Warning: Skipping non-dictionary items in JSON list: {report['unrecoverable']}")
+    return rows
+
+
+def _log_slot_issues(rows):
+    for row in rows:
+        for issue in row['slot_issues']:
+            if issue['fix'] == 'duplicate':
+                print(f"Dropped slot '{issue['raw']}' for {row['course_code'] or row['course_name']}: "
+                      f"same as '{issue['slot']}', already listed.")
+            elif issue['slot']:
+                print(f"Corrected slot '{issue['raw']}' -> '{issue['slot']}' for {row['course_code'] or row['course_name']}.")
+            else:
+                print(f"Warning: Slot '{issue['raw']}' for {row['course_code'] or row['course_name']} "
+                      f"is not in the time slot mapping and could not be corrected.")
+
+
+def parse_stats():
+    """How often responses parsed cleanly vs. needed recovery, for monitoring."""
+    with _parse_stats_lock:
+        return dict(_parse_stats)
+
+
+def _generate_streaming(backend, image_data, mime_type, on_rows, index):
+    """
+    Streams a completion, calling on_rows(rows_so_far) each time another course
+    object closes, with its slots checked against index. Returns (full_text, streamed_rows).
+    """
+    parser = IncrementalRowParser()
+    text_parts = []
+    started = time.perf_counter()
+    first_row_at = None
+    on_rows([])  # A retry starts from an empty table
+    for text in backend.generate_stream(OCR_PROMPT_PART, image_data, mime_type, OCR_GENERATION_CONFIG):
+        text_parts.append(text)
+        new_rows = parser.feed(text)
+        if new_rows:
+            index.validate_rows(new_rows)
+            if first_row_at is None:
+                first_row_at = time.perf_counter() - started
+            on_rows(list(parser.rows))
+    total = time.perf_counter() - started
+    if first_row_at is not None:
+        print(f"Streamed {len(parser.rows)} row(s): first row after {first_row_at:.2f}s, complete after {total:.2f}s.")
+    return "".join(text_parts), parser.rows
+
+
+def _run_tiled_ocr(image_data, max_retries, retry_delay, on_rows, slot_grid):
+    """
+    OCRs a very tall image as overlapping bands in parallel and merges the rows.
+    Returns None if the image doesn't need tiling or any band fails, in which
+    case the caller falls back to a single call on the whole image.
+    """
+    tiles = split_into_tiles(image_data)
+    if not tiles:
+        return None
+    started = time.perf_counter()
+    results = [None] * len(tiles)
+    with ThreadPoolExecutor(max_workers=max(1, OCR_TILE_CONCURRENCY), thread_name_prefix="ocr-tile") as executor:
+        futures = {executor.submit(run_ocr_and_extract, tile, "image/png", max_retries, retry_delay,
+                                   use_cache=False, tiling=False, slot_grid=slot_grid): index
+                   for index, tile in enumerate(tiles)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if on_rows is not None:
+                # Show what has been merged so far; bands finish in any order
+                on_rows(merge_tile_rows([rows for rows in results if rows]))
+    if any(rows is None for rows in results):
+        print("One or more image bands failed; retrying the whole image in a single call.")
+        record_tiling_fallback()
+        if on_rows is not None:
+            on_rows([])
+        return None
+    merged = merge_tile_rows(results)
+    print(f"Tiled OCR: {sum(len(rows) for rows in results)} band row(s) merged into {len(merged)} "
+          f"course(s) in {time.perf_counter() - started:.2f}s.")
+    return merged
+
+
+# --- Updated run_ocr_and_extract ---
+def run_ocr_and_extract(image_data, mime_type="image/png", max_retries=3, retry_delay=None, use_cache=True,
+                        on_rows=None, tiling=True, slot_grid=None):
+    """
+    Runs OCR on image data using the configured OCR backend (Gemini API by default),
+    requests JSON, extracts schedule data, and retries on timeout/errors.
+
+    Calls go through the shared Gemini rate limiter and circuit breaker; retries
+    back off exponentially with jitter (retry_delay overrides the base delay).
+
+    If on_rows is given, the completion is streamed and on_rows(rows_so_far) is
+    called as each course object is parsed, so callers can show partial results.
+
+    Results are looked up in (and stored to) the persistent OCR cache keyed by the
+    image bytes plus model/prompt version, so repeat uploads skip the model call.
+    On an exact miss, the optional perceptual-hash index (off by default) is
+    consulted so near-duplicate uploads of the same timetable, with the same
+    aspect ratio, reuse the stored result as well.
+
+    With tiling, very tall images are split into overlapping bands along table
+    row boundaries, OCR'd concurrently and merged by course_code (see image_tiling).
+
+    slot_grid (a slot_grids.SlotGrid) is the campus/semester timetable slot codes
+    are corrected against; without one, the built-in time_slots. Corrections
+    depend on the grid, so results are cached per grid version.
+    """
+    backend = get_ocr_backend(GEMINI_MODEL_NAME)
+    index = slot_grid.index if slot_grid is not None else slot_index
+    result_version = (OCR_RESULT_VERSION if slot_grid is None
+                      else f"{OCR_RESULT_VERSION}-{slot_grid.key}@{slot_grid.version}")
+    cache = get_ocr_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = make_cache_key(image_data, backend.model_name, result_version)
+            cached_data = cache.get(cache_key)
+            if cached_data is not None:
+                print(f"OCR cache hit ({len(cached_data)} item(s)); skipping Gemini call.")
+                return cached_data
+        except Exception as e:
+            print(f"Warning: OCR cache lookup failed, continuing without cache: {e}")
+            cache = None
+
+    # No exact hit: look for a perceptually similar image (re-saved JPEG, different screenshot size, etc.)
+    similarity_index = get_similarity_index() if cache is not None else None
+    image_hash = image_aspect = None
+    if similarity_index is not None:
+        try:
+            image_hash, image_aspect = compute_image_signature(image_data)
+            key_suffix = f":{backend.model_name}:{result_version}"
+            for distance, near_key in similarity_index.find(image_hash, key_suffix, image_aspect):
+                near_data = cache.get(near_key)
+                if near_data is None:
+                    # Underlying cache entry expired or was evicted; forget it
+                    similarity_index.remove(near_key)
+                    continue
+                similarity_index.record_hit()
+                print(f"OCR near-duplicate hit (distance {distance}, {len(near_data)} item(s)); skipping Gemini call.")
+                # Not stored under this image's exact key: a near match is a guess, and caching
+                # it would pin a possibly wrong result to these bytes for the whole TTL
+                return near_data
+        except Exception as e:
+            print(f"Warning: Near-duplicate lookup failed, continuing without it: {e}")
+            image_hash = None
+
+    if not backend.is_available():
+         print(f"Error: OCR backend '{backend.name}' is not configured. Cannot run OCR.")
+         # Return None to indicate a configuration failure upstream
+         # Or potentially raise an Exception
+         return None
+
+    def store_result(data):
+        # Only cache non-empty results so a bad parse isn't pinned for the TTL
+        if cache is not None and data:
+            try:
+                cache.put(cache_key, data)
+                if similarity_index is not None and image_hash is not None:
+                    similarity_index.add(image_hash, cache_key, image_aspect)
+            except Exception as e:
+                print(f"Warning: Failed to store OCR result in cache: {e}")
+
+    # Long screenshots / full-page exports: several smaller calls in parallel beat one huge one
+    if tiling:
+        tiled_data = _run_tiled_ocr(image_data, max_retries, retry_delay, on_rows, slot_grid)
+        if tiled_data is not None:
+            store_result(tiled_data)
+            return tiled_data
+
+    # Shrink the upload (orient, crop, downscale, grayscale, re-encode) before sending it
+    upload_data, upload_mime_type, preprocess_info = preprocess_image(image_data, mime_type)
+    if preprocess_info['applied']:
+        print(f"Preprocessed image: {preprocess_info['input_bytes']} -> {preprocess_info['output_bytes']} bytes "
+              f"in {preprocess_info['total_ms']} ms {preprocess_info['stages_ms']}")
+
     # --- Generation and Retry Logic ---
+    rate_limiter = get_rate_limiter()
+    breaker = get_circuit_breaker()
     for attempt in range(max_retries):
+        # Fail fast while Gemini is known to be overloaded instead of piling on more requests
+        if not breaker.allow():
+            print(f"Gemini circuit breaker is open; not calling the API for another {breaker.retry_after():.0f}s.")
+            return None
+        if backend.uses_quota and not rate_limiter.acquire():
+            print("Timed out waiting for a Gemini rate limit slot. Giving up.")
+            breaker.record_neutral()
+            return None
+
+        overloaded = False
         try:
             print(f"Attempt {attempt + 1}: Sending request to Gemini API...")
             # Add safety settings if needed
@@ -218,52 +623,87 @@ Example Output Format (Strict JSON):
             #     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
             # ]
             # response = model.generate_content(contents, safety_settings=safety_settings)
-            response = model.generate_content(contents)
+            streamed_rows = []
+            if on_rows is not None and OCR_STREAMING_ENABLED:
+                response_text, streamed_rows = _generate_streaming(backend, upload_data, upload_mime_type, on_rows,
+                                                                   index)
+            else:
+                response_text = backend.generate(OCR_PROMPT_PART, upload_data, upload_mime_type,
+                                                 OCR_GENERATION_CONFIG)
 
             print(f"Attempt {attempt + 1}: Received response from Gemini API.")
-            # print(f"Raw Gemini Response Text (Attempt {attempt + 1}):\n---\n{response.text}\n---") # Debug Raw Response
-
-            # Process the response using the updated JSON parser
-            extracted_data = process_gemini_response(response.text)
+            breaker.record_success()
+            if backend.uses_quota:
+                # Offline backends (e.g. replay) say nothing about Gemini's limits
+                rate_limiter.on_success()
+            # print(f"Raw Gemini Response Text (Attempt {attempt + 1}):\n---\n{response_text}\n---") # Debug Raw Response
+
+            if not (response_text or "").strip():
+                # Nothing to salvage: the only parse outcome worth paying for another call.
+                # Counted here because it never reaches process_gemini_response.
+                with _parse_stats_lock:
+                    _parse_stats['empty'] += 1
+                raise ValueError("Model returned an empty response")
+
+            # Process the response using the tolerant JSON parser (partial results are kept)
+            extracted_data = process_gemini_response(response_text, index)
+            if len(streamed_rows) > len(extracted_data):
+                # The full text didn't parse (e.g. truncated), but complete objects did stream in
+                extracted_data = streamed_rows
             print(f"Attempt {attempt + 1}: Processed Data: {extracted_data}")
 
+            store_result(extracted_data)
+
             # Return the result (could be an empty list if parsing failed or no data found)
             return extracted_data
 
         # --- Specific Exception Handling ---
-        except genai.types.generation_types.SafetyError as e:
-            print(f"Attempt {attempt + 1} failed: Response blocked due to safety reasons: {e}")
-            # Consider logging e.feedback for details
-            return None  # Indicate safety block failure
-
-        except genai.types.generation_types.StopCandidateException as e:
-             print(f"Attempt {attempt + 1} failed: Generation stopped unexpectedly: {e}")
-             return None # Indicate unexpected stop
+        except OcrBlockedError as e:
+            # Safety block or unexpected stop: retrying the same image won't help
+            breaker.record_neutral()
+            print(f"Attempt {attempt + 1} failed: {e}")
+            return None
 
         except Exception as e:
             error_message = str(e).lower()
             # Check for common transient errors or specific API errors
             if "503" in error_message or "service unavailable" in error_message:
                 print(f"Attempt {attempt + 1} failed with a service unavailable error: {e}")
+                overloaded = True
             elif "timed out" in error_message or "deadline exceeded" in error_message:
                 print(f"Attempt {attempt + 1} timed out.")
             elif "api key not valid" in error_message:
                  print(f"Attempt {attempt + 1} failed: Invalid API Key. Check configuration.")
+                 breaker.record_neutral()
                  return None # Don't retry on invalid key
-            elif "resource has been exhausted" in error_message or "quota exceeded" in error_message:
-                 print(f"Attempt {attempt + 1} failed: Quota Exceeded. {e}")
-                 return None # Don't retry on quota issues
+            elif ("429" in error_message or "resource has been exhausted" in error_message
+                  or "quota exceeded" in error_message):
+                 # Usually a per-minute limit: slow everyone down and retry after backing off
+                 print(f"Attempt {attempt + 1} failed: Quota Exceeded / rate limited. {e}")
+                 overloaded = True
             elif "user location is not supported" in error_message:
                  print(f"Attempt {attempt + 1} failed: User location not supported for this API. {e}")
+                 breaker.record_neutral()
                  return None # Don't retry region errors
             else:
                 # Catch other potential API errors or unexpected issues
                 print(f"Attempt {attempt + 1} failed with an unexpected error: {type(e).__name__}: {e}")
 
+            if overloaded:
+                breaker.record_failure()
+                if backend.uses_quota:
+                    rate_limiter.on_throttle()
+            else:
+                breaker.record_neutral()
+
             # Retry logic
             if attempt < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                if retry_delay is None:
+                    delay = backoff_delay(attempt)
+                else:
+                    delay = backoff_delay(attempt, base=retry_delay)
+                print(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
             else:
                 print(f"Max retries ({max_retries}) reached. Giving up.")
                 return None # Indicate final failure after retries
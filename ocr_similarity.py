@@ -0,0 +1,250 @@
+import os
+import io
+import time
+import sqlite3
+import threading
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from ocr_cache import OCR_CACHE_PATH
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+# Near-duplicate index lives next to the OCR cache (same SQLite file, separate table).
+OCR_SIMILARITY_PATH = os.getenv("OCR_SIMILARITY_PATH", OCR_CACHE_PATH)
+# Maximum Hamming distance (out of 64 bits) for two images to count as the same timetable.
+OCR_SIMILARITY_MAX_DISTANCE = int(os.getenv("OCR_SIMILARITY_MAX_DISTANCE", "6"))
+# Largest relative difference in aspect ratio between matching images (the hash ignores it).
+OCR_SIMILARITY_MAX_ASPECT_DIFF = float(os.getenv("OCR_SIMILARITY_MAX_ASPECT_DIFF", "0.02"))
+# Off by default: an 8x8 dHash can't tell apart different students' timetables with the same
+# layout (they hash a few bits apart), so a near match may be someone else's timetable. Only
+# enable it where uploads are known to be re-saves of the same images. Set OCR_SIMILARITY_ENABLED=1 to use it.
+OCR_SIMILARITY_ENABLED = os.getenv("OCR_SIMILARITY_ENABLED", "0") not in ("0", "false", "False", "")
+
+HASH_BITS = 64
+
+
+def compute_image_signature(image_data, hash_size=8):
+    """
+    Computes a 64-bit difference hash (dHash) of the image bytes and the
+    image's aspect ratio (width / height, after EXIF orientation).
+
+    The image is auto-oriented, flattened to grayscale and shrunk to
+    (hash_size + 1) x hash_size; each bit records whether a pixel is brighter
+    than its right-hand neighbour. Re-encodes and resizes of the same
+    screenshot land within a few bits of each other. The shrink discards the
+    aspect ratio, so it is returned for matches to be checked against.
+    """
+    with Image.open(io.BytesIO(image_data)) as img:
+        img = ImageOps.exif_transpose(img)
+        aspect = img.width / img.height
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+        pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value, aspect
+
+
+def compute_dhash(image_data, hash_size=8):
+    """Computes the 64-bit difference hash of the image bytes (see compute_image_signature)."""
+    return compute_image_signature(image_data, hash_size)[0]
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two integer hashes."""
+    return bin(a ^ b).count("1")
+
+
+class _BKTree:
+    """
+    Burkhard-Keller tree over integer hashes using Hamming distance.
+
+    Radius queries only descend into children whose edge distance lies within
+    [d - radius, d + radius], so lookups touch a small fraction of the nodes
+    even with tens of thousands of entries.
+    """
+
+    def __init__(self):
+        self._root = None  # [hash, {distance: child_node}, set_of_values]
+        self.size = 0
+
+    def add(self, hash_value, value):
+        if self._root is None:
+            self._root = [hash_value, {}, {value}]
+            self.size += 1
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                if value not in node[2]:
+                    node[2].add(value)
+                    self.size += 1
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [hash_value, {}, {value}]
+                self.size += 1
+                return
+            node = child
+
+    def discard(self, hash_value, value):
+        """Removes value from the node for hash_value (the node itself stays as a routing point)."""
+        node = self._root
+        while node is not None:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                if value in node[2]:
+                    node[2].discard(value)
+                    self.size -= 1
+                return
+            node = node[1].get(distance)
+
+    def search(self, hash_value, radius):
+        """Returns [(distance, value), ...] for every entry within radius, nearest first."""
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node_hash, children, values = stack.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= radius:
+                matches.extend((distance, v) for v in values)
+            low, high = distance - radius, distance + radius
+            for edge, child in children.items():
+                if low <= edge <= high:
+                    stack.append(child)
+        matches.sort(key=lambda m: m[0])
+        return matches
+
+
+class ImageSimilarityIndex:
+    """
+    Persistent perceptual-hash index mapping previously OCR'd images to their
+    OCR cache keys.
+
+    Rows are stored in SQLite and mirrored into an in-memory BK-tree on first
+    use, so lookups stay sub-millisecond for large indexes. The index only
+    stores keys; the OCR results themselves stay in the OCR cache.
+    """
+
+    def __init__(self, path=OCR_SIMILARITY_PATH, max_distance=OCR_SIMILARITY_MAX_DISTANCE,
+                 max_aspect_diff=OCR_SIMILARITY_MAX_ASPECT_DIFF):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_aspect_diff = max_aspect_diff
+        self._lock = threading.Lock()
+        self._tree = _BKTree()
+        self._aspects = {}  # cache_key -> aspect ratio (None when it wasn't given)
+        self.lookups = 0
+        self.near_hits = 0
+        self.stale = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS image_hashes (
+                   cache_key  TEXT PRIMARY KEY,
+                   dhash      TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   aspect     REAL
+               )"""
+        )
+        self._conn.commit()
+        # SQLite integers are signed 64-bit, so hashes are stored as hex text.
+        for cache_key, dhash_hex, aspect in self._conn.execute("SELECT cache_key, dhash, aspect FROM image_hashes"):
+            self._tree.add(int(dhash_hex, 16), cache_key)
+            self._aspects[cache_key] = aspect
+
+    def find(self, hash_value, key_suffix="", aspect=None):
+        """
+        Returns [(distance, cache_key), ...] within max_distance, nearest first.
+        key_suffix restricts matches to keys produced by the current model/prompt;
+        with aspect, only images of (nearly) the same aspect ratio match.
+        """
+        with self._lock:
+            self.lookups += 1
+            matches = self._tree.search(hash_value, self.max_distance)
+            aspects = {k: self._aspects.get(k) for _, k in matches}
+        if aspect is not None:
+            # Images of a different shape can shrink to the same 9x8 thumbnail
+            matches = [(d, k) for d, k in matches
+                       if aspects[k] is not None and abs(aspects[k] - aspect) <= self.max_aspect_diff * aspect]
+        return [(d, k) for d, k in matches if k.endswith(key_suffix)]
+
+    def add(self, hash_value, cache_key, aspect=None):
+        """Records that cache_key holds the OCR result for an image with this hash and aspect ratio."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dhash FROM image_hashes WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is not None:
+                self._tree.discard(int(row[0], 16), cache_key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_hashes (cache_key, dhash, created_at, aspect) VALUES (?, ?, ?, ?)",
+                (cache_key, f"{hash_value:016x}", time.time(), aspect),
+            )
+            self._conn.commit()
+            self._tree.add(hash_value, cache_key)
+            self._aspects[cache_key] = aspect
+
+    def remove(self, cache_key):
+        """Drops a key whose cached result has been evicted."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dhash FROM image_hashes WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                return
+            self._conn.execute("DELETE FROM image_hashes WHERE cache_key = ?", (cache_key,))
+            self._conn.commit()
+            self._tree.discard(int(row[0], 16), cache_key)
+            self._aspects.pop(cache_key, None)
+            self.stale += 1
+
+    def record_hit(self):
+        with self._lock:
+            self.near_hits += 1
+
+    def stats(self):
+        """Returns lookup counters and index size for monitoring."""
+        with self._lock:
+            return {
+                'lookups': self.lookups,
+                'near_hits': self.near_hits,
+                'stale_removed': self.stale,
+                'entries': self._tree.size,
+                'max_distance': self.max_distance,
+                'max_aspect_diff': self.max_aspect_diff,
+            }
+
+
+# --- Shared Instance ---
+_index_instance = None
+_index_instance_lock = threading.Lock()
+
+
+def get_similarity_index():
+    """Returns the process-wide index, creating it on first use (None when disabled or unavailable)."""
+    global _index_instance
+    if not OCR_SIMILARITY_ENABLED:
+        return None
+    if _index_instance is None:
+        with _index_instance_lock:
+            if _index_instance is None:
+                try:
+                    _index_instance = ImageSimilarityIndex()
+                except Exception as e:
+                    print(f"Warning: Could not open image similarity index at '{OCR_SIMILARITY_PATH}': {e}")
+                    return None
+    return _index_instance
@@ -0,0 +1,76 @@
+"""
+Microbenchmark for process_gemini_response's parser.
+
+Compares parse_gemini_response against a bare json.loads on clean model
+output (the fast path should cost no more than json.loads plus row
+normalization), and times the recovery paths on typical malformed responses.
+
+Usage:
+    python parser_benchmark.py [--courses 20] [--repeat 2000]
+"""
+import sys
+import json
+import timeit
+import argparse
+
+from ocr_script import parse_gemini_response, normalize_course_item
+
+
+def sample_response(courses):
+    rows = [{"course_code": f"CSE{1000 + i}", "course_name": f"Course {i}", "faculty_name": f"Dr. Faculty {i}",
+             "venue": f"SJT-{100 + i}", "slots": ["A11", "TA11"]} for i in range(courses)]
+    return json.dumps(rows, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Gemini response parser.")
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    clean = sample_response(args.courses)
+    cases = {
+        'clean': clean,
+        'fenced + prose': f"Here is the schedule:\n```json\n{clean}\n```\nLet me know if you need more.",
+        'trailing commas': clean.replace("}\n]", "},\n]"),
+        'truncated': clean[: int(len(clean) * 0.7)],
+    }
+
+    def per_call_us(func):
+        # Best of several runs, so a scheduler hiccup in one run can't fail the check
+        return min(timeit.repeat(func, number=args.repeat, repeat=5)) / args.repeat * 1e6
+
+    def baseline():
+        # What the original parser did for clean input: json.loads + normalization
+        return [normalize_course_item(item) for item in json.loads(clean)]
+
+    baseline_us = per_call_us(baseline)
+    loads_us = per_call_us(lambda: json.loads(clean))
+    print(f"{args.courses} courses, {len(clean)} chars, best of 5 x {args.repeat} runs each")
+    print(f"  {'json.loads only':<22}{loads_us:9.1f} us")
+    print(f"  {'json.loads + normalize':<22}{baseline_us:9.1f} us")
+
+    for name, text in cases.items():
+        rows, report = parse_gemini_response(text)
+        elapsed_us = per_call_us(lambda: parse_gemini_response(text))
+        print(f"  {name:<22}{elapsed_us:9.1f} us  ({len(rows)} rows, mode={report['mode']}, "
+              f"{elapsed_us / baseline_us:.2f}x baseline)")
+
+    # The pass/fail check alternates the two measurements, so both see the same machine load,
+    # and compares the best run of each
+    baseline_runs, clean_runs = [], []
+    for _ in range(7):
+        baseline_runs.append(timeit.timeit(baseline, number=args.repeat))
+        clean_runs.append(timeit.timeit(lambda: parse_gemini_response(clean), number=args.repeat))
+    baseline_us = min(baseline_runs) / args.repeat * 1e6
+    clean_us = min(clean_runs) / args.repeat * 1e6
+    # Allow for timing noise; the fast path should not be measurably slower
+    if clean_us > baseline_us * 1.25:
+        print(f"\nFAIL: clean-input parse is {clean_us / baseline_us:.2f}x the json.loads baseline")
+        return 1
+    print("\nOK: clean-input parsing is as fast as json.loads + normalization")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
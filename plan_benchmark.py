@@ -0,0 +1,58 @@
+"""
+Microbenchmark for event planning, the API-free half of create_calendar_events.
+
+Times plan_calendar_events on a synthetic schedule, a cached get_event_plan
+hit (a dry run followed by the confirmed run), and the cost estimate.
+
+Usage:
+    python plan_benchmark.py [--courses 20] [--repeat 2000]
+"""
+import io
+import sys
+import random
+import timeit
+import argparse
+import contextlib
+
+from ocr_script import slot_table
+from google_calendar_utils import plan_calendar_events, get_event_plan, estimate_plan_cost, parse_date_range
+
+
+def sample_schedule(courses):
+    codes = sorted(slot_table.codes)
+    rng = random.Random(0)
+    return [{"course_code": f"CSE{1000 + i}", "course_name": f"Course {i}", "faculty_name": f"Dr. Faculty {i}",
+             "venue": f"SJT{100 + i}", "slots": " ".join(rng.sample(codes, 3))} for i in range(courses)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark event planning: fresh, cached, and cost estimate.")
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    schedule = sample_schedule(args.courses)
+    start_date, end_date = parse_date_range("2025-01-06", "2025-05-09")
+
+    with contextlib.redirect_stdout(io.StringIO()):  # The planner logs each coalesced course
+        plan = plan_calendar_events(schedule, slot_table, start_date, end_date)
+        if get_event_plan(schedule, slot_table, start_date, end_date) != plan:
+            print("FAIL: cached plan differs from a fresh one", file=sys.stderr)
+            return 1
+        timings = [
+            ("plan (fresh)", lambda: plan_calendar_events(schedule, slot_table, start_date, end_date)),
+            ("plan (cached)", lambda: get_event_plan(schedule, slot_table, start_date, end_date)),
+            ("cost estimate", lambda: estimate_plan_cost(plan)),
+        ]
+        results = [(name, min(timeit.repeat(func, number=args.repeat, repeat=3)) / args.repeat)
+                   for name, func in timings]
+
+    print(f"{args.courses}-course schedule: {len(plan.events)} events, {plan.slot_count} slots, "
+          f"~{estimate_plan_cost(plan)['api_calls']} API calls to execute")
+    for name, seconds in results:
+        print(f"  {name:<16}{seconds * 1e6:9.1f} us")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Microbenchmark for slot lookups during event creation.
+
+Compares the original per-slot scan (every day of time_slots, then re-deriving
+weekday, RRULE day and ISO time strings) with the compiled SlotTable lookup,
+over a synthetic schedule of many courses.
+
+Usage:
+    python slot_benchmark.py [--courses 500] [--repeat 20]
+"""
+import sys
+import random
+import timeit
+import argparse
+
+from ocr_script import time_slots, slot_table
+from slot_table import DAY_TO_WEEKDAY, DAY_TO_RRULE
+
+
+def scan_lookup(slot_codes):
+    """The lookup create_calendar_events used to do for each slot."""
+    found = []
+    for slot_code in slot_codes:
+        for day, day_slots in time_slots.items():
+            if slot_code in day_slots:
+                slot_info = day_slots[slot_code]
+                found.append((DAY_TO_WEEKDAY[day], DAY_TO_RRULE[day],
+                              f"{slot_info['start']}:00", f"{slot_info['end']}:00"))
+                break
+    return found
+
+
+def table_lookup(slot_codes):
+    found = []
+    for slot_code in slot_codes:
+        slot_info = slot_table.get(slot_code)
+        if slot_info is not None:
+            found.append((slot_info.weekday, slot_info.rrule_day, slot_info.start_time, slot_info.end_time))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark slot lookups: per-day scan vs. compiled table.")
+    parser.add_argument("--courses", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    codes = sorted(slot_table.codes)
+    rng = random.Random(0)
+    # Mostly valid slots, a few unknown ones (which force the scan to check every day)
+    slot_codes = [rng.choice(codes) if rng.random() < 0.95 else "X99"
+                  for _ in range(args.courses) for _ in range(4)]
+    if scan_lookup(slot_codes) != table_lookup(slot_codes):
+        print("FAIL: compiled table disagrees with the day-by-day scan")
+        return 1
+
+    scan_s = min(timeit.repeat(lambda: scan_lookup(slot_codes), number=1, repeat=args.repeat))
+    table_s = min(timeit.repeat(lambda: table_lookup(slot_codes), number=1, repeat=args.repeat))
+    print(f"{len(slot_codes)} slot lookups ({args.courses} courses), best of {args.repeat}")
+    print(f"  {'per-day scan':<16}{scan_s * 1000:9.2f} ms")
+    print(f"  {'compiled table':<16}{table_s * 1000:9.2f} ms  ({scan_s / table_s:.1f}x faster)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
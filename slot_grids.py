@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+from slot_table import compile_slot_table, DAY_TO_WEEKDAY
+from slot_validation import SlotIndex
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Configuration ---
+SLOT_GRIDS_DIR = os.getenv("SLOT_GRIDS_DIR", "timetables")
+# How often (seconds) the directory is checked for new or changed grid files.
+SLOT_GRIDS_CHECK_SECONDS = float(os.getenv("SLOT_GRIDS_CHECK_SECONDS", "5"))
+BUILTIN_GRID_KEY = "default/default"
+# Grid used when a request doesn't pick one.
+DEFAULT_SLOT_GRID = os.getenv("DEFAULT_SLOT_GRID", BUILTIN_GRID_KEY)
+
+
+class SlotGrid:
+    """One loaded timetable: the raw mapping plus its compiled lookup structures."""
+
+    def __init__(self, key, time_slots, version, label=None, source=None):
+        self.key = key
+        self.campus, _, self.semester = key.partition("/")
+        self.label = label or key
+        self.version = version
+        self.source = source
+        self.time_slots = time_slots
+        self.table = compile_slot_table(time_slots)
+        self.index = SlotIndex(self.table.codes)
+        self.loaded_at = time.time()
+
+    def describe(self):
+        return {'key': self.key, 'label': self.label, 'version': self.version, 'slots': len(self.table),
+                'source': self.source, 'loaded_at': self.loaded_at}
+
+
+def _validate_time_slots(time_slots):
+    """Raises ValueError unless time_slots looks like {day: {slot: {start, end}}}."""
+    if not isinstance(time_slots, dict) or not time_slots:
+        raise ValueError("time_slots must be a non-empty object")
+    for day, day_slots in time_slots.items():
+        if day not in DAY_TO_WEEKDAY:
+            raise ValueError(f"unknown day '{day}'")
+        if not isinstance(day_slots, dict):
+            raise ValueError(f"slots for {day} must be an object")
+        for code, times in day_slots.items():
+            for field in ("start", "end"):
+                value = times.get(field) if isinstance(times, dict) else None
+                try:
+                    hours, minutes = str(value).split(":")
+                    valid = 0 <= int(hours) < 24 and 0 <= int(minutes) < 60 and len(minutes) == 2
+                except ValueError:
+                    valid = False
+                if not valid:
+                    raise ValueError(f"{day} slot {code}: '{field}' must be HH:MM, got {value!r}")
+
+
+def _load_grid_file(key, path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    data = json.loads(raw)
+    label = None
+    if isinstance(data, dict) and isinstance(data.get("time_slots"), dict):
+        label = data.get("label")
+        data = data["time_slots"]
+    _validate_time_slots(data)
+    return SlotGrid(key, data, version=hashlib.sha256(raw).hexdigest()[:12], label=label, source=path)
+
+
+class SlotGridRegistry:
+    """
+    Registry of slot timetables ("grids") per campus and semester.
+
+    Grids are JSON files under SLOT_GRIDS_DIR, one per campus/semester:
+
+        timetables/<campus>/<semester>.json
+
+    holding either a time_slots mapping ({day: {slot: {"start": "HH:MM", "end": "HH:MM"}}})
+    or {"label": "...", "time_slots": {...}}. A grid is addressed by "<campus>/<semester>".
+    The built-in ocr_script.time_slots is always available as "default/default"
+    (a file with that name replaces it).
+
+    Each file is parsed once into a SlotTable and SlotIndex. Files are re-checked
+    at most every SLOT_GRIDS_CHECK_SECONDS; a changed file is parsed off to the
+    side and swapped in with a single reference assignment, so requests already
+    holding the old grid finish with it and readers never wait on a lock. A file
+    that fails to parse leaves the previously loaded version in place.
+    """
+
+    def __init__(self, directory=SLOT_GRIDS_DIR, builtin=None, check_seconds=SLOT_GRIDS_CHECK_SECONDS):
+        self.directory = directory
+        self.check_seconds = check_seconds
+        self._builtin = (SlotGrid(BUILTIN_GRID_KEY, builtin, version="builtin", label="Default timetable")
+                         if builtin else None)
+        self._grids = {}  # Replaced wholesale on reload, never mutated in place
+        self._file_state = {}  # key -> (mtime_ns, size) of the loaded file
+        self._refresh_lock = threading.Lock()
+        self._last_check = 0.0
+        self.reloads = 0
+        self.failures = 0
+        self._refresh()
+
+    def _scan(self):
+        """Returns {key: path} for every grid file currently on disk."""
+        found = {}
+        if not os.path.isdir(self.directory):
+            return found
+        for campus in sorted(os.listdir(self.directory)):
+            campus_dir = os.path.join(self.directory, campus)
+            if not os.path.isdir(campus_dir):
+                continue
+            for name in sorted(os.listdir(campus_dir)):
+                if name.endswith(".json"):
+                    found[f"{campus}/{name[:-5]}"] = os.path.join(campus_dir, name)
+        return found
+
+    def _refresh(self):
+        # Only one thread reloads; everyone else keeps using the current grids
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_check = time.monotonic()
+            grids = dict(self._grids)
+            changed = False
+            on_disk = self._scan()
+            for key in list(grids):
+                if key not in on_disk and key != BUILTIN_GRID_KEY:
+                    print(f"Slot grid '{key}' was removed.")
+                    del grids[key]
+                    self._file_state.pop(key, None)
+                    changed = True
+            for key, path in on_disk.items():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                state = (stat.st_mtime_ns, stat.st_size)
+                if self._file_state.get(key) == state:
+                    continue
+                self._file_state[key] = state
+                try:
+                    grids[key] = _load_grid_file(key, path)
+                except (OSError, ValueError) as e:
+                    # Keep serving the last good version (if any)
+                    self.failures += 1
+                    print(f"Warning: Could not load slot grid '{path}': {e}")
+                    continue
+                self.reloads += 1
+                changed = True
+                print(f"Loaded slot grid '{key}' (version {grids[key].version}, {len(grids[key].table)} slots).")
+            if self._builtin is not None and BUILTIN_GRID_KEY not in on_disk:
+                changed = changed or grids.get(BUILTIN_GRID_KEY) is not self._builtin
+                grids[BUILTIN_GRID_KEY] = self._builtin
+            if changed:
+                self._grids = grids
+        finally:
+            self._refresh_lock.release()
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._last_check >= self.check_seconds:
+            self._refresh()
+
+    def get(self, key=None):
+        """Returns the SlotGrid for "<campus>/<semester>" (default: DEFAULT_SLOT_GRID), or None."""
+        self._maybe_refresh()
+        return self._grids.get(key or DEFAULT_SLOT_GRID)
+
+    def available(self):
+        """[(key, label)] of every loaded grid, sorted by key."""
+        self._maybe_refresh()
+        return [(key, grid.label) for key, grid in sorted(self._grids.items())]
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'default': DEFAULT_SLOT_GRID,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'grids': [grid.describe() for _, grid in sorted(self._grids.items())],
+        }
+
+
+# --- Shared Instance ---
+_registry_instance = None
+_registry_instance_lock = threading.Lock()
+
+
+def get_slot_grid_registry():
+    """Returns the process-wide registry, seeded with the built-in ocr_script.time_slots."""
+    global _registry_instance
+    if _registry_instance is None:
+        with _registry_instance_lock:
+            if _registry_instance is None:
+                from ocr_script import time_slots
+                _registry_instance = SlotGridRegistry(builtin=time_slots)
+    return _registry_instance
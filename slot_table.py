@@ -0,0 +1,59 @@
+from collections import namedtuple
+from types import MappingProxyType
+
+# Define the mapping from day names to weekday numbers (Monday=0)
+DAY_TO_WEEKDAY = {
+    "Monday": 0, "Tuesday": 1, "Wednesday": 2,
+    "Thursday": 3, "Friday": 4, "Saturday": 5, "Sunday": 6
+}
+# Define the RRULE day mapping for Google Calendar
+DAY_TO_RRULE = {
+    "Monday": "MO", "Tuesday": "TU", "Wednesday": "WE",
+    "Thursday": "TH", "Friday": "FR", "Saturday": "SA", "Sunday": "SU"
+}
+
+# Everything event creation needs for one slot, derived once.
+# start/end are "HH:MM"; start_time/end_time are the "HH:MM:SS" used in ISO datetimes.
+SlotTime = namedtuple("SlotTime", "code day weekday rrule_day start end start_time end_time")
+
+
+class SlotTable:
+    """
+    Immutable, compiled form of a time_slots mapping ({day: {slot: {start, end}}}):
+    each slot code maps straight to its SlotTime, so lookups are a single dict
+    access instead of a scan over every day. If a code appears under several
+    days, the first day wins, matching the old day-by-day scan.
+    """
+
+    __slots__ = ("_entries", "codes")
+
+    def __init__(self, time_slots):
+        entries = {}
+        for day, day_slots in time_slots.items():
+            weekday, rrule_day = DAY_TO_WEEKDAY[day], DAY_TO_RRULE[day]
+            for code, times in day_slots.items():
+                if code not in entries:
+                    entries[code] = SlotTime(code, day, weekday, rrule_day, times["start"], times["end"],
+                                             f"{times['start']}:00", f"{times['end']}:00")
+        self._entries = MappingProxyType(entries)
+        self.codes = frozenset(entries)
+
+    def get(self, code):
+        """Returns the SlotTime for a slot code, or None if it isn't in the timetable."""
+        return self._entries.get(code)
+
+    def __contains__(self, code):
+        return code in self._entries
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def compile_slot_table(time_slots):
+    """Builds a SlotTable; passes an already compiled table through unchanged."""
+    if isinstance(time_slots, SlotTable):
+        return time_slots
+    return SlotTable(time_slots)
@@ -0,0 +1,156 @@
+import re
+import threading
+
+# Characters OCR commonly confuses, by what the slot code needs at that position.
+# Slot codes are a letter followed by digits (e.g. "A11"), so an "l" where a digit
+# belongs is almost certainly a "1", and a "0" where the letter belongs a "D".
+DIGIT_CONFUSABLES = {"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "|": "1", "!": "1", "J": "1",
+                     "Z": "2", "S": "5", "G": "6", "B": "8"}
+LETTER_CONFUSABLES = {"0": "D", "8": "B", "4": "A", "3": "E", "6": "G", "5": "S", "2": "Z"}
+
+# Confidence assigned to each kind of fix; a row's confidence is its weakest slot's.
+CONFIDENCE_EXACT = 1.0
+CONFIDENCE_CONFUSABLE = 0.9
+CONFIDENCE_JOINED = 0.85
+CONFIDENCE_EDIT = 0.7
+# A token dropped because it (after correction) repeats a slot already in the row.
+CONFIDENCE_DUPLICATE = 0.8
+CONFIDENCE_UNRESOLVED = 0.0
+
+_SEPARATORS = re.compile(r"[\s\-_.:/]+")
+
+_stats_lock = threading.Lock()
+_stats = {'rows': 0, 'slots': 0, 'valid': 0, 'confusable_fixes': 0, 'joined': 0,
+          'edit_fixes': 0, 'duplicates_dropped': 0, 'unresolved': 0}
+
+
+class SlotIndex:
+    """
+    Precomputed index of the valid slot codes (e.g. a SlotTable's codes), used to
+    correct OCR'd slot codes before any Calendar calls are made.
+
+    Besides the exact set, it keeps a position-aware confusable form of every
+    code and a single-deletion neighbourhood (every code with one character
+    removed), so edit-distance-1 candidates are found with a few dict lookups
+    instead of comparing against every slot.
+    """
+
+    def __init__(self, codes):
+        self.valid = set(codes)
+        self._by_confusable = {}
+        self._deletes = {}
+        for code in self.valid:
+            self._by_confusable.setdefault(self._confusable_form(code), set()).add(code)
+            for variant in self._deletions(code):
+                self._deletes.setdefault(variant, set()).add(code)
+
+    @staticmethod
+    def _confusable_form(token):
+        """Maps look-alike characters to what a slot code expects at each position."""
+        if not token:
+            return token
+        head = LETTER_CONFUSABLES.get(token[0], token[0])
+        return head + "".join(DIGIT_CONFUSABLES.get(ch, ch) for ch in token[1:])
+
+    @staticmethod
+    def _deletions(token):
+        return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+    def _edit_candidates(self, token):
+        """Valid codes within one insertion, deletion or substitution of token."""
+        candidates = set()
+        # token has an extra character (e.g. "TA11" -> "A11")
+        for variant in self._deletions(token):
+            if variant in self.valid:
+                candidates.add(variant)
+        # token is missing a character ("A1" -> "A11", "A21", ...)
+        candidates |= self._deletes.get(token, set())
+        # one character substituted ("A17" -> "A11", "A14")
+        for variant in self._deletions(token):
+            for code in self._deletes.get(variant, ()):
+                if len(code) == len(token):
+                    candidates.add(code)
+        return candidates
+
+    def correct(self, token):
+        """
+        Returns (slot_code, confidence, kind) for one raw token. kind is 'valid',
+        'confusable', 'edit' or 'unresolved'; an unresolved token is returned unchanged.
+        """
+        cleaned = _SEPARATORS.sub("", str(token).upper())
+        if cleaned in self.valid:
+            return cleaned, CONFIDENCE_EXACT, 'valid'
+        matches = self._by_confusable.get(self._confusable_form(cleaned), set())
+        if len(matches) == 1:
+            return next(iter(matches)), CONFIDENCE_CONFUSABLE, 'confusable'
+        candidates = set()
+        for form in {cleaned, self._confusable_form(cleaned)}:
+            candidates |= self._edit_candidates(form)
+        if len(candidates) == 1:
+            return next(iter(candidates)), CONFIDENCE_EDIT, 'edit'
+        return cleaned, CONFIDENCE_UNRESOLVED, 'unresolved'
+
+    def validate_row(self, row):
+        """
+        Corrects a normalized course row's slots in place and sets 'confidence'
+        (the lowest slot confidence, 1.0 for rows without slots) and
+        'slot_issues' (what was changed, dropped as a duplicate, or couldn't
+        be resolved).
+        """
+        tokens = list(row.get('slots') or [])
+        slots, issues, counts = [], [], {}
+        confidence = CONFIDENCE_EXACT
+        i = 0
+        while i < len(tokens):
+            raw = tokens[i]
+            code, score, kind = self.correct(raw)
+            # "B2 1" arrives as two tokens; try the pair when one alone isn't a slot
+            if kind != 'valid' and i + 1 < len(tokens):
+                joined_code, _, joined_kind = self.correct(f"{raw}{tokens[i + 1]}")
+                if joined_kind in ('valid', 'confusable') and self.correct(tokens[i + 1])[2] != 'valid':
+                    code, score, kind = joined_code, CONFIDENCE_JOINED, 'joined'
+                    raw = f"{raw} {tokens[i + 1]}"
+                    i += 1
+            i += 1
+            counts[kind] = counts.get(kind, 0) + 1
+            if code in slots and kind != 'unresolved':
+                # Usually a corrected tutorial/lab suffix that duplicates a slot already listed (TA11 -> A11).
+                # Dropping it changes the row, so the row is flagged like any other fix
+                counts['duplicate'] = counts.get('duplicate', 0) + 1
+                issues.append({'raw': raw, 'slot': code, 'fix': 'duplicate'})
+                confidence = min(confidence, score, CONFIDENCE_DUPLICATE)
+                continue
+            if kind != 'valid':
+                issues.append({'raw': raw, 'slot': code if kind != 'unresolved' else None, 'fix': kind})
+            confidence = min(confidence, score)
+            if code in slots:
+                continue
+            slots.append(code)
+        row['slots'] = slots
+        row['confidence'] = confidence
+        row['slot_issues'] = issues
+        _record(len(tokens), counts)
+        return row
+
+    def validate_rows(self, rows):
+        for row in rows:
+            self.validate_row(row)
+        return rows
+
+
+def _record(token_count, counts):
+    with _stats_lock:
+        _stats['rows'] += 1
+        _stats['slots'] += token_count
+        _stats['valid'] += counts.get('valid', 0)
+        _stats['confusable_fixes'] += counts.get('confusable', 0)
+        _stats['joined'] += counts.get('joined', 0)
+        _stats['edit_fixes'] += counts.get('edit', 0)
+        _stats['duplicates_dropped'] += counts.get('duplicate', 0)
+        _stats['unresolved'] += counts.get('unresolved', 0)
+
+
+def slot_validation_stats():
+    """How many OCR'd slot codes were valid, corrected or left unresolved."""
+    with _stats_lock:
+        return dict(_stats)
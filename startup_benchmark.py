@@ -0,0 +1,83 @@
+"""
+Measures how long it takes to import the web app, using `python -X importtime`.
+
+Usage:
+    python startup_benchmark.py                 # report for `import app`
+    python startup_benchmark.py --module ocr_script --top 15
+    python startup_benchmark.py --budget-ms 800 # exit 1 if the import takes longer
+
+The import runs in fresh subprocesses (best of --runs) so module caches from
+this process don't skew the numbers.
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+# Default import-time budget for `import app`; override with --budget-ms or STARTUP_IMPORT_BUDGET_MS.
+STARTUP_IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500"))
+
+# "import time:       self [us] |  cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import(module_name):
+    """Imports module_name in a fresh interpreter; returns {module: (self_us, cumulative_us, depth)}."""
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=project_dir, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        tail = "\n".join(result.stderr.strip().splitlines()[-5:])
+        raise RuntimeError(f"Importing {module_name} failed:\n{tail}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            timings[name] = (int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the Flask app.")
+    parser.add_argument("--module", default="app", help="Module to import (default: app)")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh-interpreter runs; the fastest is reported")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest top-level imports to list")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_IMPORT_BUDGET_MS,
+                        help="Fail (exit 1) if the import takes longer than this")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(max(1, args.runs)):
+        timings = measure_import(args.module)
+        if best is None or timings[args.module][1] < best[args.module][1]:
+            best = timings
+
+    total_ms = best[args.module][1] / 1000
+    print(f"import {args.module}: {total_ms:.1f} ms (best of {args.runs}, budget {args.budget_ms:.0f} ms)")
+
+    # Direct dependencies of the measured module, slowest first
+    deps = [(name, cumulative) for name, (_, cumulative, depth) in best.items() if depth == 1]
+    deps.sort(key=lambda item: item[1], reverse=True)
+    print(f"\nSlowest imports made by {args.module}:")
+    for name, cumulative in deps[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    heavy = [name for name in ("google.generativeai", "googleapiclient.discovery", "google_auth_oauthlib.flow")
+             if name in best]
+    if heavy:
+        print(f"\nNote: heavy Google clients imported at startup: {', '.join(heavy)}")
+
+    if total_ms > args.budget_ms:
+        print(f"\nFAIL: import time {total_ms:.1f} ms exceeds budget of {args.budget_ms:.0f} ms")
+        return 1
+    print("\nOK: within budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())